@@ -9,6 +9,7 @@ from flask_migrate import Migrate
 from app.extensions import db
 from app.models import *
 from app.utils.tasks import initialize_tasks
+from app.utils.jobs import recover_interrupted_jobs
 
 from .routes.blueprints import register_blueprints
 
@@ -27,5 +28,6 @@ def create_app():
 
     with app.app_context():
         initialize_tasks()
+        recover_interrupted_jobs()
 
     return app
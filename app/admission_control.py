@@ -0,0 +1,285 @@
+import re, time, logging, threading
+from contextlib import contextmanager
+
+import app.proxmox as proxmox
+
+# Import the appropiate configuration
+from app.config import Config
+# from app.configUni import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Control de admisión del nodo
+## Antes de encender o clonar VMs se comprueba que el nodo tiene sitio para ellas, en lugar
+## de dejar que la memoria se agote y el host empiece a usar swap o a matar procesos.
+## - Memoria: en cada nodo, la suma de la memoria máxima (maxmem) de las VMs encendidas, más
+##   la de las que se van a encender, no puede superar ADMISSION_MEMORY_LIMIT veces la memoria
+##   del nodo menos ADMISSION_HOST_MEMORY_RESERVE MB para el propio Proxmox.
+## - Almacenamiento: los clones completos copian los discos de la VM base en el almacenamiento
+##   de su nodo; tras crearlos debe quedar libre al menos ADMISSION_MIN_STORAGE_FREE
+##   del almacenamiento.
+## Los encendidos que no caben esperan su turno (hasta un tiempo máximo) y después se
+## rechazan con el motivo; las clonaciones que no caben se rechazan directamente.
+
+MIB = 1024 ** 2
+DISK_KEY_PATTERN = re.compile(r'(ide|sata|scsi|virtio|efidisk|tpmstate)\d+')
+SIZE_UNITS = {'K': 1024, 'M': MIB, 'G': 1024 ** 3, 'T': 1024 ** 4}
+ACTIVE_STATUSES = ('running', 'paused') # Estados en los que una VM ocupa su memoria en el nodo
+
+# Memoria reservada para las VMs admitidas que aún no aparecen encendidas en Proxmox
+_reserved = {} # vmid -> maxmem
+_reserved_lock = threading.Lock()
+
+class AdmissionException(Exception):
+    pass
+
+def is_enabled():
+    """Indica si el control de admisión está activado
+
+    :return: True si Config.PROXMOX.ADMISSION_MEMORY_LIMIT es mayor que 0
+    :rtype: bool
+    """
+    return Config.PROXMOX.ADMISSION_MEMORY_LIMIT > 0
+
+def _format_size(size):
+    return f"{size / 1024 ** 3:.1f} GB"
+
+def get_memory_limit(node=None):
+    """Obtiene la memoria de un nodo que pueden comprometer las VMs encendidas
+
+    :param node: Nombre del nodo (default: el nodo por defecto)
+    :type node: str
+
+    :return: Bytes de memoria disponibles para las VMs
+    :rtype: int
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    :raises ProxmoxError: Si no se pueden obtener los datos del nodo
+    """
+    total = proxmox.get_node_status(node)['memory']['total']
+    return int(total * Config.PROXMOX.ADMISSION_MEMORY_LIMIT) - Config.PROXMOX.ADMISSION_HOST_MEMORY_RESERVE * MIB
+
+def _admit(vm_ids, snapshot, limits):
+    # Debe llamarse con _reserved_lock: calcula y reserva en el mismo paso
+    committed = {}
+    for vm in snapshot.values():
+        if vm.get('status') in ACTIVE_STATUSES:
+            committed[vm.get('node')] = committed.get(vm.get('node'), 0) + vm.get('maxmem', 0)
+    for vmid, maxmem in _reserved.items():
+        vm = snapshot.get(vmid, {})
+        if vm.get('status') not in ACTIVE_STATUSES:
+            committed[vm.get('node')] = committed.get(vm.get('node'), 0) + maxmem
+
+    admitted, reserved, rejected, full_nodes = [], [], [], set()
+    for vm_id in vm_ids:
+        vm_status = snapshot.get(int(vm_id))
+        if (
+            vm_status is None or vm_status.get('status') in ACTIVE_STATUSES
+            or int(vm_id) in _reserved or vm_status.get('node') not in limits
+        ):
+            # Las encendidas (o ya reservadas) ya cuentan, y las que no están en el clúster fallarán al encenderse
+            admitted.append(vm_id)
+            continue
+
+        node = vm_status['node']
+        maxmem = vm_status.get('maxmem', 0)
+        if committed.get(node, 0) + maxmem > limits[node]:
+            rejected.append(vm_id)
+            full_nodes.add(node)
+            continue
+
+        committed[node] = committed.get(node, 0) + maxmem
+        _reserved[int(vm_id)] = maxmem
+        reserved.append(vm_id)
+        admitted.append(vm_id)
+
+    reason = None
+    if rejected:
+        usage = ", ".join(
+            f"{node}: {_format_size(committed.get(node, 0))} de {_format_size(max(0, limits[node]))}"
+            for node in sorted(full_nodes)
+        )
+        reason = (
+            f"No hay memoria suficiente para encender {len(rejected)} VM(s), "
+            f"las VMs encendidas ya comprometen la memoria de su nodo ({usage})"
+        )
+
+    return admitted, reserved, rejected, reason
+
+def _release(vm_ids):
+    with _reserved_lock:
+        for vm_id in vm_ids:
+            _reserved.pop(int(vm_id), None)
+
+def _wait_for_admission(vm_ids, timeout):
+    # Devuelve (admitidas, reservadas por esta llamada, rechazadas, motivo)
+    if not is_enabled() or not vm_ids:
+        return list(vm_ids), [], [], None
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            snapshot = proxmox.get_vms_status_snapshot()
+            nodes = {snapshot[int(vm_id)]['node'] for vm_id in vm_ids if int(vm_id) in snapshot}
+            limits = {node: get_memory_limit(node) for node in nodes}
+        except Exception as e:
+            logger.warning(f"Could not check the node memory, admitting the VMs anyway: {e}")
+            return list(vm_ids), [], [], None
+
+        with _reserved_lock:
+            admitted, reserved, rejected, reason = _admit(vm_ids, snapshot, limits)
+            if not rejected or time.monotonic() >= deadline:
+                break
+
+            # Se espera a que quepan todas; lo reservado en este intento se devuelve
+            for vm_id in reserved:
+                _reserved.pop(int(vm_id), None)
+
+        time.sleep(min(Config.PROXMOX.BOOT_LOAD_CHECK_INTERVAL, max(0, deadline - time.monotonic())))
+
+    if rejected:
+        logger.warning(f"Admission control rejected the start of VMs {rejected}: {reason}")
+
+    return admitted, reserved, rejected, reason
+
+@contextmanager
+def start_admission(vm_ids, timeout=0):
+    """
+    Gestor de contexto que reserva memoria para encender unas VMs y la libera al salir
+
+        with admission_control.start_admission(vm_ids) as (admitted, rejected, reason):
+            proxmox.batch_start_virtual_machines(admitted)
+
+    Si no caben todas, se vuelve a comprobar cada Config.PROXMOX.BOOT_LOAD_CHECK_INTERVAL
+    segundos hasta timeout; pasado ese tiempo se admiten solo las que caben. Al salir
+    del bloque las VMs admitidas ya están encendidas (y cuentan en Proxmox) o han
+    fallado, así que su reserva deja de ser necesaria.
+
+    Si el control de admisión está desactivado o no se pueden consultar los datos
+    del nodo, se admiten todas.
+
+    :param vm_ids: IDs de las VMs a encender
+    :type vm_ids: list[int]
+
+    :param timeout: Segundos máximos de espera a que haya memoria para todas (default: 0)
+    :type timeout: int
+
+    :return: Tupla (VMs admitidas, VMs rechazadas, motivo del rechazo o None)
+    :rtype: tuple[list[int], list[int], str]
+    """
+    admitted, reserved, rejected, reason = _wait_for_admission(vm_ids, timeout)
+    try:
+        yield admitted, rejected, reason
+    finally:
+        _release(reserved)
+
+def parse_size(size):
+    """Convierte un tamaño de Proxmox (p. ej. '32G', '512M') a bytes
+
+    :param size: Tamaño con sufijo K, M, G o T (sin sufijo son bytes)
+    :type size: str
+
+    :return: Bytes
+    :rtype: int
+    """
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([KMGT]?)', size.strip().upper())
+    if not match:
+        return 0
+
+    return int(float(match.group(1)) * SIZE_UNITS.get(match.group(2), 1))
+
+def get_vm_disks(vm_config):
+    """
+    Obtiene el tamaño de los discos de una VM agrupados por almacenamiento
+
+    Los discos se guardan como scsi0, virtio0... con el formato
+    'local-lvm:vm-100-disk-0,size=32G'. Las unidades de CD se ignoran.
+
+    :param vm_config: Configuración de la VM en Proxmox
+    :type vm_config: dict
+
+    :return: Diccionario almacenamiento -> bytes
+    :rtype: dict
+    """
+    disks = {}
+    for key, value in vm_config.items():
+        if not DISK_KEY_PATTERN.fullmatch(key) or 'media=cdrom' in value:
+            continue
+
+        volume, *options = value.split(',')
+        storage = volume.split(':')[0] if ':' in volume else None
+        size = next((parse_size(o[len('size='):]) for o in options if o.startswith('size=')), 0)
+        if storage:
+            disks[storage] = disks.get(storage, 0) + size
+
+    return disks
+
+def check_clone(vmid, number_of_clones, linked=False, placement=None):
+    """
+    Comprueba que los almacenamientos tienen sitio para los clones de una VM
+
+    Un clon completo ocupa lo mismo que los discos de la VM base; un clon enlazado
+    apenas ocupa al crearse, pero igualmente se exige que quede libre
+    Config.PROXMOX.ADMISSION_MIN_STORAGE_FREE de cada almacenamiento. Con placement
+    se comprueban los almacenamientos del nodo de cada clon; los compartidos entre
+    nodos se cuentan una sola vez.
+
+    Si el control de admisión está desactivado o no se pueden consultar los
+    almacenamientos, la clonación se admite.
+
+    :param vmid: ID de la VM a clonar
+    :type vmid: int
+
+    :param number_of_clones: Número de clones a crear
+    :type number_of_clones: int
+
+    :param linked: Se van a crear clones enlazados (default: False)
+    :type linked: bool
+
+    :param placement: Diccionario ID del clon -> {'node', 'storage', ...} de placement.plan_clone_placement
+        (default: None, todos en el nodo de la VM base)
+    :type placement: dict
+
+    :raises AdmissionException: Si algún almacenamiento no tiene sitio para los clones, con el motivo
+    """
+    if not is_enabled():
+        return
+
+    try:
+        disks = get_vm_disks(proxmox.get_vm_config(vmid))
+        clones = list((placement or {}).values()) or [{'node': proxmox.get_vm_node(vmid)}] * number_of_clones
+        node_storages = {
+            node: {storage['storage']: storage for storage in proxmox.get_node_storages(node)}
+            for node in {clone['node'] for clone in clones}
+        }
+    except Exception as e:
+        logger.warning(f"Could not check the cluster storage, cloning anyway: {e}")
+        return
+
+    # Espacio necesario en cada almacenamiento: (nodo, nombre), o solo el nombre si es compartido
+    required = {}
+    for clone in clones:
+        clone_disks = {}
+        for name, size in disks.items():
+            name = clone.get('storage') or name
+            storage = node_storages[clone['node']].get(name)
+            if storage is None or not storage.get('total'):
+                continue
+
+            key = name if storage.get('shared') else (clone['node'], name)
+            clone_disks[key] = (clone_disks.get(key, (0,))[0] + (0 if linked else size), storage)
+
+        for key, (size, storage) in clone_disks.items():
+            needed, _, count = required.get(key, (0, storage, 0))
+            required[key] = (needed + size, storage, count + 1)
+
+    for key, (needed, storage, count) in required.items():
+        label = key if isinstance(key, str) else f"{key[1]}' del nodo '{key[0]}"
+        reserve = int(storage['total'] * Config.PROXMOX.ADMISSION_MIN_STORAGE_FREE)
+        if storage.get('avail', 0) - needed < reserve:
+            raise AdmissionException(
+                f"No hay espacio suficiente en el almacenamiento '{label}' para {count} clon(es): "
+                f"se necesitan {_format_size(needed)} y quedan {_format_size(storage.get('avail', 0))} libres "
+                f"(se reserva un {Config.PROXMOX.ADMISSION_MIN_STORAGE_FREE:.0%} del almacenamiento)"
+            )
@@ -2,11 +2,45 @@ import os
 from datetime import timedelta
 
 class ProxmoxConfig:
-    NODE_NAME = os.getenv('PROXMOX_NODE_NAME', "pve-proxmox")
+    NODE_NAME = os.getenv('PROXMOX_NODE_NAME', "pve-proxmox") # Nodo por defecto, en el que se crean las VMs base
+    CLUSTER_NODES = os.getenv('PROXMOX_CLUSTER_NODES', "") # Nodos del clúster que usa la aplicación separados por comas, vacío para usar todos
+    PLACEMENT_POLICY = os.getenv('PROXMOX_PLACEMENT_POLICY', "local") # Nodo de los clones: "local" (el de la VM base), "least-loaded" o "spread"
+    CLONE_STORAGE = os.getenv('PROXMOX_CLONE_STORAGE', "") # Almacenamiento de los clones completos, vacío para usar el de la VM base
+    MIGRATION_TIMEOUT = int(os.getenv('PROXMOX_MIGRATION_TIMEOUT', 600)) # Segundos máximos para migrar un clon a otro nodo
     HOST = os.getenv('PROXMOX_HOST', '192.168.1.138')
     PORT = os.getenv('PROXMOX_PORT', 8006)
     ROOT_USER = os.getenv('PROXMOX_ROOT_USER','root@pam')
     PASSWORD = os.getenv('PROXMOX_ROOT_PASSWORD', 'password')
+    CLONE_CONCURRENCY = int(os.getenv('PROXMOX_CLONE_CONCURRENCY', 2)) # Clonaciones simultáneas, ajustar según el almacenamiento
+    API_CONCURRENCY = int(os.getenv('PROXMOX_API_CONCURRENCY', 8)) # Peticiones simultáneas del cliente asíncrono
+    INVENTORY_CACHE_TTL = int(os.getenv('PROXMOX_INVENTORY_CACHE_TTL', 10)) # Segundos que se reutiliza la lista de VMs del clúster, 0 para consultarla siempre
+    BOOT_CONCURRENCY = int(os.getenv('PROXMOX_BOOT_CONCURRENCY', 3)) # VMs encendidas a la vez para obtener su IP
+    NODE_BOOT_CONCURRENCY = int(os.getenv('PROXMOX_NODE_BOOT_CONCURRENCY', 6)) # VMs arrancando a la vez al empezar las clases, entre todas las asignaturas
+    BOOT_WAVE_SIZE = int(os.getenv('PROXMOX_BOOT_WAVE_SIZE', 4)) # VMs por oleada al empezar una clase
+    BOOT_MAX_CPU = float(os.getenv('PROXMOX_BOOT_MAX_CPU', 0.85)) # Uso de CPU del nodo (0 - 1) por encima del cual se retrasa la siguiente oleada
+    BOOT_MAX_MEMORY = float(os.getenv('PROXMOX_BOOT_MAX_MEMORY', 0.9)) # Uso de memoria del nodo (0 - 1) por encima del cual se retrasa la siguiente oleada
+    BOOT_LOAD_CHECK_INTERVAL = int(os.getenv('PROXMOX_BOOT_LOAD_CHECK_INTERVAL', 15)) # Segundos entre comprobaciones de la carga del nodo
+    IDLE_ACTION = os.getenv('PROXMOX_IDLE_ACTION', "hibernate") # Qué hacer con los clones inactivos: "hibernate", "stop" o vacío para dejarlos encendidos
+    IDLE_GRACE_PERIOD = int(os.getenv('PROXMOX_IDLE_GRACE_PERIOD', 20)) # Minutos de inactividad antes de poner un clon en reposo
+    IDLE_CPU_THRESHOLD = float(os.getenv('PROXMOX_IDLE_CPU_THRESHOLD', 0.05)) # Uso de CPU (0 - 1) por debajo del cual un clon se considera inactivo
+    IDLE_NETWORK_THRESHOLD = int(os.getenv('PROXMOX_IDLE_NETWORK_THRESHOLD', 2048)) # Bytes/s de red por debajo de los cuales un clon se considera inactivo
+    IDLE_CHECK_INTERVAL = int(os.getenv('PROXMOX_IDLE_CHECK_INTERVAL', 60)) # Segundos entre comprobaciones de inactividad
+    ON_DEMAND_START_CONCURRENCY = int(os.getenv('PROXMOX_ON_DEMAND_START_CONCURRENCY', 3)) # VMs encendidas a la vez al abrir los alumnos un laboratorio, en todo el nodo
+    ON_DEMAND_START_WORKERS = int(os.getenv('PROXMOX_ON_DEMAND_START_WORKERS', 8)) # Hilos por proceso para los encendidos bajo demanda, aparte de JOB_WORKERS; los que superan ON_DEMAND_START_CONCURRENCY esperan turno en ellos
+    ON_DEMAND_START_COOLDOWN = int(os.getenv('PROXMOX_ON_DEMAND_START_COOLDOWN', 60)) # Segundos que debe esperar un alumno entre dos encendidos
+    ON_DEMAND_START_TIMEOUT = int(os.getenv('PROXMOX_ON_DEMAND_START_TIMEOUT', 120)) # Segundos máximos para que arranque la VM
+    ON_DEMAND_VNC_TIMEOUT = int(os.getenv('PROXMOX_ON_DEMAND_VNC_TIMEOUT', 90)) # Segundos máximos para que el servidor VNC acepte conexiones
+    ADMISSION_MEMORY_LIMIT = float(os.getenv('PROXMOX_ADMISSION_MEMORY_LIMIT', 1.0)) # Memoria del nodo (1 = toda, más de 1 permite sobrecomprometer) que pueden ocupar las VMs encendidas, 0 desactiva el control de admisión
+    ADMISSION_HOST_MEMORY_RESERVE = int(os.getenv('PROXMOX_ADMISSION_HOST_MEMORY_RESERVE', 2048)) # MB de memoria del nodo reservados para Proxmox
+    ADMISSION_MIN_STORAGE_FREE = float(os.getenv('PROXMOX_ADMISSION_MIN_STORAGE_FREE', 0.1)) # Parte de cada almacenamiento (0 - 1) que debe quedar libre tras clonar
+    ADMISSION_QUEUE_TIMEOUT = int(os.getenv('PROXMOX_ADMISSION_QUEUE_TIMEOUT', 300)) # Segundos que un encendido espera a que haya memoria antes de rechazarse
+    IP_RESOLVERS = os.getenv('PROXMOX_IP_RESOLVERS', "cloudinit") # Fuentes para obtener la IP sin encender la VM, en orden (cloudinit, static, leases)
+    STATIC_IP_POOL_FILE = os.getenv('PROXMOX_STATIC_IP_POOL_FILE', "/etc/ethers") # Pares "MAC IP" asignados de antemano
+    DHCP_LEASES_FILE = os.getenv('PROXMOX_DHCP_LEASES_FILE', "/var/lib/misc/dnsmasq.leases") # Concesiones de dnsmasq o dhcpd.leases de ISC
+    IP_POOL_SUBNET = os.getenv('PROXMOX_IP_POOL_SUBNET', "") # Red de las IPs fijas asignadas por cloud-init (p. ej. 192.168.1.0/24), vacío para desactivarlo
+    IP_POOL_START = os.getenv('PROXMOX_IP_POOL_START', "") # Primera IP del pool, vacío para empezar por la primera de la red
+    IP_POOL_END = os.getenv('PROXMOX_IP_POOL_END', "") # Última IP del pool, vacío para acabar en la última de la red
+    IP_POOL_GATEWAY = os.getenv('PROXMOX_IP_POOL_GATEWAY', "") # Puerta de enlace de los clones, nunca se asigna
 
 class GuacamoleConfig:
     BASE_URL = os.getenv('GUACAMOLE_HOST', "http://192.168.1.140:8080/guacamole")
@@ -14,7 +48,19 @@ class GuacamoleConfig:
     PASSWORD = os.getenv('GUACAMOLE_PASSWORD', "guacadmin")
     PORT = 3306 # Default port for MySQL
     DATABASE_TYPE = "mysql"
-    DATABASE_NAME = os.getenv('GUACAMOLE_DATABASE', "guacamole-db")
+    DATABASE_NAME = os.getenv('GUACAMOLE_DATABASE', "guacamole_db")
+    DATABASE_HOST = os.getenv('GUACAMOLE_DATABASE_HOST', "192.168.1.140")
+    DATABASE_USER = os.getenv('GUACAMOLE_DATABASE_USER', "guacamole_user")
+    DATABASE_PASSWORD = os.getenv('GUACAMOLE_DATABASE_PASSWORD', "guacamole_password")
+    PROVISIONING_BACKEND = os.getenv('GUACAMOLE_PROVISIONING_BACKEND', "rest") # "rest" o "database" (escribe las conexiones directamente en MySQL)
+    CONNECTION_CONCURRENCY = int(os.getenv('GUACAMOLE_CONNECTION_CONCURRENCY', 4)) # Conexiones creadas a la vez
+    TOKEN_IDLE_TIMEOUT = int(os.getenv('GUACAMOLE_TOKEN_IDLE_TIMEOUT', 3600)) # Segundos, debe coincidir con api-session-timeout de Guacamole
+    CONNECTION_INDEX_TTL = int(os.getenv('GUACAMOLE_CONNECTION_INDEX_TTL', 60)) # Segundos que se reutiliza el índice de conexiones
+    HTTP_POOL_SIZE = int(os.getenv('GUACAMOLE_HTTP_POOL_SIZE', 10)) # Conexiones HTTP reutilizables con Guacamole
+    HTTP_RETRIES = int(os.getenv('GUACAMOLE_HTTP_RETRIES', 3)) # Reintentos ante errores de red o respuestas 502/503/504
+    HTTP_BACKOFF = float(os.getenv('GUACAMOLE_HTTP_BACKOFF', 0.5)) # Factor de espera exponencial entre reintentos
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('GUACAMOLE_HTTP_CONNECT_TIMEOUT', 5)) # Segundos
+    HTTP_READ_TIMEOUT = float(os.getenv('GUACAMOLE_HTTP_READ_TIMEOUT', 30)) # Segundos
 
 class FlaskAppConfig:
     # TODO: Change this to a more secure way of creating the secret key
@@ -26,6 +72,10 @@ class FlaskAppConfig:
 
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', './tmp/uploads')
 
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', 4)) # Hilos por proceso para los trabajos en segundo plano
+    WARM_POOL_CHECK_INTERVAL = int(os.getenv('WARM_POOL_CHECK_INTERVAL', 5)) # Minutos entre comprobaciones de los clones de reserva
+    SCHEDULER_HEARTBEAT_INTERVAL = int(os.getenv('SCHEDULER_HEARTBEAT_INTERVAL', 15)) # Segundos entre comprobaciones del proceso líder del scheduler
+
     SESSION_TYPE = 'filesystem'
     SESSION_FILE_DIR = '/tmp/flask_session' # TODO: Cambiarlo a un ruta más segura / dentro del contenedor
     SESSION_PERMANENT = False
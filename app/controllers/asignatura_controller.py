@@ -42,7 +42,7 @@ def create_asignatura(nombre, profesor_id, descripcion=None):
         db.session.rollback()
         raise SQLAlchemyError(f"Error al crear la asignatura: {e}") from e
 
-def create_asignatura_with_entidades(nombre, profesor_id, descripcion=None, labs_data=None, lista_id_alumnos=None, horarios_data=None):
+def create_asignatura_with_entidades(nombre, profesor_id, descripcion=None, labs_data=None, lista_id_alumnos=None, horarios_data=None, warm_pool_size=0):
     """
     Crea una nueva asignatura en la base de datos con sus entidades asociadas
 
@@ -66,6 +66,9 @@ def create_asignatura_with_entidades(nombre, profesor_id, descripcion=None, labs
     :param horarios_data: Datos de los horarios a crear (default: None)
     :type horarios_data: list[dict]
 
+    :param warm_pool_size: Número de clones de reserva para nuevos alumnos (default: 0)
+    :type warm_pool_size: int
+
     :return: Asignatura creada
     :rtype: Asignatura
 
@@ -73,7 +76,7 @@ def create_asignatura_with_entidades(nombre, profesor_id, descripcion=None, labs
     """
     try:
         with db.session.begin_nested():
-            new_asignatura = Asignatura(nombre, profesor_id, descripcion)
+            new_asignatura = Asignatura(nombre, profesor_id, descripcion, warm_pool_size)
             db.session.add(new_asignatura)
             db.session.flush() # Se hace flush para obtener el ID de la asignatura
 
@@ -148,7 +151,7 @@ def get_asignaturas_without_virtual_machines():
         .all()
     )
 
-def update_asignatura(asignatura_id, nombre, descripcion=None, labs_data=None, lista_id_alumnos=None, horarios_data=None):
+def update_asignatura(asignatura_id, nombre, descripcion=None, labs_data=None, lista_id_alumnos=None, horarios_data=None, warm_pool_size=None):
     """Actualiza los datos de una asignatura y sus entidades asociadas
 
     Las entidades asociadas son laboratorios, matrículas y horarios
@@ -171,6 +174,9 @@ def update_asignatura(asignatura_id, nombre, descripcion=None, labs_data=None, l
     :param horarios_data: Datos de los horarios a actualizar (default: None)
     :type horarios_data: list[dict]
 
+    :param warm_pool_size: Nuevo número de clones de reserva, None para no cambiarlo (default: None)
+    :type warm_pool_size: int
+
     :return: Asignatura actualizada
     :rtype: Asignatura
 
@@ -189,6 +195,8 @@ def update_asignatura(asignatura_id, nombre, descripcion=None, labs_data=None, l
         with db.session.begin_nested():
             asignatura.nombre = nombre
             asignatura.descripcion = descripcion
+            if warm_pool_size is not None:
+                asignatura.warm_pool_size = warm_pool_size
 
             if labs_data:
                 bulk_update_laboratorios(labs_data, asignatura_id, asignatura.profesor_id)
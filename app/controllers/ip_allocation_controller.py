@@ -0,0 +1,189 @@
+import ipaddress
+
+from app.extensions import db
+from app.models.ip_allocation import IpAllocation
+from app.models.virtual_machine import VirtualMachine
+
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+
+# Import the appropiate configuration
+from app.config import Config
+# from app.configUni import Config
+
+ALLOCATION_ATTEMPTS = 3 # Reintentos si otro proceso reserva las mismas IPs a la vez
+
+class IpAllocationException(Exception):
+    pass
+
+def is_pool_enabled():
+    """Indica si hay un pool de IPs fijas configurado
+
+    :return: True si Config.PROXMOX.IP_POOL_SUBNET está definido
+    :rtype: bool
+    """
+    return bool(Config.PROXMOX.IP_POOL_SUBNET)
+
+def get_pool_network():
+    """Obtiene la red del pool de IPs fijas
+
+    :return: La red del pool
+    :rtype: ipaddress.IPv4Network
+
+    :raises IpAllocationException: Si el pool no está configurado o la configuración no es válida
+    """
+    if not is_pool_enabled():
+        raise IpAllocationException("No hay un pool de IPs configurado")
+
+    try:
+        return ipaddress.IPv4Network(Config.PROXMOX.IP_POOL_SUBNET, strict=False)
+    except ValueError as e:
+        raise IpAllocationException(f"La red del pool de IPs no es válida: {e}") from e
+
+def get_pool_addresses():
+    """Obtiene todas las direcciones del pool en orden, sin la puerta de enlace
+
+    :return: Lista de direcciones IPv4
+    :rtype: list[str]
+
+    :raises IpAllocationException: Si el pool no está configurado o la configuración no es válida
+    """
+    network = get_pool_network()
+
+    try:
+        start = ipaddress.IPv4Address(Config.PROXMOX.IP_POOL_START) if Config.PROXMOX.IP_POOL_START else None
+        end = ipaddress.IPv4Address(Config.PROXMOX.IP_POOL_END) if Config.PROXMOX.IP_POOL_END else None
+        gateway = ipaddress.IPv4Address(Config.PROXMOX.IP_POOL_GATEWAY) if Config.PROXMOX.IP_POOL_GATEWAY else None
+    except ValueError as e:
+        raise IpAllocationException(f"El rango del pool de IPs no es válido: {e}") from e
+
+    return [
+        str(host) for host in network.hosts()
+        if (start is None or host >= start) and (end is None or host <= end) and host != gateway
+    ]
+
+def get_ipconfig(ip_address):
+    """Obtiene el valor de ipconfig0 de cloud-init para una IP del pool
+
+    :param ip_address: Dirección IPv4 del pool
+    :type ip_address: str
+
+    :return: Valor de ipconfig0 (p. ej. 'ip=192.168.1.50/24,gw=192.168.1.1')
+    :rtype: str
+
+    :raises IpAllocationException: Si el pool no está configurado o la configuración no es válida
+    """
+    ipconfig = f"ip={ip_address}/{get_pool_network().prefixlen}"
+    if Config.PROXMOX.IP_POOL_GATEWAY:
+        ipconfig += f",gw={Config.PROXMOX.IP_POOL_GATEWAY}"
+
+    return ipconfig
+
+def get_used_addresses():
+    """Obtiene las direcciones reservadas o asignadas a alguna máquina virtual
+
+    :return: Conjunto de direcciones IPv4
+    :rtype: set[str]
+    """
+    reserved = {allocation.ip_address for allocation in IpAllocation.query.all()}
+    assigned = {
+        vm.ip_address for vm in VirtualMachine.query.filter(VirtualMachine.ip_address.isnot(None)).all()
+    }
+    return reserved | assigned
+
+def get_allocations(proxmox_ids):
+    """Obtiene las IPs reservadas para unas máquinas virtuales
+
+    :param proxmox_ids: IDs de las máquinas virtuales
+    :type proxmox_ids: list[int]
+
+    :return: Diccionario proxmox_id -> dirección IPv4 de las que tienen reserva
+    :rtype: dict
+    """
+    allocations = IpAllocation.query.filter(IpAllocation.proxmox_id.in_(list(proxmox_ids))).all()
+    return {allocation.proxmox_id: allocation.ip_address for allocation in allocations}
+
+def get_reserved_ids():
+    """Obtiene los IDs de las máquinas virtuales que tienen una IP reservada
+
+    :return: Conjunto de IDs
+    :rtype: set[int]
+    """
+    return {allocation.proxmox_id for allocation in IpAllocation.query.all()}
+
+def allocate_ip_addresses(proxmox_ids, in_use=()):
+    """Reserva una IP libre del pool para cada máquina virtual
+
+    Una dirección está ocupada si ya está reservada, asignada a otra máquina
+    virtual o aparece en in_use (direcciones detectadas en la red, p. ej. en las
+    concesiones DHCP). Las máquinas virtuales que ya tienen reserva la conservan.
+
+    Si otro proceso reserva alguna de las mismas direcciones a la vez, la
+    restricción de unicidad lo detecta y se vuelve a intentar con las que quedan.
+
+    :param proxmox_ids: IDs de las máquinas virtuales
+    :type proxmox_ids: list[int]
+
+    :param in_use: Direcciones que no se deben asignar (default: ())
+    :type in_use: iterable[str]
+
+    :return: Diccionario proxmox_id -> dirección IPv4 reservada
+    :rtype: dict
+
+    :raises IpAllocationException: Si el pool no está configurado o no quedan suficientes direcciones libres
+    :raises SQLAlchemyError: Si ocurre un error al guardar las reservas
+    """
+    pool = get_pool_addresses()
+    in_use = set(in_use)
+
+    for attempt in range(ALLOCATION_ATTEMPTS):
+        allocated = get_allocations(proxmox_ids)
+        pending = [proxmox_id for proxmox_id in proxmox_ids if proxmox_id not in allocated]
+        if not pending:
+            return allocated
+
+        used = get_used_addresses() | in_use
+        free = [address for address in pool if address not in used]
+        if len(free) < len(pending):
+            raise IpAllocationException(
+                f"No quedan suficientes IPs libres en el pool: se necesitan {len(pending)} y quedan {len(free)}"
+            )
+
+        try:
+            for proxmox_id, address in zip(pending, free):
+                db.session.add(IpAllocation(ip_address=address, proxmox_id=proxmox_id))
+                allocated[proxmox_id] = address
+
+            db.session.commit()
+            return allocated
+
+        except IntegrityError:
+            # Otro proceso ha reservado alguna de las direcciones
+            db.session.rollback()
+
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            raise SQLAlchemyError(f"Error al reservar las IPs: {e}") from e
+
+    raise IpAllocationException(f"No se han podido reservar las IPs tras {ALLOCATION_ATTEMPTS} intentos")
+
+def release_ip_addresses(proxmox_ids):
+    """Libera las IPs reservadas para unas máquinas virtuales
+
+    :param proxmox_ids: IDs de las máquinas virtuales
+    :type proxmox_ids: list[int]
+
+    :return: Número de reservas liberadas
+    :rtype: int
+
+    :raises SQLAlchemyError: Si ocurre un error al borrar las reservas
+    """
+    try:
+        released = IpAllocation.query.filter(
+            IpAllocation.proxmox_id.in_(list(proxmox_ids))
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return released
+
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        raise SQLAlchemyError(f"Error al liberar las IPs: {e}") from e
@@ -0,0 +1,206 @@
+from datetime import datetime
+
+from app.extensions import db
+from app.models.job import Job, JOB_STATUSES
+
+from sqlalchemy.exc import SQLAlchemyError
+
+class JobException(Exception):
+    pass
+
+def create_job(job_type, params=None, user_id=None, worker=None):
+    """Crea un trabajo en estado 'pending'
+
+    :param job_type: Tipo de trabajo
+    :type job_type: str
+
+    :param params: Parámetros del trabajo, serializables a JSON (default: None)
+    :type params: dict
+
+    :param user_id: ID del usuario que lanza el trabajo (default: None)
+    :type user_id: int
+
+    :param worker: Proceso que ejecutará el trabajo (default: None)
+    :type worker: str
+
+    :return: El trabajo creado
+    :rtype: Job
+
+    :raises SQLAlchemyError: Si ocurre un error al crear el trabajo
+    """
+    try:
+        job = Job(job_type=job_type, params=params, user_id=user_id, worker=worker)
+        db.session.add(job)
+        db.session.commit()
+
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        raise SQLAlchemyError(f"Error al crear el trabajo: {e}") from e
+
+    return job
+
+def get_job_by_id(job_id):
+    """Obtiene un trabajo por su ID
+
+    :param job_id: ID del trabajo
+    :type job_id: int
+
+    :return: El trabajo encontrado o None si no existe
+    :rtype: Job
+
+    :raises ValueError: Si job_id no es un entero
+    """
+    if not isinstance(job_id, int):
+        raise ValueError("El ID del trabajo debe ser un entero")
+
+    return Job.query.get(job_id)
+
+def get_job_status(job_id):
+    """Obtiene el estado de un trabajo directamente de la base de datos
+
+    Cierra la sesión tras la consulta para no mantener abierta la transacción,
+    de forma que las peticiones largas (p. ej. los streams de eventos) liberan
+    la conexión y cada llamada lee el estado más reciente.
+
+    :param job_id: ID del trabajo
+    :type job_id: int
+
+    :return: Estado del trabajo o None si no existe
+    :rtype: str
+
+    :raises ValueError: Si job_id no es un entero
+    """
+    if not isinstance(job_id, int):
+        raise ValueError("El ID del trabajo debe ser un entero")
+
+    try:
+        return db.session.query(Job.status).filter_by(id=job_id).scalar()
+    finally:
+        db.session.close()
+
+def get_jobs_by_status(*statuses):
+    """Obtiene los trabajos que se encuentran en alguno de los estados dados
+
+    :param statuses: Estados de los trabajos
+    :type statuses: str
+
+    :return: Lista de trabajos
+    :rtype: list[Job]
+
+    :raises ValueError: Si algún estado no es válido
+    """
+    if any(status not in JOB_STATUSES for status in statuses):
+        raise ValueError(f"Los estados deben ser uno de {JOB_STATUSES}")
+
+    return Job.query.filter(Job.status.in_(statuses)).all()
+
+def get_latest_job(job_type, user_id):
+    """Obtiene el último trabajo de un tipo lanzado por un usuario
+
+    :param job_type: Tipo de trabajo
+    :type job_type: str
+
+    :param user_id: ID del usuario
+    :type user_id: int
+
+    :return: El trabajo más reciente o None si no hay ninguno
+    :rtype: Job
+    """
+    return Job.query.filter_by(job_type=job_type, user_id=user_id).order_by(Job.id.desc()).first()
+
+def count_jobs_ahead(job_id, job_type, *statuses):
+    """Cuenta los trabajos de un tipo, en alguno de los estados dados, creados antes que uno dado
+
+    Como get_job_status, cierra la sesión tras la consulta para que cada llamada
+    lea el estado más reciente.
+
+    :param job_id: ID del trabajo
+    :type job_id: int
+
+    :param job_type: Tipo de trabajo
+    :type job_type: str
+
+    :param statuses: Estados de los trabajos
+    :type statuses: str
+
+    :return: Número de trabajos
+    :rtype: int
+
+    :raises ValueError: Si algún estado no es válido
+    """
+    if any(status not in JOB_STATUSES for status in statuses):
+        raise ValueError(f"Los estados deben ser uno de {JOB_STATUSES}")
+
+    try:
+        return Job.query.filter(
+            Job.job_type == job_type,
+            Job.status.in_(statuses),
+            Job.id < job_id
+        ).count()
+    finally:
+        db.session.close()
+
+def claim_job(job_id, worker):
+    """Marca un trabajo pendiente como 'running' para el proceso dado
+
+    La actualización es condicional (solo si sigue en 'pending'), por lo que si
+    dos procesos intentan ejecutar el mismo trabajo solo uno lo consigue.
+
+    :param job_id: ID del trabajo
+    :type job_id: int
+
+    :param worker: Proceso que ejecuta el trabajo (host:pid)
+    :type worker: str
+
+    :return: True si el trabajo se ha reclamado, False si otro proceso lo hizo antes
+    :rtype: bool
+
+    :raises SQLAlchemyError: Si ocurre un error al actualizar el trabajo
+    """
+    try:
+        claimed = Job.query.filter_by(id=job_id, status='pending').update(
+            {'status': 'running', 'worker': worker, 'started_at': datetime.now()},
+            synchronize_session=False
+        )
+        db.session.commit()
+        return claimed == 1
+
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        raise SQLAlchemyError(f"Error al reclamar el trabajo: {e}") from e
+
+def update_job(job_id, commit=True, **kwargs):
+    """Actualiza un trabajo
+
+    :param job_id: ID del trabajo
+    :type job_id: int
+
+    :param kwargs: Campos a actualizar
+    :type kwargs: dict
+
+    :return: El trabajo actualizado
+    :rtype: Job
+
+    :raises ValueError: Si job_id no es un entero
+    :raises JobException: Si el trabajo no existe
+    :raises SQLAlchemyError: Si ocurre un error al actualizar el trabajo
+    """
+    if not isinstance(job_id, int):
+        raise ValueError("El ID del trabajo debe ser un entero")
+
+    try:
+        job = Job.query.get(job_id)
+        if not job:
+            raise JobException(f"Trabajo con ID {job_id} no encontrado")
+
+        for key, value in kwargs.items():
+            setattr(job, key, value)
+
+        if commit:
+            db.session.commit()
+
+        return job
+
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        raise SQLAlchemyError(f"Error al actualizar el trabajo: {e}") from e
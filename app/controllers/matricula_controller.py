@@ -47,9 +47,26 @@ def __remove_user_from_virtual_machine(asignatura_id, user_id):
         db.session.rollback()
         raise SQLAlchemyError(f"Error al eliminar al usuario de las máquinas virtuales: {e}") from e
 
+def __assign_spare_virtual_machine(asignatura_id, user_id):
+    """Asigna al alumno un clon de reserva de la asignatura, si queda alguno
+
+    No se realiza commit, el llamante debe hacerlo.
+
+    :param asignatura_id: ID de la asignatura
+    :type asignatura_id: int
+
+    :param user_id: ID del alumno
+    :type user_id: int
+    """
+    vm = virtual_machines_controller.assign_spare_virtual_machine(asignatura_id, user_id, commit=False)
+    if vm:
+        logger.info(f"Assigned spare VM {vm.proxmox_id} to user {user_id} in subject {asignatura_id}")
+
 def create_matricula(user_id, asignatura_id):
     """Matricula a un alumno en una asignatura
 
+    Si la asignatura tiene clones de reserva, se asigna uno al alumno.
+
     :param user_id: ID del alumno
     :type user_id: int
 
@@ -74,6 +91,7 @@ def create_matricula(user_id, asignatura_id):
     try:
         matricula = Matricula(user_id=user_id, asignatura_id=asignatura_id)
         db.session.add(matricula)
+        __assign_spare_virtual_machine(asignatura_id, user_id)
         db.session.commit()
         return matricula
     except SQLAlchemyError as e:
@@ -84,6 +102,10 @@ def create_matriculas_for_entity(entity_type: EntityType, entity_id, lista_ids):
     """
     Crea matrículas para una entidad (asignatura o alumno) dada una lista de ID's
 
+    A cada alumno matriculado se le asigna un clon de reserva de la asignatura, si queda alguno.
+
+    NOTA: No se realiza commit en esta función, por lo que el llamante debe hacerlo
+
     :param entity_type: Tipo de entidad
     :type entity_type: EntityType
 
@@ -104,12 +126,14 @@ def create_matriculas_for_entity(entity_type: EntityType, entity_id, lista_ids):
             matricula = Matricula(user_id=user_id, asignatura_id=entity_id)
             db.session.add(matricula)
             matriculas.append(matricula)
+            __assign_spare_virtual_machine(entity_id, user_id)
 
     elif entity_type == EntityType.USUARIO:
         for asignatura_id in lista_ids:
             matricula = Matricula(user_id=entity_id, asignatura_id=asignatura_id)
             db.session.add(matricula)
             matriculas.append(matricula)
+            __assign_spare_virtual_machine(asignatura_id, entity_id)
     else:
         raise ValueError("Tipo de entidad no válido")
 
@@ -245,6 +269,8 @@ def update_matriculas_for_entity(entity_type: EntityType, entity_id, lista_ids):
     """
     Actualiza las matrículas de una entidad (asignatura o alumno) dada una lista de ID's
 
+    A los alumnos nuevos se les asigna un clon de reserva de la asignatura, si queda alguno.
+
     NOTA: No se realiza commit en esta función, por lo que el llamante debe hacerlo
 
     :param entity_type: Tipo de entidad
@@ -311,12 +337,14 @@ def update_matriculas_for_entity(entity_type: EntityType, entity_id, lista_ids):
                 matricula = Matricula(user_id=user_id, asignatura_id=entity_id)
                 matriculas.append(matricula)
                 db.session.add(matricula)
+                __assign_spare_virtual_machine(entity_id, user_id)
         
         elif entity_type == EntityType.USUARIO:
             for asignatura_id in to_add_enrollments:
                 matricula = Matricula(user_id=entity_id, asignatura_id=asignatura_id)
                 matriculas.append(matricula)
                 db.session.add(matricula)
+                __assign_spare_virtual_machine(asignatura_id, entity_id)
 
         return matriculas
 
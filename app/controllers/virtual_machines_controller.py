@@ -1,5 +1,6 @@
 from app.extensions import db
 from app.models.virtual_machine import VirtualMachine
+from app.models.ip_allocation import IpAllocation
 
 from sqlalchemy.exc import SQLAlchemyError
 
@@ -11,7 +12,7 @@ def __check_ids(**ids):
         if not isinstance(value, int):
             raise ValueError(f"El ID {key} debe ser un entero")
 
-def create_virtual_machine(proxmox_id, name, user_id, asignatura_id, vnc_username=None, vnc_password=None, is_base=False, cloned_from=None):
+def create_virtual_machine(proxmox_id, name, user_id, asignatura_id, vnc_username=None, vnc_password=None, is_base=False, cloned_from=None, clone_mode=None, ip_address=None, is_spare=False, node=None):
     """Crea una máquina virtual
 
     :param proxmox_id: ID de la máquina virtual
@@ -20,7 +21,7 @@ def create_virtual_machine(proxmox_id, name, user_id, asignatura_id, vnc_usernam
     :param name: Nombre de la máquina virtual
     :type name: str
 
-    :param user_id: ID del usuario dueño de la máquina virtual
+    :param user_id: ID del usuario dueño de la máquina virtual, None si no tiene dueño
     :type user_id: int
 
     :param asignatura_id: ID de la asignatura a la que pertenece la máquina virtual
@@ -38,6 +39,18 @@ def create_virtual_machine(proxmox_id, name, user_id, asignatura_id, vnc_usernam
     :param cloned_from: ID de la máquina virtual de la que se clonó (default: None)
     :type cloned_from: int
 
+    :param clone_mode: Tipo de clon, 'full' o 'linked' (default: None)
+    :type clone_mode: str
+
+    :param ip_address: IP fija asignada desde el pool (default: None)
+    :type ip_address: str
+
+    :param is_spare: Indica si es un clon de reserva para nuevos alumnos (default: False)
+    :type is_spare: bool
+
+    :param node: Nodo del clúster de Proxmox de la máquina virtual (default: None)
+    :type node: str
+
     :return: La máquina virtual creada
     :rtype: VirtualMachine
 
@@ -45,7 +58,10 @@ def create_virtual_machine(proxmox_id, name, user_id, asignatura_id, vnc_usernam
     :raises VirtualMachineException: Si un error al establecer la contraseña VNC
     :raises SQLAlchemyError: Si ocurre un error al crear la máquina virtual
     """
-    __check_ids(proxmox_id=proxmox_id, user_id=user_id, asignatura_id=asignatura_id)
+    __check_ids(proxmox_id=proxmox_id, asignatura_id=asignatura_id)
+    if user_id is not None:
+        __check_ids(user_id=user_id)
+
     try:
         virtual_machine = VirtualMachine(
             proxmox_id=proxmox_id,
@@ -54,7 +70,11 @@ def create_virtual_machine(proxmox_id, name, user_id, asignatura_id, vnc_usernam
             asignatura_id=asignatura_id,
             vnc_username=vnc_username,
             is_base_vm=is_base,
-            cloned_from=cloned_from
+            cloned_from=cloned_from,
+            clone_mode=clone_mode,
+            ip_address=ip_address,
+            is_spare=is_spare,
+            node=node
         )
 
         if vnc_password and vnc_username:
@@ -138,6 +158,103 @@ def get_clones_of_virtual_machine(proxmox_id):
 
     return VirtualMachine.query.filter_by(cloned_from=proxmox_id).all()
 
+def __unowned_query(asignatura_id):
+    return VirtualMachine.query.filter(
+        VirtualMachine.asignatura_id == asignatura_id,
+        VirtualMachine.is_base_vm.is_(False),
+        VirtualMachine.is_spare.is_(True),
+        VirtualMachine.user_id.is_(None)
+    )
+
+def __spare_query(asignatura_id):
+    return __unowned_query(asignatura_id).filter(VirtualMachine.guacamole_connection_id.isnot(None))
+
+def get_spare_virtual_machines(asignatura_id):
+    """Obtiene los clones de reserva de una asignatura
+
+    Un clon de reserva no tiene dueño y ya tiene su conexión de Guacamole creada.
+
+    :param asignatura_id: ID de la asignatura
+    :type asignatura_id: int
+
+    :return: Lista de máquinas virtuales de reserva
+    :rtype: list[VirtualMachine]
+
+    :raises ValueError: Si asignatura_id no es un entero
+    """
+    if not isinstance(asignatura_id, int):
+        raise ValueError("El ID de la asignatura debe ser un entero")
+
+    return __spare_query(asignatura_id).all()
+
+def get_unowned_clones(asignatura_id):
+    """Obtiene los clones de reserva de una asignatura, tengan o no su conexión de Guacamole
+
+    Son los que cuentan para warm_pool_size: un clon cuya conexión no se pudo
+    crear sigue ocupando su sitio hasta que se reintente.
+
+    :param asignatura_id: ID de la asignatura
+    :type asignatura_id: int
+
+    :return: Lista de máquinas virtuales sin dueño
+    :rtype: list[VirtualMachine]
+
+    :raises ValueError: Si asignatura_id no es un entero
+    """
+    if not isinstance(asignatura_id, int):
+        raise ValueError("El ID de la asignatura debe ser un entero")
+
+    return __unowned_query(asignatura_id).all()
+
+def assign_spare_virtual_machine(asignatura_id, user_id, commit=True):
+    """Asigna a un alumno uno de los clones de reserva de una asignatura
+
+    Si el alumno ya tiene una máquina virtual en la asignatura, se devuelve esa.
+    La fila del clon se bloquea (saltando las ya bloqueadas) para que dos
+    matrículas simultáneas no reciban el mismo clon.
+
+    :param asignatura_id: ID de la asignatura
+    :type asignatura_id: int
+
+    :param user_id: ID del alumno
+    :type user_id: int
+
+    :param commit: Indica si se debe hacer commit (default: True)
+    :type commit: bool
+
+    :return: La máquina virtual del alumno o None si no quedan clones de reserva
+    :rtype: VirtualMachine
+
+    :raises ValueError: Si alguno de los IDs no es un entero
+    :raises SQLAlchemyError: Si ocurre un error al asignar la máquina virtual
+    """
+    __check_ids(asignatura_id=asignatura_id, user_id=user_id)
+
+    try:
+        existing = VirtualMachine.query.filter_by(
+            asignatura_id=asignatura_id,
+            user_id=user_id,
+            is_base_vm=False
+        ).first()
+        if existing:
+            return existing
+
+        spare = __spare_query(asignatura_id).order_by(VirtualMachine.proxmox_id).with_for_update(skip_locked=True).first()
+        if not spare:
+            return None
+
+        spare.user_id = user_id
+        spare.is_spare = False
+
+        if commit:
+            db.session.commit()
+
+        return spare
+
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        raise SQLAlchemyError(f"Error al asignar la máquina virtual de reserva: {e}") from e
+
 def update_virtual_machine(proxmox_id, commit=True, **kwargs):
     """Actualiza una máquina virtual
 
@@ -213,6 +330,8 @@ def bulk_update_virtual_machines(virtual_machines):
 def delete_virtual_machine(proxmox_id):
     """Elimina una máquina virtual de la base de datos
 
+    Si la máquina virtual tenía una IP del pool reservada, la reserva se libera.
+
     :param proxmox_id: ID de la máquina virtual
     :type proxmox_id: str
 
@@ -231,6 +350,7 @@ def delete_virtual_machine(proxmox_id):
         if not virtual_machine:
             raise VirtualMachineException("Máquina virtual no encontrada")
 
+        IpAllocation.query.filter_by(proxmox_id=proxmox_id).delete()
         db.session.delete(virtual_machine)
         db.session.commit()
         return virtual_machine
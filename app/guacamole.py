@@ -1,4 +1,9 @@
-import json, logging, requests
+import json, logging, threading, time, requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from sqlalchemy import MetaData, Table, Column, Integer, String, create_engine, select, text
+from sqlalchemy.engine import URL
+from sqlalchemy.exc import SQLAlchemyError
 
 # Import the correct config file
 from app.config import GuacamoleConfig
@@ -10,15 +15,71 @@ logger = logging.getLogger(__name__)
 class GuacamoleError(Exception):
     pass
 
-def get_guacamole_token():
+# Sesión HTTP compartida por todo el proceso
+## Reutiliza las conexiones TCP/TLS (keep-alive) entre peticiones y reintenta los
+## errores de red con espera exponencial. Las respuestas 502/503/504 solo se reintentan
+## en métodos idempotentes para no crear conexiones duplicadas.
+_session = None
+_session_lock = threading.Lock()
+
+def _get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=GuacamoleConfig.HTTP_RETRIES,
+                backoff_factor=GuacamoleConfig.HTTP_BACKOFF,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset(['GET', 'PUT', 'DELETE', 'HEAD', 'OPTIONS']),
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(
+                pool_connections=1, # Solo se conecta a un host
+                pool_maxsize=GuacamoleConfig.HTTP_POOL_SIZE,
+                max_retries=retry
+            )
+
+            session = requests.Session()
+            session.verify = False
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+
+        return _session
+
+def _send(method, url, timeout=None, **kwargs):
     """
-    Obtiene un token para autenticar con Guacamole
+    Envía una petición a Guacamole a través de la sesión compartida
 
-    :return: El token para autenticar con Guacamole
-    :rtype: str
+    :param method: Método HTTP
+    :type method: str
 
-    :raises GuacamoleError: Si la petición falla
+    :param url: URL de la petición
+    :type url: str
+
+    :param timeout: Tiempo máximo de lectura en segundos (default: None, usa GuacamoleConfig.HTTP_READ_TIMEOUT)
+    :type timeout: float
+
+    :return: La respuesta de Guacamole
+    :rtype: requests.Response
+
+    :raises GuacamoleError: Si no se puede conectar con Guacamole tras los reintentos
     """
+    timeout = (GuacamoleConfig.HTTP_CONNECT_TIMEOUT, timeout or GuacamoleConfig.HTTP_READ_TIMEOUT)
+    try:
+        return _get_session().request(method, url, timeout=timeout, **kwargs)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Guacamole request {method} {url} failed: {e}")
+        raise GuacamoleError(f"No se ha podido conectar con Guacamole: {e}") from e
+
+TOKEN_REFRESH_MARGIN = 60 # Segundos antes de que caduque el token en los que ya se renueva
+
+# Token compartido por todo el proceso
+_token = None
+_token_last_used = 0
+_token_lock = threading.Lock()
+
+def _request_new_token():
     headers = {
         'Content-Type': 'application/x-www-form-urlencoded'
     }
@@ -28,13 +89,102 @@ def get_guacamole_token():
         "password": GuacamoleConfig.PASSWORD,
     }
 
-    response = requests.post(f"{GuacamoleConfig.BASE_URL}/api/tokens", headers=headers, data=payload, verify=False)
+    response = _send('POST', f"{GuacamoleConfig.BASE_URL}/api/tokens", headers=headers, data=payload)
 
     if response.status_code != 200:
         raise GuacamoleError("Failed to authenticate with Guacamole.", response.status_code, response.text)
 
     return response.json().get('authToken')
 
+def _token_is_valid():
+    idle_time = time.monotonic() - _token_last_used
+    return _token is not None and idle_time < GuacamoleConfig.TOKEN_IDLE_TIMEOUT - TOKEN_REFRESH_MARGIN
+
+def get_guacamole_token(force_refresh=False):
+    """
+    Obtiene un token para autenticar con Guacamole
+
+    El token se comparte en todo el proceso y se reutiliza mientras no esté
+    cerca de caducar por inactividad (GuacamoleConfig.TOKEN_IDLE_TIMEOUT). Si
+    hay que renovarlo, solo un hilo hace la petición y el resto espera y
+    reutiliza el nuevo token, por lo que muchas peticiones simultáneas
+    provocan una única autenticación.
+
+    :param force_refresh: Obtener un token nuevo aunque el actual siga siendo válido (default: False)
+    :type force_refresh: bool
+
+    :return: El token para autenticar con Guacamole
+    :rtype: str
+
+    :raises GuacamoleError: Si la petición falla
+    """
+    global _token, _token_last_used
+
+    if not force_refresh and _token_is_valid():
+        _token_last_used = time.monotonic()
+        return _token
+
+    with _token_lock:
+        # Otro hilo puede haberlo renovado mientras se esperaba el lock
+        if force_refresh or not _token_is_valid():
+            _token = _request_new_token()
+            logger.info("New Guacamole token obtained")
+
+        _token_last_used = time.monotonic()
+        return _token
+
+def invalidate_guacamole_token(token=None):
+    """
+    Descarta el token compartido para que la siguiente llamada obtenga uno nuevo
+
+    :param token: Token que ha dejado de ser válido. Si el token compartido ya es
+        otro (porque otro hilo lo renovó) no se descarta (default: None, descarta el actual)
+    :type token: str
+    """
+    global _token
+
+    with _token_lock:
+        if token is None or token == _token:
+            _token = None
+
+def _request(method, url, token=None, **kwargs):
+    """
+    Realiza una petición autenticada a la API de Guacamole
+
+    Si Guacamole rechaza el token con un 403 (p. ej. porque la sesión caducó
+    o se cerró), se descarta, se obtiene uno nuevo y se repite la petición una vez.
+
+    :param method: Método HTTP
+    :type method: str
+
+    :param url: URL de la petición
+    :type url: str
+
+    :param token: Token a usar (default: None, usa el token compartido)
+    :type token: str
+
+    :return: La respuesta de Guacamole
+    :rtype: requests.Response
+
+    :raises GuacamoleError: Si no se puede obtener un token o conectar con Guacamole
+    """
+    for attempt in range(2):
+        current_token = token or get_guacamole_token()
+        headers = {
+            'Guacamole-Token': current_token,
+            'Content-Type': 'application/json'
+        }
+
+        response = _send(method, url, headers=headers, **kwargs)
+        if response.status_code != 403 or attempt > 0:
+            return response
+
+        logger.warning("Guacamole rejected the token, requesting a new one")
+        invalidate_guacamole_token(current_token)
+        token = None
+
+    return response
+
 # Functions to read data from Guacamole instead of writing
 def get_guacamole_connections(token):
     """
@@ -49,17 +199,142 @@ def get_guacamole_connections(token):
     :raises GuacamoleError: Si la petición falla
     """
     url = f"{GuacamoleConfig.BASE_URL}/api/session/data/{GuacamoleConfig.DATABASE_TYPE}/connections"
-    headers = {
-        'Guacamole-Token': token,
-        'Content-Type': 'application/json'
-    }
 
-    response = requests.get(url, headers=headers, verify=False)
+    response = _request('GET', url, token)
     if response.status_code != 200:
         raise GuacamoleError("Failed to get Guacamole connections.", response.status_code, response.text)
 
     return response.json()
 
+def get_guacamole_connection(token, connection_id):
+    """
+    Obtiene una conexión de Guacamole por su ID
+
+    :param token: El token para autenticar con Guacamole
+    :type token: str
+
+    :param connection_id: El ID de la conexión
+    :type connection_id: str
+
+    :return: La conexión en formato JSON o None si no existe
+    :rtype: dict
+
+    :raises GuacamoleError: Si la petición falla
+    """
+    url = f"{GuacamoleConfig.BASE_URL}/api/session/data/{GuacamoleConfig.DATABASE_TYPE}/connections/{connection_id}"
+
+    response = _request('GET', url, token)
+    if response.status_code == 404:
+        return None
+
+    if response.status_code != 200:
+        raise GuacamoleError("Failed to get the Guacamole connection.", response.status_code, response.text)
+
+    return response.json()
+
+def get_guacamole_connection_parameters(token, connection_id):
+    """
+    Obtiene los parámetros de una conexión de Guacamole (hostname, port...)
+
+    :param token: El token para autenticar con Guacamole
+    :type token: str
+
+    :param connection_id: El ID de la conexión
+    :type connection_id: str
+
+    :return: Diccionario con los parámetros o None si la conexión no existe
+    :rtype: dict
+
+    :raises GuacamoleError: Si la petición falla
+    """
+    url = f"{GuacamoleConfig.BASE_URL}/api/session/data/{GuacamoleConfig.DATABASE_TYPE}/connections/{connection_id}/parameters"
+
+    response = _request('GET', url, token)
+    if response.status_code == 404:
+        return None
+
+    if response.status_code != 200:
+        raise GuacamoleError("Failed to get the Guacamole connection parameters.", response.status_code, response.text)
+
+    return response.json()
+
+def get_active_connection_ids(token):
+    """
+    Obtiene los IDs de las conexiones de Guacamole que tienen alguna sesión abierta
+
+    :param token: El token para autenticar con Guacamole
+    :type token: str
+
+    :return: Conjunto de IDs de conexión (str)
+    :rtype: set[str]
+
+    :raises GuacamoleError: Si la petición falla
+    """
+    url = f"{GuacamoleConfig.BASE_URL}/api/session/data/{GuacamoleConfig.DATABASE_TYPE}/activeConnections"
+
+    response = _request('GET', url, token)
+    if response.status_code != 200:
+        raise GuacamoleError("Failed to get the active Guacamole connections.", response.status_code, response.text)
+
+    return {str(active['connectionIdentifier']) for active in response.json().values()}
+
+# Índice de conexiones
+## Evita descargar la lista completa de conexiones en cada búsqueda. El índice se
+## construye a partir de una única descarga, caduca tras GuacamoleConfig.CONNECTION_INDEX_TTL
+## y se actualiza directamente con las conexiones que crea o borra la aplicación.
+_connections_by_id = {}
+_connection_ids_by_name = {}
+_index_loaded_at = None
+_index_lock = threading.Lock()
+
+def _index_is_fresh():
+    return _index_loaded_at is not None and time.monotonic() - _index_loaded_at < GuacamoleConfig.CONNECTION_INDEX_TTL
+
+def _index_add(connection):
+    with _index_lock:
+        if _index_loaded_at is None:
+            return
+
+        connection_id = str(connection['identifier'])
+        _connections_by_id[connection_id] = connection
+        _connection_ids_by_name[connection['name']] = connection_id
+
+def _index_remove(connection_id):
+    with _index_lock:
+        connection = _connections_by_id.pop(str(connection_id), None)
+        if connection is not None and _connection_ids_by_name.get(connection['name']) == str(connection_id):
+            del _connection_ids_by_name[connection['name']]
+
+def get_connection_index(token, refresh=False):
+    """
+    Obtiene el índice de conexiones de Guacamole (ID -> conexión)
+
+    Si el índice ha caducado, se reconstruye con una única descarga de la lista
+    de conexiones. Las llamadas simultáneas esperan a esa descarga en lugar de
+    hacer la suya propia.
+
+    :param token: El token para autenticar con Guacamole
+    :type token: str
+
+    :param refresh: Reconstruir el índice aunque no haya caducado (default: False)
+    :type refresh: bool
+
+    :return: Diccionario ID de la conexión (str) -> conexión
+    :rtype: dict
+
+    :raises GuacamoleError: Si la petición falla
+    """
+    global _connections_by_id, _connection_ids_by_name, _index_loaded_at
+
+    with _index_lock:
+        if refresh or not _index_is_fresh():
+            connections = get_guacamole_connections(token)
+            _connections_by_id = {str(conn['identifier']): conn for conn in connections.values()}
+            _connection_ids_by_name = {conn['name']: connection_id for connection_id, conn in _connections_by_id.items()}
+            _index_loaded_at = time.monotonic()
+
+        return dict(_connections_by_id)
+
 # UNUSED
 def get_guacamole_users(token):
     """
@@ -74,17 +349,178 @@ def get_guacamole_users(token):
     :raises GuacamoleError: Si la petición falla
     """
     url = f"{GuacamoleConfig.BASE_URL}/api/session/data/{GuacamoleConfig.DATABASE_TYPE}/users"
-    headers = {
-        'Guacamole-Token': token,
-        'Content-Type': 'application/json'
-    }
 
-    response = requests.get(url, headers=headers, verify=False)
+    response = _request('GET', url, token)
     if response.status_code != 200:
         raise GuacamoleError("Failed to get Guacamole users.", response.status_code, response.text)
 
     return response.json()
 
+def _connection_payload(
+    virtual_machine_ip, connection_name, virtual_machine_username,
+    connection_password, type_of_connection="vnc", connection_port=5901
+):
+    # VNC Connection
+    return {
+        "name": connection_name,
+        "parentIdentifier": "ROOT",
+        "protocol": type_of_connection,
+        "parameters": {
+            "hostname": virtual_machine_ip,
+            "port": str(connection_port),
+            "username": virtual_machine_username,
+            "password": connection_password
+        },
+        "attributes": {
+            "maxConnection": "",
+            "weight": "",
+            "guacd-port": "4822",
+            "guacd-hostname": "guacd"
+        }
+    }
+
+def _index_add_created(connection_id, payload):
+    # Solo se indexan los datos que devuelve el listado, sin los parámetros (contraseña)
+    _index_add({
+        'identifier': connection_id,
+        'name': payload['name'],
+        'parentIdentifier': payload['parentIdentifier'],
+        'protocol': payload['protocol']
+    })
+
+# Aprovisionamiento directo en la base de datos
+## Alternativa a la API REST (GuacamoleConfig.PROVISIONING_BACKEND = "database"): las
+## conexiones se escriben en las tablas de Guacamole en una única transacción, sin pasar
+## por la autenticación ni por una petición por conexión. Guacamole lee las conexiones de
+## la base de datos en cada petición, por lo que las nuevas están disponibles al momento.
+DATABASE_CHUNK_SIZE = 500
+
+_metadata = MetaData()
+
+_connection_table = Table(
+    'guacamole_connection', _metadata,
+    Column('connection_id', Integer, primary_key=True),
+    Column('connection_name', String(128)),
+    Column('parent_id', Integer),
+    Column('protocol', String(32)),
+    Column('proxy_port', Integer),
+    Column('proxy_hostname', String(512)),
+    Column('max_connections', Integer),
+    Column('connection_weight', Integer)
+)
+
+_connection_parameter_table = Table(
+    'guacamole_connection_parameter', _metadata,
+    Column('connection_id', Integer, primary_key=True),
+    Column('parameter_name', String(128), primary_key=True),
+    Column('parameter_value', String(4096))
+)
+
+_connection_permission_table = Table(
+    'guacamole_connection_permission', _metadata,
+    Column('entity_id', Integer, primary_key=True),
+    Column('connection_id', Integer, primary_key=True),
+    Column('permission', String(16), primary_key=True)
+)
+
+_entity_table = Table(
+    'guacamole_entity', _metadata,
+    Column('entity_id', Integer, primary_key=True),
+    Column('name', String(128)),
+    Column('type', String(16))
+)
+
+# Permisos que Guacamole concede al usuario que crea una conexión desde la API
+_CREATOR_PERMISSIONS = ('READ', 'UPDATE', 'DELETE', 'ADMINISTER')
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def _get_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            url = URL.create(
+                'mysql+pymysql',
+                username=GuacamoleConfig.DATABASE_USER,
+                password=GuacamoleConfig.DATABASE_PASSWORD,
+                host=GuacamoleConfig.DATABASE_HOST,
+                port=GuacamoleConfig.PORT,
+                database=GuacamoleConfig.DATABASE_NAME
+            )
+            _engine = create_engine(url, pool_pre_ping=True, pool_recycle=3600)
+
+        return _engine
+
+def _uses_database_backend():
+    return GuacamoleConfig.PROVISIONING_BACKEND == "database"
+
+def _optional_int(value):
+    return int(value) if value not in (None, "") else None
+
+def _db_insert_connections(payloads):
+    """
+    Inserta varias conexiones en la base de datos de Guacamole en una única transacción
+
+    :param payloads: Conexiones con el mismo formato que las envía la API REST (ver _connection_payload)
+    :type payloads: list[dict]
+
+    :return: IDs (como str) de las conexiones creadas, en el mismo orden que payloads
+    :rtype: list[str]
+
+    :raises GuacamoleError: Si la inserción falla. En ese caso no se crea ninguna conexión
+    """
+    if not payloads:
+        return []
+
+    try:
+        with _get_engine().begin() as conn:
+            entity_id = conn.execute(
+                select(_entity_table.c.entity_id).where(
+                    _entity_table.c.name == GuacamoleConfig.USER,
+                    _entity_table.c.type == 'USER'
+                )
+            ).scalar()
+            if entity_id is None:
+                raise GuacamoleError(f"The Guacamole user {GuacamoleConfig.USER} does not exist in the database.")
+
+            # Un único INSERT con todas las filas
+            conn.execute(_connection_table.insert().values([
+                {
+                    'connection_name': payload['name'],
+                    'parent_id': None, # ROOT
+                    'protocol': payload['protocol'],
+                    'proxy_port': _optional_int(payload['attributes'].get('guacd-port')),
+                    'proxy_hostname': payload['attributes'].get('guacd-hostname') or None,
+                    'max_connections': _optional_int(payload['attributes'].get('maxConnection')),
+                    'connection_weight': _optional_int(payload['attributes'].get('weight'))
+                }
+                for payload in payloads
+            ]))
+
+            # MySQL asigna IDs consecutivos a las filas de un mismo INSERT y LAST_INSERT_ID()
+            # devuelve el de la primera
+            first_id = conn.execute(text("SELECT LAST_INSERT_ID()")).scalar()
+            connection_ids = [first_id + i for i in range(len(payloads))]
+
+            conn.execute(_connection_parameter_table.insert().values([
+                {'connection_id': connection_id, 'parameter_name': name, 'parameter_value': value}
+                for connection_id, payload in zip(connection_ids, payloads)
+                for name, value in payload['parameters'].items()
+            ]))
+
+            conn.execute(_connection_permission_table.insert().values([
+                {'entity_id': entity_id, 'connection_id': connection_id, 'permission': permission}
+                for connection_id in connection_ids
+                for permission in _CREATOR_PERMISSIONS
+            ]))
+
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to insert the Guacamole connections into the database: {e}")
+        raise GuacamoleError(f"No se han podido crear las conexiones en la base de datos de Guacamole: {e}") from e
+
+    return [str(connection_id) for connection_id in connection_ids]
+
 def create_guacamole_connection(
     token, virtual_machine_ip, connection_name,
     virtual_machine_username, connection_password,
@@ -95,6 +531,9 @@ def create_guacamole_connection(
 
     Este método permite crear una nueva conexión en Guacamole. Soporta el uso de 
     diferentes protocolos de conexión, pero actualmente asume que se usará VNC.
+
+    Con GuacamoleConfig.PROVISIONING_BACKEND = "database" la conexión se escribe
+    directamente en la base de datos de Guacamole y el token no se usa.
     
     :param token: Token para autenticar con Guacamole
     :type token: str
@@ -124,31 +563,18 @@ def create_guacamole_connection(
     """
 
     url = f"{GuacamoleConfig.BASE_URL}/api/session/data/{GuacamoleConfig.DATABASE_TYPE}/connections"
-    headers = {
-        'Guacamole-Token': token,
-        'Content-Type': 'application/json'
-    }
 
-    # VNC Connection
-    payload = {
-        "name": connection_name,
-        "parentIdentifier": "ROOT",
-        "protocol": type_of_connection,
-        "parameters": {
-            "hostname": virtual_machine_ip,
-            "port": str(connection_port),
-            "username": virtual_machine_username,
-            "password": connection_password
-        },
-        "attributes": {
-            "maxConnection": "",
-            "weight": "",
-            "guacd-port": "4822",
-            "guacd-hostname": "guacd"
-        }
-    }
+    payload = _connection_payload(
+        virtual_machine_ip, connection_name, virtual_machine_username,
+        connection_password, type_of_connection, connection_port
+    )
 
-    response = requests.post(url, headers=headers, json=payload, verify=False)
+    if _uses_database_backend():
+        connection_id = _db_insert_connections([payload])[0]
+        _index_add_created(connection_id, payload)
+        return connection_id
+
+    response = _request('POST', url, token, json=payload)
     if response.status_code not in [200, 201]:
         raise GuacamoleError(
             f"Failed to create Guacamole connection. Status code: {response.status_code}. Response: {response.text}, URL: {url}"
@@ -158,12 +584,17 @@ def create_guacamole_connection(
     if connection_id is None:
         raise GuacamoleError("Failed to get the connection ID.")
 
+    _index_add_created(connection_id, payload)
+
     return connection_id # This is the connection ID for the new session
 
 # UNUSED
 def check_connection_exists(token, connection_name):
     """Comprueba si una conexión ya existe en Guacamole
 
+    La búsqueda se hace en el índice de conexiones, sin descargar la lista
+    completa si el índice está actualizado.
+
     :param token: El token para autenticar con Guacamole
     :type token: str
 
@@ -175,18 +606,16 @@ def check_connection_exists(token, connection_name):
 
     :raises GuacamoleError: Si la petición falla
     """
-    connections = get_guacamole_connections(token)
-    for conn_number in connections:
-        conn = connections[conn_number]
-        if conn['name'] == connection_name:
-            return conn['identifier']
-
-    return None
+    get_connection_index(token)
+    return _connection_ids_by_name.get(connection_name)
 
 def test_guacamole_connection(token, connection_id):
     """
     Comprueba si una conexión de Guacamole existe
 
+    Consulta directamente la conexión por su ID en lugar de descargar la
+    lista completa de conexiones.
+
     :param token: El token para autenticar con Guacamole
     :type token: str
 
@@ -194,17 +623,39 @@ def test_guacamole_connection(token, connection_id):
     :type connection_id: str
 
     :return: True si la conexión existe, False si no
-, 204]
+    :rtype: bool
+
     :raises GuacamoleError: Si la petición falla
     """
-    connections = get_guacamole_connections(token)
-    for conn_number in connections:
-        conn = connections[conn_number]
-        if conn['identifier'] == str(connection_id):
-            logger.info(f"Connection {connection_id} exists.")
-            return True
+    connection = get_guacamole_connection(token, connection_id)
+    if connection is None:
+        _index_remove(connection_id)
+        return False
+
+    logger.info(f"Connection {connection_id} exists.")
+    _index_add(connection)
+    return True
+
+def get_existing_connection_ids(token, connection_ids):
+    """
+    Comprueba qué conexiones de una lista existen en Guacamole
 
-    return False
+    Pensado para operaciones sobre muchas conexiones: se descarga la lista de
+    conexiones una única vez y se reconstruye el índice con ella.
+
+    :param token: El token para autenticar con Guacamole
+    :type token: str
+
+    :param connection_ids: IDs de las conexiones a comprobar
+    :type connection_ids: list
+
+    :return: Conjunto con los IDs (como str) de las conexiones que existen
+    :rtype: set[str]
+
+    :raises GuacamoleError: Si la petición falla
+    """
+    connections = get_connection_index(token, refresh=True)
+    return {str(connection_id) for connection_id in connection_ids if str(connection_id) in connections}
 
 def delete_guacamole_connection(token, connection_id):
     """
@@ -217,14 +668,158 @@ def delete_guacamole_connection(token, connection_id):
     """
     url = f"{GuacamoleConfig.BASE_URL}/api/session/data/{GuacamoleConfig.DATABASE_TYPE}/connections/{connection_id}"
 
-    headers = {
-        'Guacamole-Token': token,
-        'Content-Type': 'application/json'
-    }
-    response = requests.delete(url, headers=headers, verify=False)
+    response = _request('DELETE', url, token)
 
     if response.status_code not in [200, 204]:
         raise GuacamoleError(
             f"Failed to delete Guacamole connection. Status code: {response.status_code}. Response: {response.text}, URL: {url}"
         )
 
+    _index_remove(connection_id)
+
+# Operaciones en bloque
+## Guacamole permite aplicar varias altas y bajas de conexiones en una única petición
+## PATCH sobre /connections (formato JSON Patch). Las operaciones se envían en lotes
+## de PATCH_CHUNK_SIZE; si un lote falla, Guacamole no aplica ninguna de sus operaciones,
+## por lo que ese lote se repite conexión a conexión para aislar la que falla.
+PATCH_CHUNK_SIZE = 50
+
+def _patch_connections(token, operations):
+    """
+    Aplica una lista de operaciones JSON Patch sobre las conexiones de Guacamole
+
+    :param token: El token para autenticar con Guacamole
+    :type token: str
+
+    :param operations: Operaciones 'add' o 'remove'
+    :type operations: list[dict]
+
+    :return: Resultado de cada operación, en el mismo orden (incluye el 'identifier' de la conexión)
+    :rtype: list[dict]
+
+    :raises GuacamoleError: Si la petición falla
+    """
+    url = f"{GuacamoleConfig.BASE_URL}/api/session/data/{GuacamoleConfig.DATABASE_TYPE}/connections"
+
+    response = _request('PATCH', url, token, json=operations)
+    if response.status_code not in [200, 204]:
+        raise GuacamoleError(
+            f"Failed to patch Guacamole connections. Status code: {response.status_code}. Response: {response.text}"
+        )
+
+    if response.status_code == 204 or not response.content:
+        return []
+
+    return response.json().get('patches', [])
+
+def bulk_create_guacamole_connections(token, connections, chunk_size=None):
+    """
+    Crea varias conexiones de Guacamole con peticiones PATCH en lotes
+
+    Con GuacamoleConfig.PROVISIONING_BACKEND = "database" cada lote se inserta
+    directamente en la base de datos de Guacamole en una única transacción.
+
+    :param token: El token para autenticar con Guacamole
+    :type token: str
+
+    :param connections: Diccionario vmid -> datos de la conexión, con las mismas claves que
+        los parámetros de create_guacamole_connection (virtual_machine_ip, connection_name,
+        virtual_machine_username, connection_password y, opcionalmente, type_of_connection y connection_port)
+    :type connections: dict
+
+    :param chunk_size: Número máximo de conexiones por petición (default: None, PATCH_CHUNK_SIZE
+        o DATABASE_CHUNK_SIZE según el modo de aprovisionamiento)
+    :type chunk_size: int
+
+    :return: Tupla (connection_ids, errors) con los diccionarios vmid -> ID de la conexión creada
+        y vmid -> mensaje de error de las que no se han podido crear
+    :rtype: tuple[dict, dict]
+
+    :raises GuacamoleError: Si no se puede obtener un token o conectar con Guacamole
+    """
+    connection_ids = {}
+    errors = {}
+
+    use_database = _uses_database_backend()
+    if chunk_size is None:
+        chunk_size = DATABASE_CHUNK_SIZE if use_database else PATCH_CHUNK_SIZE
+
+    vmids = list(connections)
+    for i in range(0, len(vmids), chunk_size):
+        chunk = vmids[i:i + chunk_size]
+        payloads = {vmid: _connection_payload(**connections[vmid]) for vmid in chunk}
+
+        try:
+            if use_database:
+                new_ids = _db_insert_connections([payloads[vmid] for vmid in chunk])
+            else:
+                patches = _patch_connections(
+                    token, [{'op': 'add', 'path': '/', 'value': payloads[vmid]} for vmid in chunk]
+                )
+                if len(patches) != len(chunk) or any(patch.get('identifier') is None for patch in patches):
+                    raise GuacamoleError("Guacamole did not return the identifiers of the new connections.")
+                new_ids = [patch['identifier'] for patch in patches]
+
+        except GuacamoleError as e:
+            logger.warning(f"Bulk connection creation failed, creating them one by one: {e}")
+            for vmid in chunk:
+                try:
+                    connection_ids[vmid] = create_guacamole_connection(token, **connections[vmid])
+                except GuacamoleError as e:
+                    logger.error(f"Failed to create the Guacamole connection of VM {vmid}: {e}")
+                    errors[vmid] = str(e)
+            continue
+
+        # Las operaciones se resuelven en el mismo orden en que se enviaron
+        for vmid, connection_id in zip(chunk, new_ids):
+            connection_ids[vmid] = connection_id
+            _index_add_created(connection_id, payloads[vmid])
+
+    return connection_ids, errors
+
+def bulk_delete_guacamole_connections(token, connection_ids, chunk_size=PATCH_CHUNK_SIZE):
+    """
+    Borra varias conexiones de Guacamole con peticiones PATCH en lotes
+
+    Las conexiones que ya no existen se consideran borradas.
+
+    :param token: El token para autenticar con Guacamole
+    :type token: str
+
+    :param connection_ids: IDs de las conexiones a borrar
+    :type connection_ids: list
+
+    :param chunk_size: Número máximo de conexiones por petición (default: PATCH_CHUNK_SIZE)
+    :type chunk_size: int
+
+    :return: Diccionario ID de la conexión -> mensaje de error de las que no se han podido borrar
+    :rtype: dict
+
+    :raises GuacamoleError: Si no se puede obtener un token o conectar con Guacamole
+    """
+    errors = {}
+
+    # Borrar una conexión inexistente haría fallar el lote completo
+    existing = get_existing_connection_ids(token, connection_ids)
+    connection_ids = [connection_id for connection_id in connection_ids if str(connection_id) in existing]
+
+    for i in range(0, len(connection_ids), chunk_size):
+        chunk = connection_ids[i:i + chunk_size]
+
+        try:
+            _patch_connections(token, [{'op': 'remove', 'path': f"/{connection_id}"} for connection_id in chunk])
+
+        except GuacamoleError as e:
+            logger.warning(f"Bulk connection deletion failed, deleting them one by one: {e}")
+            for connection_id in chunk:
+                try:
+                    delete_guacamole_connection(token, connection_id)
+                except GuacamoleError as e:
+                    logger.error(f"Failed to delete the Guacamole connection {connection_id}: {e}")
+                    errors[connection_id] = str(e)
+            continue
+
+        for connection_id in chunk:
+            _index_remove(connection_id)
+
+    return errors
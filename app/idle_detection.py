@@ -0,0 +1,154 @@
+import time, logging, threading
+from datetime import datetime
+
+import app.proxmox as proxmox
+import app.guacamole as guacamole
+from app.controllers import virtual_machines_controller
+
+# Import the appropiate configuration
+from app.config import Config
+# from app.configUni import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Reposo de las VMs inactivas
+## Los clones se encienden para toda la franja del horario, aunque ningún alumno se conecte.
+## Periódicamente se comprueba cada clon encendido: está inactivo si no tiene ninguna sesión
+## abierta en Guacamole, su uso de CPU es bajo y apenas tiene tráfico de red. Si sigue
+## inactivo durante Config.PROXMOX.IDLE_GRACE_PERIOD minutos, se hiberna (o se apaga) para
+## liberar su RAM en el nodo. Al abrir el laboratorio, el alumno la reanuda (ver app/on_demand_start.py).
+
+IDLE_ACTIONS = ('hibernate', 'stop')
+
+# Estado entre comprobaciones (solo las ejecuta el proceso líder del scheduler)
+_idle_since = {} # vmid -> instante desde el que está inactiva
+_network_samples = {} # vmid -> (instante, bytes de red acumulados)
+_state_lock = threading.Lock()
+
+def is_enabled():
+    """Indica si el reposo de las VMs inactivas está activado
+
+    :return: True si Config.PROXMOX.IDLE_ACTION es 'hibernate' o 'stop'
+    :rtype: bool
+    """
+    return Config.PROXMOX.IDLE_ACTION in IDLE_ACTIONS
+
+def _network_rate(vmid, vm_status, now):
+    # Bytes por segundo desde la comprobación anterior, None en la primera
+    total = vm_status.get('netin', 0) + vm_status.get('netout', 0)
+    previous = _network_samples.get(vmid)
+    _network_samples[vmid] = (now, total)
+
+    if previous is None or now <= previous[0] or total < previous[1]:
+        return None
+
+    return (total - previous[1]) / (now - previous[0])
+
+def _forget(vmid):
+    _idle_since.pop(vmid, None)
+    _network_samples.pop(vmid, None)
+
+def find_idle_virtual_machines(clones, snapshot, active_connection_ids):
+    """
+    Actualiza el estado de inactividad de los clones y devuelve los que han superado el periodo de gracia
+
+    :param clones: Clones de la base de datos
+    :type clones: list[VirtualMachine]
+
+    :param snapshot: Estado de las VMs en Proxmox (get_vms_status_snapshot)
+    :type snapshot: dict
+
+    :param active_connection_ids: IDs de las conexiones de Guacamole con sesiones abiertas
+    :type active_connection_ids: set[str]
+
+    :return: IDs de las VMs que hay que poner en reposo
+    :rtype: list[int]
+    """
+    now = time.monotonic()
+    grace = Config.PROXMOX.IDLE_GRACE_PERIOD * 60
+    idle = []
+
+    with _state_lock:
+        for vm in clones:
+            vm_status = snapshot.get(vm.proxmox_id)
+            if not vm_status or vm_status.get('status') != 'running' or vm_status.get('lock'):
+                _forget(vm.proxmox_id)
+                continue
+
+            rate = _network_rate(vm.proxmox_id, vm_status, now)
+            busy = (
+                str(vm.guacamole_connection_id) in active_connection_ids
+                or vm_status.get('cpu', 0) > Config.PROXMOX.IDLE_CPU_THRESHOLD
+                or rate is None
+                or rate > Config.PROXMOX.IDLE_NETWORK_THRESHOLD
+            )
+            if busy:
+                _idle_since.pop(vm.proxmox_id, None)
+                continue
+
+            if now - _idle_since.setdefault(vm.proxmox_id, now) >= grace:
+                idle.append(vm.proxmox_id)
+
+    return idle
+
+def _suspend(vm_ids):
+    try:
+        if Config.PROXMOX.IDLE_ACTION == 'hibernate':
+            proxmox.batch_hibernate_virtual_machines(vm_ids)
+        else:
+            proxmox.batch_stop_virtual_machines(vm_ids)
+    except TimeoutError as e:
+        # Las que no han terminado se volverán a comprobar en la siguiente pasada
+        logger.error(e)
+
+def check_idle_virtual_machines():
+    """
+    Pone en reposo los clones encendidos que llevan inactivos más del periodo de gracia
+
+    Debe llamarse dentro del contexto de la aplicación. Si no se pueden obtener
+    las sesiones abiertas de Guacamole no se pone ninguna VM en reposo.
+
+    :return: IDs de las VMs puestas en reposo
+    :rtype: list[int]
+    """
+    if not is_enabled():
+        return []
+
+    clones = [vm for vm in virtual_machines_controller.get_all_virtual_machines() if not vm.is_base_vm]
+    if not clones:
+        return []
+
+    try:
+        snapshot = proxmox.get_vms_status_snapshot([vm.proxmox_id for vm in clones])
+        active_connection_ids = guacamole.get_active_connection_ids(guacamole.get_guacamole_token())
+    except (ConnectionError, proxmox.ProxmoxError, guacamole.GuacamoleError, ValueError) as e:
+        logger.warning(f"Skipping the idle check: {e}")
+        return []
+
+    # Las VMs que se han vuelto a encender (por el horario o por el alumno) ya no están en reposo
+    awake = [
+        {'proxmox_id': vm.proxmox_id, 'idle_suspended_at': None}
+        for vm in clones
+        if vm.idle_suspended_at is not None and snapshot.get(vm.proxmox_id, {}).get('status') == 'running'
+    ]
+    if awake:
+        virtual_machines_controller.bulk_update_virtual_machines(awake)
+
+    idle = find_idle_virtual_machines(clones, snapshot, active_connection_ids)
+    if not idle:
+        return []
+
+    logger.info(f"Putting idle VMs to sleep ({Config.PROXMOX.IDLE_ACTION}): {idle}")
+    _suspend(idle)
+
+    suspended_at = datetime.now()
+    virtual_machines_controller.bulk_update_virtual_machines(
+        [{'proxmox_id': vm_id, 'idle_suspended_at': suspended_at} for vm_id in idle]
+    )
+
+    with _state_lock:
+        for vm_id in idle:
+            _forget(vm_id)
+
+    return idle
@@ -0,0 +1,280 @@
+import os, re, time, asyncio, logging, threading, ipaddress
+
+import app.proxmox as proxmox
+
+# Import the appropiate configuration
+from app.config import Config
+# from app.configUni import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Resolución de IPs sin encender las VMs
+## Encender cada clon para preguntar su IP al agente de QEMU es la parte más lenta de crear
+## las conexiones. Aquí la IP se obtiene a partir de la configuración de la VM en Proxmox
+## (su MAC o su ipconfig de cloud-init) y de fuentes externas. Las fuentes se consultan en
+## el orden de Config.PROXMOX.IP_RESOLVERS; si ninguna conoce la IP, el llamador debe
+## recurrir al agente (async_boot_and_get_ip).
+
+# Funciones registradas para cada fuente de IPs
+_ip_resolvers = {}
+
+MAC_PATTERN = re.compile(r'([0-9A-Fa-f]{2}(?::[0-9A-Fa-f]{2}){5})')
+
+def ip_resolver(name):
+    """Decorador que registra una fuente de direcciones IP
+
+    La función recibe la configuración de la VM en Proxmox y la lista de MACs
+    de sus interfaces (en minúsculas) y devuelve la IPv4 de la VM o None si no
+    la conoce.
+
+    :param name: Nombre de la fuente, el usado en Config.PROXMOX.IP_RESOLVERS
+    :type name: str
+    """
+    def decorator(f):
+        _ip_resolvers[name] = f
+        return f
+    return decorator
+
+def get_vm_macs(vm_config):
+    """
+    Obtiene las MACs de las interfaces de red de una VM a partir de su configuración
+
+    Las interfaces se guardan como net0, net1... con el formato
+    'virtio=BC:24:11:00:00:01,bridge=vmbr0'.
+
+    :param vm_config: Configuración de la VM en Proxmox
+    :type vm_config: dict
+
+    :return: MACs en minúsculas, ordenadas por interfaz
+    :rtype: list[str]
+    """
+    macs = []
+    for key in sorted(k for k in vm_config if re.fullmatch(r'net\d+', k)):
+        match = MAC_PATTERN.search(vm_config[key])
+        if match:
+            macs.append(match.group(1).lower())
+
+    return macs
+
+def _valid_ipv4(value):
+    try:
+        return str(ipaddress.IPv4Address(value))
+    except ValueError:
+        return None
+
+def ip_from_ipconfig(ipconfig):
+    """
+    Obtiene la IPv4 fija de un valor ipconfigN de cloud-init
+
+    :param ipconfig: Valor de ipconfigN (p. ej. 'ip=10.0.0.5/24,gw=10.0.0.1')
+    :type ipconfig: str
+
+    :return: La IPv4 o None si la interfaz usa DHCP
+    :rtype: str
+    """
+    for option in ipconfig.split(','):
+        name, _, value = option.partition('=')
+        if name == 'ip' and value not in ('dhcp', ''):
+            return _valid_ipv4(value.split('/')[0])
+
+    return None
+
+@ip_resolver('cloudinit')
+def _resolve_from_cloudinit(vm_config, macs):
+    # 'ip=dhcp' no sirve para conocer la IP
+    for key in sorted(k for k in vm_config if re.fullmatch(r'ipconfig\d+', k)):
+        ip = ip_from_ipconfig(vm_config[key])
+        if ip:
+            return ip
+
+    return None
+
+# Los archivos se vuelven a leer solo si han cambiado desde la última vez
+_file_cache = {} # path -> (mtime, MAC -> IP)
+_file_cache_lock = threading.Lock()
+
+def _load_mac_table(path, parse):
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError as e:
+        logger.warning(f"Could not read {path}: {e}")
+        return {}
+
+    with _file_cache_lock:
+        cached = _file_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        with open(path) as f:
+            table = parse(f.read())
+
+        _file_cache[path] = (mtime, table)
+        return table
+
+def _parse_ethers(content):
+    # Una línea "MAC IP" por VM, como /etc/ethers o dhcp-host de dnsmasq (read-ethers)
+    table = {}
+    for line in content.splitlines():
+        fields = line.split('#')[0].split()
+        if len(fields) >= 2 and MAC_PATTERN.fullmatch(fields[0]):
+            ip = _valid_ipv4(fields[1])
+            if ip:
+                table[fields[0].lower()] = ip
+
+    return table
+
+def _parse_dnsmasq_leases(content):
+    # "<expiración> <MAC> <IP> <hostname> <client-id>"; una expiración 0 no caduca
+    table = {}
+    now = time.time()
+    for line in content.splitlines():
+        fields = line.split()
+        if len(fields) < 3 or not MAC_PATTERN.fullmatch(fields[1]):
+            continue
+
+        expires = int(fields[0]) if fields[0].isdigit() else 0
+        ip = _valid_ipv4(fields[2])
+        if ip and (expires == 0 or expires > now):
+            table[fields[1].lower()] = ip
+
+    return table
+
+def _parse_isc_leases(content):
+    # Bloques "lease <IP> { ... binding state active; hardware ethernet <MAC>; }".
+    # El archivo solo crece, así que la última concesión de cada MAC es la vigente
+    table = {}
+    for ip, body in re.findall(r'lease\s+([\d.]+)\s*\{(.*?)\}', content, re.S):
+        mac = re.search(r'hardware\s+ethernet\s+' + MAC_PATTERN.pattern, body)
+        state = re.search(r'^\s*binding\s+state\s+(\w+)', body, re.M)
+        if not mac or not _valid_ipv4(ip):
+            continue
+
+        if state and state.group(1) != 'active':
+            table.pop(mac.group(1).lower(), None)
+        else:
+            table[mac.group(1).lower()] = ip
+
+    return table
+
+def _parse_leases(content):
+    if re.search(r'^\s*lease\s+[\d.]+\s*\{', content, re.M):
+        return _parse_isc_leases(content)
+    return _parse_dnsmasq_leases(content)
+
+@ip_resolver('static')
+def _resolve_from_static_pool(vm_config, macs):
+    table = _load_mac_table(Config.PROXMOX.STATIC_IP_POOL_FILE, _parse_ethers)
+    return next((table[mac] for mac in macs if mac in table), None)
+
+@ip_resolver('leases')
+def _resolve_from_leases(vm_config, macs):
+    table = _load_mac_table(Config.PROXMOX.DHCP_LEASES_FILE, _parse_leases)
+    return next((table[mac] for mac in macs if mac in table), None)
+
+def get_addresses_in_use():
+    """
+    Obtiene las direcciones que las fuentes externas configuradas (pool estático
+    y concesiones DHCP) ya asocian a algún equipo
+
+    Sirve para no asignar una IP fija que ya está en uso en la red.
+
+    :return: Conjunto de direcciones IPv4
+    :rtype: set[str]
+    """
+    files = {
+        'static': (Config.PROXMOX.STATIC_IP_POOL_FILE, _parse_ethers),
+        'leases': (Config.PROXMOX.DHCP_LEASES_FILE, _parse_leases)
+    }
+
+    addresses = set()
+    for name, _ in _configured_resolvers():
+        if name in files:
+            addresses.update(_load_mac_table(*files[name]).values())
+
+    return addresses
+
+def _configured_resolvers():
+    names = [name.strip() for name in Config.PROXMOX.IP_RESOLVERS.split(',') if name.strip()]
+    unknown = [name for name in names if name not in _ip_resolvers]
+    if unknown:
+        logger.warning(f"Unknown IP resolvers ignored: {unknown}")
+
+    return [(name, _ip_resolvers[name]) for name in names if name in _ip_resolvers]
+
+def resolve_ip_from_config(vm_config):
+    """
+    Obtiene la IP de una VM a partir de su configuración, sin encenderla
+
+    :param vm_config: Configuración de la VM en Proxmox
+    :type vm_config: dict
+
+    :return: La IPv4 de la VM o None si ninguna fuente la conoce
+    :rtype: str
+    """
+    macs = get_vm_macs(vm_config)
+    for name, resolver in _configured_resolvers():
+        try:
+            ip = resolver(vm_config, macs)
+        except Exception as e:
+            logger.warning(f"IP resolver '{name}' failed: {e}")
+            continue
+
+        if ip:
+            return ip
+
+    return None
+
+async def async_resolve_vm_ip(client, vmid):
+    """
+    Versión asíncrona de resolve_vm_ip
+
+    :return: La IPv4 de la VM o None si ninguna fuente la conoce
+    :rtype: str
+    """
+    if not _configured_resolvers():
+        return None
+
+    try:
+        vm_config = await client.get(f"/nodes/{await proxmox.async_get_vm_node(client, vmid)}/qemu/{vmid}/config")
+    except Exception as e:
+        logger.warning(f"Failed to get the configuration of VM {vmid}: {e}")
+        return None
+
+    ip = resolve_ip_from_config(vm_config or {})
+    if ip:
+        logger.info(f"IP address for VM {vmid} resolved without booting it: {ip}")
+
+    return ip
+
+async def async_resolve_vm_ips(client, vmids):
+    """
+    Obtiene las IPs de varias VMs sin encenderlas
+
+    :return: Diccionario vmid -> IPv4 o None si ninguna fuente la conoce
+    :rtype: dict
+    """
+    ips = await asyncio.gather(*(async_resolve_vm_ip(client, vmid) for vmid in vmids))
+    return dict(zip(vmids, ips))
+
+def resolve_vm_ip(vmid):
+    """
+    Obtiene la IP de una VM sin encenderla, consultando las fuentes de
+    Config.PROXMOX.IP_RESOLVERS en orden
+
+    :param vmid: ID de la VM
+    :type vmid: int
+
+    :return: La IPv4 de la VM o None si ninguna fuente la conoce (hay que preguntar al agente)
+    :rtype: str
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    """
+    if not _configured_resolvers():
+        return None
+
+    async def resolve():
+        async with proxmox.AsyncProxmoxClient() as client:
+            return await async_resolve_vm_ip(client, vmid)
+
+    return asyncio.run(resolve())
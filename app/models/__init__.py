@@ -4,3 +4,5 @@ from .usuario import Usuario
 from .virtual_machine import VirtualMachine
 from .matricula import Matricula
 from .horario import Horario
+from .job import Job
+from .ip_allocation import IpAllocation
@@ -8,6 +8,7 @@ class Asignatura(db.Model):
         nombre (str): Nombre de la asignatura
         descripcion (str): Descripción de la asignatura
         profesor_id (int): ID del profesor que imparte la asignatura
+        warm_pool_size (int): Número de clones de reserva, ya aprovisionados, que se mantienen para los nuevos alumnos
 
         laboratorios (list[Laboratorio]): Lista de laboratorios asociados a la asignatura
         matriculas (list[Matricula]): Lista de matrículas asociadas a la asignatura
@@ -20,13 +21,14 @@ class Asignatura(db.Model):
     nombre = db.Column(db.String(100), nullable=False, unique=True)
     descripcion = db.Column(db.String(255), nullable=False)
     profesor_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
+    warm_pool_size = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     laboratorios = db.relationship('Laboratorio', back_populates='asignatura', cascade='all, delete-orphan', passive_deletes=True)
     matriculas = db.relationship('Matricula', back_populates='asignatura', cascade='all, delete-orphan', passive_deletes=True)
     horarios = db.relationship('Horario', back_populates='asignatura', cascade='all, delete-orphan', passive_deletes=True)
     virtual_machines = db.relationship('VirtualMachine', back_populates='asignatura', lazy='dynamic')
 
-    def __init__(self, nombre, profesor_id, descripcion=None):
+    def __init__(self, nombre, profesor_id, descripcion=None, warm_pool_size=0):
         """Constructor del modelo asignaturas
 
         :param nombre: Nombre de la asignatura
@@ -37,10 +39,14 @@ class Asignatura(db.Model):
 
         :param descripcion: Descripción de la asignatura (default: None)
         :type descripcion: str
+
+        :param warm_pool_size: Número de clones de reserva (default: 0)
+        :type warm_pool_size: int
         """
         self.nombre = nombre
         self.profesor_id = profesor_id
         self.descripcion = descripcion
+        self.warm_pool_size = warm_pool_size
 
     def serialize(self):
         """Serializa el objeto asignatura a un diccionario
@@ -53,6 +59,7 @@ class Asignatura(db.Model):
             'nombre': self.nombre,
             'descripcion': self.descripcion,
             'profesor_id': self.profesor_id,
+            'warm_pool_size': self.warm_pool_size,
         }
 
     def __repr__(self):
@@ -0,0 +1,51 @@
+from app.extensions import db
+
+class IpAllocation(db.Model):
+    """Modelo de la tabla ip_allocations en la base de datos
+
+    Reserva de una dirección del pool de IPs fijas para un clon. La reserva se
+    crea antes de clonar (cuando la VM todavía no está en virtual_machines),
+    por lo que no tiene clave foránea a la máquina virtual.
+
+    Atributos:
+        ip_address (str): Dirección IPv4 reservada
+        proxmox_id (int): ID en Proxmox de la VM a la que se asigna
+        created_at (datetime): Fecha de la reserva
+    """
+    __tablename__ = 'ip_allocations'
+
+    ip_address = db.Column(db.String(45), primary_key=True)
+    proxmox_id = db.Column(db.Integer, nullable=False, unique=True)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+
+    def __init__(self, ip_address, proxmox_id):
+        """Constructor del modelo ip_allocations
+
+        :param ip_address: Dirección IPv4 reservada
+        :type ip_address: str
+
+        :param proxmox_id: ID en Proxmox de la VM a la que se asigna
+        :type proxmox_id: int
+        """
+        self.ip_address = ip_address
+        self.proxmox_id = proxmox_id
+
+    def serialize(self):
+        """Serializa el objeto ip_allocations a un diccionario
+
+        :return: Diccionario con los datos de la reserva
+        :rtype: dict
+        """
+        return {
+            'ip_address': self.ip_address,
+            'proxmox_id': self.proxmox_id,
+            'created_at': self.created_at
+        }
+
+    def __repr__(self):
+        """Representación de la reserva como string
+
+        :return: Representación de la reserva
+        :rtype: str
+        """
+        return f"IpAllocation({self.ip_address} -> {self.proxmox_id})"
@@ -0,0 +1,88 @@
+from sqlalchemy.types import Enum
+from app.extensions import db
+
+JOB_STATUSES = ('pending', 'running', 'completed', 'failed')
+
+class Job(db.Model):
+    """Modelo de la tabla jobs en la base de datos
+
+    Representa una operación larga (clonación, eliminación, prueba de conexiones...)
+    que se ejecuta en segundo plano fuera de la petición HTTP.
+
+    Atributos:
+        id (int): ID del trabajo
+        job_type (str): Tipo de trabajo, identifica la función que lo ejecuta
+        status (str): Estado del trabajo ('pending', 'running', 'completed' o 'failed')
+        progress (int): Progreso del trabajo (0 - 100)
+        message (str): Último mensaje de progreso o de error
+        params (dict): Parámetros con los que se ejecuta el trabajo
+        result (dict): Resultado del trabajo, incluye los mensajes para el usuario
+        user_id (int): ID del usuario que lanzó el trabajo
+        worker (str): Proceso que ejecuta el trabajo (host:pid)
+        created_at (datetime): Fecha de creación del trabajo
+        started_at (datetime): Fecha de inicio de la ejecución
+        finished_at (datetime): Fecha de finalización de la ejecución
+    """
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(50), nullable=False)
+    status = db.Column(Enum(*JOB_STATUSES, name='job_status'), nullable=False, default='pending', index=True)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.Text, nullable=True)
+    params = db.Column(db.JSON, nullable=True)
+    result = db.Column(db.JSON, nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('usuarios.id', ondelete='SET NULL'), nullable=True)
+    worker = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __init__(self, job_type, params=None, user_id=None, worker=None):
+        """Constructor del modelo jobs
+
+        :param job_type: Tipo de trabajo
+        :type job_type: str
+
+        :param params: Parámetros del trabajo, deben ser serializables a JSON (default: None)
+        :type params: dict
+
+        :param user_id: ID del usuario que lanza el trabajo (default: None)
+        :type user_id: int
+
+        :param worker: Proceso que ejecutará el trabajo (default: None)
+        :type worker: str
+        """
+        self.job_type = job_type
+        self.params = params
+        self.user_id = user_id
+        self.worker = worker
+        self.status = 'pending'
+        self.progress = 0
+
+    def serialize(self):
+        """Serializa el objeto jobs a un diccionario
+
+        :return: Diccionario con los datos del trabajo
+        :rtype: dict
+        """
+        return {
+            'id': self.id,
+            'job_type': self.job_type,
+            'status': self.status,
+            'progress': self.progress,
+            'message': self.message,
+            'result': self.result,
+            'user_id': self.user_id,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+    def __repr__(self):
+        """Representación del trabajo como string
+
+        :return: Representación del trabajo
+        :rtype: str
+        """
+        return f"Job({self.id}, {self.job_type}, {self.status})"
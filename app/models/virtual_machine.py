@@ -1,4 +1,5 @@
 from cryptography.fernet import Fernet
+from sqlalchemy.types import Enum
 from app.extensions import db
 
 from app.models.asignatura import Asignatura
@@ -7,6 +8,8 @@ from app.models.usuario import Usuario
 from app.config import FlaskAppConfig
 key = FlaskAppConfig.ENCRYPTION_KEY # Clave de cifrado para las contraseñas VNC
 
+CLONE_MODES = ('full', 'linked')
+
 class VirtualMachine(db.Model):
     """Modelo de la tabla virtual_machines en la base de datos
 
@@ -21,7 +24,13 @@ class VirtualMachine(db.Model):
         vnc_password (str): Contraseña para la conexión VNC
 
         is_base_vm (bool): Indica si la máquina virtual es base
+        is_template (bool): Indica si la máquina virtual base se ha convertido en plantilla de Proxmox
         cloned_from (int): ID de la máquina virtual de la que se clonó
+        clone_mode (str): Tipo de clon ('full' o 'linked'), nulo para las máquinas base
+        ip_address (str): IP fija asignada por cloud-init desde el pool, nula si la VM usa DHCP
+        is_spare (bool): Indica si el clon es de reserva (sin usar) y se puede asignar al próximo alumno matriculado
+        idle_suspended_at (datetime): Fecha en la que se hibernó o apagó por inactividad, nula si no está en reposo
+        node (str): Nodo del clúster de Proxmox en el que se creó o al que se migró, nulo si es el nodo por defecto
         created_at (datetime): Fecha de creación de la máquina virtual
 
         asignatura (Asignatura): Asignatura a la que pertenece la máquina virtual
@@ -39,12 +48,18 @@ class VirtualMachine(db.Model):
     vnc_password = db.Column(db.Text, nullable=True)
 
     is_base_vm = db.Column(db.Boolean, default=False, nullable=False)
+    is_template = db.Column(db.Boolean, default=False, nullable=False)
     cloned_from = db.Column(
         db.Integer,
         db.ForeignKey('virtual_machines.proxmox_id', ondelete='SET NULL'),
         nullable=True,
         index = True
     )
+    clone_mode = db.Column(Enum(*CLONE_MODES, name='clone_mode'), nullable=True)
+    ip_address = db.Column(db.String(45), nullable=True, unique=True)
+    is_spare = db.Column(db.Boolean, default=False, nullable=False, server_default='0')
+    idle_suspended_at = db.Column(db.DateTime, nullable=True)
+    node = db.Column(db.String(100), nullable=True)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
 
     asignatura = db.relationship('Asignatura', back_populates='virtual_machines')
@@ -80,7 +95,7 @@ class VirtualMachine(db.Model):
         cipher_suite = Fernet(key)
         return cipher_suite.decrypt(self.vnc_password.encode()).decode() == vnc_password
 
-    def __init__(self, nombre, user_id, asignatura_id, proxmox_id, guacamole_connection_id=None, vnc_username=None, cloned_from=None, is_base_vm=False):
+    def __init__(self, nombre, user_id, asignatura_id, proxmox_id, guacamole_connection_id=None, vnc_username=None, cloned_from=None, is_base_vm=False, clone_mode=None, ip_address=None, is_spare=False, node=None):
         """Constructor del modelo virtual_machines
 
         :param nombre: Nombre de la máquina virtual
@@ -106,6 +121,18 @@ class VirtualMachine(db.Model):
 
         :param cloned_from: ID de la máquina virtual de la que se clonó (default: None)
         :type cloned_from: int
+
+        :param clone_mode: Tipo de clon, 'full' o 'linked' (default: None)
+        :type clone_mode: str
+
+        :param ip_address: IP fija asignada desde el pool (default: None)
+        :type ip_address: str
+
+        :param is_spare: Indica si el clon es de reserva (default: False)
+        :type is_spare: bool
+
+        :param node: Nodo del clúster de Proxmox de la máquina virtual (default: None)
+        :type node: str
         """
         self.proxmox_id = proxmox_id
         self.nombre = nombre
@@ -115,6 +142,10 @@ class VirtualMachine(db.Model):
         self.vnc_username = vnc_username
         self.is_base_vm = is_base_vm
         self.cloned_from = cloned_from
+        self.clone_mode = clone_mode
+        self.ip_address = ip_address
+        self.is_spare = is_spare
+        self.node = node
 
     def serialize(self):
         """Serializa el objeto virtual_machines a un diccionario
@@ -129,7 +160,13 @@ class VirtualMachine(db.Model):
             'asignatura_id': self.asignatura_id,
             'nombre': self.nombre,
             'is_base_vm': self.is_base_vm,
+            'is_template': self.is_template,
             'cloned_from': self.cloned_from,
+            'clone_mode': self.clone_mode,
+            'ip_address': self.ip_address,
+            'is_spare': self.is_spare,
+            'idle_suspended_at': self.idle_suspended_at,
+            'node': self.node,
             'created_at': self.created_at
         }
 
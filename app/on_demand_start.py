@@ -0,0 +1,143 @@
+import time, socket, logging
+from datetime import datetime, timedelta
+
+import app.proxmox as proxmox
+import app.guacamole as guacamole
+import app.admission_control as admission_control
+import app.utils.jobs as jobs
+from app.controllers import virtual_machines_controller, job_controller
+
+# Import the appropiate configuration
+from app.config import Config
+# from app.configUni import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Encendido bajo demanda
+## Fuera de las franjas del horario (o tras ponerse en reposo por inactividad) la VM de un
+## alumno está apagada. Al abrir el laboratorio se lanza un trabajo que la enciende y espera
+## a que su servidor VNC acepte conexiones; la página muestra el estado y carga el cliente
+## de Guacamole cuando termina. Cada alumno solo puede tener un encendido en curso y debe
+## esperar ON_DEMAND_START_COOLDOWN segundos entre encendidos, y en todo el nodo solo se
+## encienden ON_DEMAND_START_CONCURRENCY VMs a la vez (el resto espera su turno en orden).
+
+START_JOB_TYPE = 'start_student_vm'
+ACTIVE_STATUSES = ('pending', 'running')
+SLOT_POLL_INTERVAL = 2 # Segundos
+VNC_POLL_INTERVAL = 2 # Segundos
+
+class OnDemandStartException(Exception):
+    pass
+
+def get_vm_status(vmid):
+    """Obtiene el estado de una VM en Proxmox ('running', 'stopped'...)
+
+    :param vmid: ID de la VM
+    :type vmid: int
+
+    :return: El estado de la VM o None si no está en el nodo
+    :rtype: str
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    :raises ProxmoxError: Si no se puede obtener el estado de la VM
+    """
+    return proxmox.get_vms_status_snapshot([vmid]).get(int(vmid), {}).get('status')
+
+def request_start(virtual_machine, user_id):
+    """
+    Lanza el encendido de la VM de un alumno, o devuelve el que ya está en curso
+
+    Debe llamarse dentro del contexto de la aplicación.
+
+    :param virtual_machine: Máquina virtual del alumno
+    :type virtual_machine: VirtualMachine
+
+    :param user_id: ID del alumno
+    :type user_id: int
+
+    :return: ID del trabajo de encendido
+    :rtype: int
+
+    :raises OnDemandStartException: Si el alumno ha encendido su VM hace menos de ON_DEMAND_START_COOLDOWN segundos
+    """
+    latest = job_controller.get_latest_job(START_JOB_TYPE, user_id)
+    if latest is not None and latest.status in ACTIVE_STATUSES:
+        return latest.id
+
+    cooldown = timedelta(seconds=Config.PROXMOX.ON_DEMAND_START_COOLDOWN)
+    if latest is not None and latest.created_at and datetime.now() - latest.created_at < cooldown:
+        wait = int((cooldown - (datetime.now() - latest.created_at)).total_seconds()) + 1
+        raise OnDemandStartException(f"Ya ha encendido su máquina virtual hace poco, inténtelo de nuevo en {wait} segundos")
+
+    return jobs.submit_job(START_JOB_TYPE, user_id=user_id, proxmox_id=virtual_machine.proxmox_id)
+
+def wait_for_boot_slot(job_id):
+    """Espera a que haya menos de ON_DEMAND_START_CONCURRENCY encendidos por delante de este trabajo
+
+    Los trabajos se atienden en orden de creación, sea cual sea el proceso que los ejecute.
+
+    :param job_id: ID del trabajo de encendido
+    :type job_id: int
+    """
+    while job_controller.count_jobs_ahead(job_id, START_JOB_TYPE, 'running') >= Config.PROXMOX.ON_DEMAND_START_CONCURRENCY:
+        time.sleep(SLOT_POLL_INTERVAL)
+
+def start_and_wait(proxmox_id):
+    """Enciende una VM (si no lo está) y espera a que esté en marcha
+
+    Si la VM se había puesto en reposo por inactividad, deja de estarlo. Si no hay
+    memoria libre en el nodo, se espera hasta ADMISSION_QUEUE_TIMEOUT segundos.
+
+    :param proxmox_id: ID de la VM
+    :type proxmox_id: int
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    :raises TimeoutError: Si la VM no arranca en ON_DEMAND_START_TIMEOUT segundos
+    :raises AdmissionException: Si el nodo no tiene memoria para la VM
+    """
+    if get_vm_status(proxmox_id) != 'running':
+        with admission_control.start_admission([proxmox_id], Config.PROXMOX.ADMISSION_QUEUE_TIMEOUT) as (admitted, _, reason):
+            if not admitted:
+                raise admission_control.AdmissionException(reason)
+
+            proxmox.start_vm(proxmox_id)
+            proxmox.wait_for_vms_status([proxmox_id], 'running', Config.PROXMOX.ON_DEMAND_START_TIMEOUT)
+
+    virtual_machines_controller.update_virtual_machine(proxmox_id, idle_suspended_at=None)
+
+def wait_for_vnc(virtual_machine):
+    """Espera a que el servidor VNC de la VM acepte conexiones TCP
+
+    La dirección y el puerto se toman de la conexión de Guacamole de la VM.
+
+    :param virtual_machine: Máquina virtual del alumno
+    :type virtual_machine: VirtualMachine
+
+    :return: True si el servidor VNC responde, False si no lo hace en ON_DEMAND_VNC_TIMEOUT segundos o no se conoce su dirección
+    :rtype: bool
+    """
+    if virtual_machine.guacamole_connection_id is None:
+        return False
+
+    try:
+        parameters = guacamole.get_guacamole_connection_parameters(
+            guacamole.get_guacamole_token(), virtual_machine.guacamole_connection_id
+        )
+    except (guacamole.GuacamoleError, ValueError) as e:
+        logger.warning(f"Could not get the VNC address of VM {virtual_machine.proxmox_id}: {e}")
+        return False
+
+    if not parameters or not parameters.get('hostname'):
+        return False
+
+    address = (parameters['hostname'], int(parameters.get('port') or 5900))
+    deadline = time.monotonic() + Config.PROXMOX.ON_DEMAND_VNC_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(address, timeout=VNC_POLL_INTERVAL):
+                return True
+        except OSError:
+            time.sleep(VNC_POLL_INTERVAL)
+
+    return False
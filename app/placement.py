@@ -0,0 +1,158 @@
+import logging
+
+import app.proxmox as proxmox
+import app.admission_control as admission_control
+from app.controllers import virtual_machines_controller
+
+# Import the appropiate configuration
+from app.config import Config
+# from app.configUni import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Reparto de los clones entre los nodos del clúster
+## Config.PROXMOX.PLACEMENT_POLICY decide en qué nodo se crea cada clon:
+## - local: en el nodo de la VM base (como con un único nodo)
+## - least-loaded: en el nodo con menos memoria ocupada, contando los clones ya repartidos
+## - spread: repartiendo los clones de cada asignatura entre los nodos por igual
+## Con Config.PROXMOX.CLONE_STORAGE los clones completos se guardan en ese almacenamiento y
+## solo se usan los nodos que lo tienen.
+## Proxmox solo crea un clon en otro nodo si los discos de la VM base están en un
+## almacenamiento compartido; si no, el clon completo se crea en el nodo de la VM base y
+## después se migra. Los clones enlazados de una VM base en un almacenamiento local no se
+## pueden mover y se quedan en su nodo.
+
+PLACEMENT_POLICIES = ('local', 'least-loaded', 'spread')
+
+def get_candidate_nodes():
+    """
+    Obtiene los nodos del clúster en los que se pueden crear clones
+
+    Son los nodos en línea de Config.PROXMOX.CLUSTER_NODES que tienen activo
+    Config.PROXMOX.CLONE_STORAGE (si está definido).
+
+    :return: Lista de nodos (node, mem, maxmem, cpu...)
+    :rtype: list[dict]
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    :raises ProxmoxError: Si no se pueden obtener los nodos o sus almacenamientos
+    """
+    nodes = [node for node in proxmox.get_cluster_nodes() if node.get('status') == 'online']
+    if not Config.PROXMOX.CLONE_STORAGE:
+        return nodes
+
+    return [
+        node for node in nodes
+        if any(
+            storage['storage'] == Config.PROXMOX.CLONE_STORAGE and storage.get('active', 1)
+            for storage in proxmox.get_node_storages(node['node'])
+        )
+    ]
+
+def is_on_shared_storage(vmid):
+    """Indica si todos los discos de una VM están en almacenamientos compartidos
+
+    :param vmid: ID de la VM
+    :type vmid: int
+
+    :return: True si Proxmox puede crear sus clones directamente en otro nodo
+    :rtype: bool
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    :raises ProxmoxError: Si no se pueden obtener la configuración de la VM o los almacenamientos
+    """
+    disks = admission_control.get_vm_disks(proxmox.get_vm_config(vmid))
+    shared = {
+        storage['storage'] for storage in proxmox.get_node_storages(proxmox.get_vm_node(vmid))
+        if storage.get('shared')
+    }
+    return all(name in shared for name in disks)
+
+def _subject_clones_per_node(asignatura_id):
+    counts = {}
+    for vm in virtual_machines_controller.get_virtual_machine_by_asignatura(asignatura_id):
+        if not vm.is_base_vm:
+            node = vm.node or proxmox.get_vm_node(vm.proxmox_id)
+            counts[node] = counts.get(node, 0) + 1
+
+    return counts
+
+def plan_clone_placement(base_vmid, new_vmids, asignatura_id, linked=False):
+    """
+    Decide el nodo de cada clon según Config.PROXMOX.PLACEMENT_POLICY
+
+    Si no se pueden consultar los nodos, todos los clones se crean en el nodo de
+    la VM base.
+
+    :param base_vmid: ID de la VM a clonar
+    :type base_vmid: int
+
+    :param new_vmids: IDs de los nuevos clones
+    :type new_vmids: list[int]
+
+    :param asignatura_id: ID de la asignatura de los clones
+    :type asignatura_id: int
+
+    :param linked: Se van a crear clones enlazados (default: False)
+    :type linked: bool
+
+    :return: Diccionario ID del clon -> {'node', 'migrate', 'storage'}. Con migrate el clon
+        se crea en el nodo de la VM base y después se migra a node
+    :rtype: dict
+    """
+    source = proxmox.get_vm_node(base_vmid)
+    policy = Config.PROXMOX.PLACEMENT_POLICY
+    storage = None if linked else (Config.PROXMOX.CLONE_STORAGE or None)
+
+    def on_source():
+        return {vmid: {'node': source, 'migrate': False, 'storage': storage} for vmid in new_vmids}
+
+    if policy not in PLACEMENT_POLICIES:
+        logger.warning(f"Unknown placement policy '{policy}', cloning on the base VM node")
+        return on_source()
+
+    if policy == 'local':
+        return on_source()
+
+    try:
+        direct = is_on_shared_storage(base_vmid)
+        if linked and not direct:
+            logger.info(f"VM {base_vmid} is on local storage, its linked clones stay on node {source}")
+            return on_source()
+
+        nodes = get_candidate_nodes()
+        clone_memory = proxmox.get_vms_status_snapshot([base_vmid]).get(int(base_vmid), {}).get('maxmem', 0)
+        counts = _subject_clones_per_node(asignatura_id) if policy == 'spread' else {}
+    except Exception as e:
+        logger.warning(f"Could not plan the placement of the clones, cloning on the base VM node: {e}")
+        return on_source()
+
+    if not nodes:
+        logger.warning("No cluster node can host the clones, cloning on the base VM node")
+        return on_source()
+
+    # Memoria que ocuparían los clones ya repartidos en cada nodo
+    planned = {node['node']: 0 for node in nodes}
+
+    def load(node):
+        return (node.get('mem', 0) + planned[node['node']]) / node['maxmem'] if node.get('maxmem') else 1
+
+    placement = {}
+    for vmid in new_vmids:
+        if policy == 'spread':
+            node = min(nodes, key=lambda n: (counts.get(n['node'], 0), load(n)))
+            counts[node['node']] = counts.get(node['node'], 0) + 1
+        else:
+            node = min(nodes, key=load)
+
+        planned[node['node']] += clone_memory
+        placement[vmid] = {
+            'node': node['node'],
+            'migrate': not direct and node['node'] != source,
+            'storage': storage
+        }
+
+    nodes_by_clone = {vmid: p['node'] for vmid, p in placement.items()}
+    logger.info(f"Placement of the clones of VM {base_vmid} ({policy}): {nodes_by_clone}")
+    return placement
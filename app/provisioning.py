@@ -0,0 +1,247 @@
+import asyncio, logging
+
+import app.proxmox as proxmox
+import app.guacamole as guacamole
+import app.ip_resolution as ip_resolution
+
+# Import the appropiate configuration
+from app.config import Config
+# from app.configUni import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CONNECTION_BATCH_WINDOW = 0.5 # Segundos que se esperan a otros clones con IP antes de crear sus conexiones
+
+class _ConnectionBatcher:
+    """
+    Agrupa las conexiones de Guacamole de los clones que ya tienen IP
+
+    Cada clon pide su conexión con create() y espera el resultado. Las peticiones
+    que llegan dentro de la misma ventana (o hasta llenar un lote) se crean con una
+    única llamada a guacamole.bulk_create_guacamole_connections.
+    """
+    def __init__(self, token, limit, window=CONNECTION_BATCH_WINDOW, max_size=guacamole.PATCH_CHUNK_SIZE):
+        self._token = token
+        self._limit = limit
+        self._window = window
+        self._max_size = max_size
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+
+    async def create(self, vmid, connection):
+        """Encola la conexión de un clon y espera a que se cree
+
+        :return: ID de la conexión creada
+        :rtype: str
+
+        :raises GuacamoleError: Si no se puede crear la conexión
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((vmid, connection, future))
+
+        if len(self._pending) >= self._max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch):
+        async with self._limit:
+            try:
+                # El cliente de Guacamole es síncrono, se ejecuta en un hilo aparte
+                connection_ids, errors = await asyncio.to_thread(
+                    guacamole.bulk_create_guacamole_connections,
+                    self._token,
+                    {vmid: connection for vmid, connection, _ in batch}
+                )
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                return
+
+        for vmid, _, future in batch:
+            if vmid in connection_ids:
+                future.set_result(connection_ids[vmid])
+            else:
+                future.set_exception(guacamole.GuacamoleError(errors.get(vmid, "No se ha podido crear la conexión")))
+
+async def async_provision_clones(
+    vmid, base_vm_name, new_starting_id, number_of_clones=1,
+    clone_timeout=60, linked=False, connection_data=None, on_progress=None, ip_configs=None, placement=None
+):
+    """
+    Aprovisiona clones de una VM como un pipeline: clonación -> arranque y
+    obtención de la IP -> creación de la conexión de Guacamole
+
+    Si alguna fuente de ip_resolution conoce la IP del clon, no se enciende. Los
+    clones con IP fija (ip_configs) pasan directamente de la clonación a la conexión.
+    Con placement cada clon se crea en el nodo que le corresponde (o se crea en el
+    nodo de la VM base y se migra a él, ver app/placement.py) antes de arrancarlo.
+
+    Cada clon pasa a la siguiente etapa en cuanto termina la anterior, sin
+    esperar al resto (p. ej. el clon 1 puede estar arrancando mientras el clon 5
+    se sigue copiando). Cada etapa tiene su propio límite de concurrencia:
+        - Clonación: Config.PROXMOX.CLONE_CONCURRENCY
+        - Arranque e IP: Config.PROXMOX.BOOT_CONCURRENCY
+        - Conexiones de Guacamole: Config.GUACAMOLE.CONNECTION_CONCURRENCY lotes a la vez
+
+    Las conexiones de los clones que obtienen su IP con poca diferencia de tiempo
+    se crean juntas en una única petición (ver _ConnectionBatcher).
+
+    Los errores de un clon no detienen al resto; se devuelven en su resultado.
+
+    :param vmid: ID de la VM a clonar
+    :type vmid: int
+
+    :param base_vm_name: Nombre base para los clones (clone-{new_id}-{base_vm_name})
+    :type base_vm_name: str
+
+    :param new_starting_id: ID inicial para los nuevos clones
+    :type new_starting_id: int
+
+    :param number_of_clones: Número de clones a crear (default: 1)
+    :type number_of_clones: int
+
+    :param clone_timeout: Tiempo máximo (segundos) para crear cada clon (default: 60 segundos)
+    :type clone_timeout: int
+
+    :param linked: Crear clones enlazados (default: False)
+    :type linked: bool
+
+    :param connection_data: Datos para crear las conexiones de Guacamole o None para no crearlas. Diccionario con:
+        - token: Token de Guacamole
+        - name: Nombre base de las conexiones (clone-{new_id}-{name})
+        - vnc_username: Usuario VNC
+        - vnc_password: Contraseña VNC
+    :type connection_data: dict
+
+    :param on_progress: Función on_progress(vmid, stage, detail) a la que se avisa cuando un clon cambia de etapa.
+        Las etapas son 'cloning', 'migrating' (detail: nodo), 'cloned', 'booting', 'ip_found' (detail: IP), 'connection_created'
+        (detail: ID de la conexión) y 'failed' (detail: error) (default: None)
+    :type on_progress: callable
+
+    :param ip_configs: Diccionario ID del clon -> valor de ipconfig0 de cloud-init con su IP fija (default: None)
+    :type ip_configs: dict
+
+    :param placement: Diccionario ID del clon -> {'node', 'migrate', 'storage'} de placement.plan_clone_placement
+        (default: None, todos en el nodo de la VM base)
+    :type placement: dict
+
+    :return: Diccionario vmid -> {'cloned', 'node', 'ip', 'connection_id', 'error'}. 'cloned' es None si la
+        clonación agotó el tiempo y no se sabe si el clon existe en Proxmox
+    :rtype: dict
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    :raises ProxmoxError: Si la VM de origen no se puede preparar para la clonación
+    """
+    ip_configs = ip_configs or {}
+    placement = placement or {}
+    clone_limit = asyncio.Semaphore(Config.PROXMOX.CLONE_CONCURRENCY)
+    boot_limit = asyncio.Semaphore(Config.PROXMOX.BOOT_CONCURRENCY)
+    connection_limit = asyncio.Semaphore(Config.GUACAMOLE.CONNECTION_CONCURRENCY)
+
+    def notify(new_vmid, stage, detail=None):
+        if on_progress is None:
+            return
+        try:
+            on_progress(new_vmid, stage, detail)
+        except Exception as e:
+            logger.warning(f"Progress callback failed for clone {new_vmid} ({stage}): {e}")
+
+    connections = None
+    if connection_data is not None:
+        connections = _ConnectionBatcher(connection_data['token'], connection_limit)
+
+    async with proxmox.AsyncProxmoxClient() as client:
+        await proxmox.async_prepare_clone_source(client, vmid, linked)
+
+        async def provision_one(new_vmid):
+            result = {'cloned': False, 'node': None, 'ip': None, 'connection_id': None, 'error': None}
+            place = placement.get(new_vmid, {})
+            try:
+                async with clone_limit:
+                    notify(new_vmid, 'cloning')
+                    try:
+                        await proxmox.async_clone_one(
+                            client, vmid, new_vmid, f"clone-{new_vmid}-{base_vm_name}",
+                            clone_timeout, linked, ip_configs.get(new_vmid),
+                            target=None if place.get('migrate') else place.get('node'),
+                            storage=None if place.get('migrate') else place.get('storage')
+                        )
+                    except proxmox.UnconfiguredCloneError:
+                        # El clon sigue en Proxmox: se marca como creado para que se guarde con su error
+                        result['cloned'] = True
+                        result['node'] = await proxmox.async_get_vm_node(client, new_vmid)
+                        raise
+                    except proxmox.UnfinishedCloneError:
+                        # No se sabe si el clon existe: quien guarda los clones lo busca en Proxmox
+                        result['cloned'] = None
+                        raise
+                    result['cloned'] = True
+                    result['node'] = await proxmox.async_get_vm_node(client, new_vmid)
+
+                    if place.get('migrate'):
+                        notify(new_vmid, 'migrating', place['node'])
+                        await proxmox.async_migrate_vm(
+                            client, new_vmid, place['node'], Config.PROXMOX.MIGRATION_TIMEOUT, place.get('storage')
+                        )
+                        result['node'] = place['node']
+                notify(new_vmid, 'cloned')
+
+                if connection_data is None:
+                    return result
+
+                # Solo se enciende el clon si ninguna fuente conoce ya su IP
+                if new_vmid in ip_configs:
+                    result['ip'] = ip_resolution.ip_from_ipconfig(ip_configs[new_vmid])
+                else:
+                    result['ip'] = await ip_resolution.async_resolve_vm_ip(client, new_vmid)
+                if result['ip'] is None:
+                    async with boot_limit:
+                        notify(new_vmid, 'booting')
+                        result['ip'] = await proxmox.async_boot_and_get_ip(client, new_vmid)
+                notify(new_vmid, 'ip_found', result['ip'])
+
+                result['connection_id'] = await connections.create(new_vmid, {
+                    'virtual_machine_ip': result['ip'],
+                    'connection_name': f"clone-{new_vmid}-{connection_data['name']}",
+                    'virtual_machine_username': connection_data['vnc_username'],
+                    'connection_password': connection_data['vnc_password']
+                })
+                notify(new_vmid, 'connection_created', result['connection_id'])
+
+            except Exception as e:
+                logger.error(f"Failed to provision clone {new_vmid}: {e}")
+                result['error'] = str(e)
+                notify(new_vmid, 'failed', result['error'])
+
+            return result
+
+        new_vmids = [new_starting_id + i for i in range(number_of_clones)]
+        results = await asyncio.gather(*(provision_one(new_vmid) for new_vmid in new_vmids))
+
+    return dict(zip(new_vmids, results))
+
+def provision_clones(*args, **kwargs):
+    """
+    Versión síncrona de async_provision_clones para las rutas de Flask
+
+    :return: Diccionario vmid -> {'cloned', 'node', 'ip', 'connection_id', 'error'}
+    :rtype: dict
+    """
+    return asyncio.run(async_provision_clones(*args, **kwargs))
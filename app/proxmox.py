@@ -1,4 +1,7 @@
-import time, logging, json
+import time, logging, json, asyncio, threading
+from contextlib import asynccontextmanager
+
+import httpx
 from proxmoxer import ProxmoxAPI
 
 # Import the appropiate configuration
@@ -9,9 +12,17 @@ from app.config import Config
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Define the Proxmox node to connect to
+# Nodo por defecto: en él se crean las VMs base y se buscan las VMs que no aparecen en el clúster
 proxmox_node = Config.PROXMOX.NODE_NAME
 
+# Nodo en el que está cada VM, según la última consulta a cluster/resources
+_vm_nodes = {} # vmid -> nodo
+
+# Intervalos (segundos) de la espera adaptativa usada al comprobar tareas y estados
+POLL_INITIAL_INTERVAL = 0.5
+POLL_MAX_INTERVAL = 5
+POLL_BACKOFF_FACTOR = 1.5
+
 class ProxmoxConnection:
     """
     Clase Singleton para manejar la conexión con Proxmox
@@ -58,41 +69,198 @@ class ProxmoxConnection:
 class ProxmoxError(Exception):
     pass
 
-def wait_for_task(task_upid, timeout=60, interval=5):
+class UnconfiguredCloneError(ProxmoxError):
+    """El clon se ha creado en Proxmox pero no se ha podido configurar ni borrar"""
+    pass
+
+class UnfinishedCloneError(ProxmoxError):
+    """La tarea de clonación ha agotado el tiempo y no se ha podido detener: no se sabe si el clon existe"""
+    pass
+
+def _backoff_intervals(initial=POLL_INITIAL_INTERVAL, maximum=POLL_MAX_INTERVAL, factor=POLL_BACKOFF_FACTOR):
     """
-    Función de ayuda para esperar a que una tarea de Proxmox termine
+    Genera los intervalos de espera entre comprobaciones
 
-    :param task_upid: El UPID de la tarea a esperar
-    :type task_upid: str
+    Los primeros intervalos son cortos para detectar rápido las operaciones que
+    terminan enseguida y van creciendo hasta el máximo para no saturar la API.
+    """
+    interval = initial
+    while True:
+        yield interval
+        interval = min(interval * factor, maximum)
+
+# Clúster
+## Las VMs pueden estar en cualquier nodo del clúster (Config.PROXMOX.CLUSTER_NODES, o todos
+## si está vacío). Cada consulta a cluster/resources actualiza el nodo de las VMs que devuelve,
+## y las operaciones sobre una VM usan su nodo en lugar de un nodo fijo.
+def is_managed_node(node):
+    """Indica si la aplicación usa un nodo del clúster
+
+    :param node: Nombre del nodo
+    :type node: str
+
+    :return: True si Config.PROXMOX.CLUSTER_NODES está vacío o incluye el nodo
+    :rtype: bool
+    """
+    nodes = [name.strip() for name in Config.PROXMOX.CLUSTER_NODES.split(',') if name.strip()]
+    return not nodes or node in nodes
 
-    :param timeout: El tiempo máximo para esperar a que la tarea termine (default: 60 segundos)
-    :type timeout: int
+def _remember_vm_nodes(resources):
+    for vm in resources:
+        if vm.get('node'):
+            _vm_nodes[vm['vmid']] = vm['node']
 
-    :param interval: El intervalo para comprobar si la tarea ha terminado (default: 5 segundos)
-    :type interval: int
+def set_vm_node(vmid, node):
+    """Registra el nodo de una VM recién creada o migrada
 
-    :raises TimeoutError: Si la tarea no termina en el tiempo dado
-    :raises ProxmoxError: Si la tarea falla al ejecutarse
+    :param vmid: ID de la VM
+    :type vmid: int
+
+    :param node: Nombre del nodo, None para olvidarlo (p. ej. al borrar la VM)
+    :type node: str
+    """
+    if node is None:
+        _vm_nodes.pop(int(vmid), None)
+    else:
+        _vm_nodes[int(vmid)] = node
+
+def get_vm_node(vmid):
+    """
+    Obtiene el nodo del clúster en el que está una VM
+
+    Si la VM no se conoce todavía, se consulta cluster/resources. Si no aparece
+    (o no se puede consultar) se devuelve el nodo por defecto.
+
+    :param vmid: ID de la VM
+    :type vmid: int
+
+    :return: Nombre del nodo
+    :rtype: str
+    """
+    node = _vm_nodes.get(int(vmid))
+    if node is None:
+        try:
+            get_vms_status_snapshot()
+        except Exception as e:
+            logger.warning(f"Failed to locate VM {vmid} in the cluster: {e}")
+        node = _vm_nodes.get(int(vmid), proxmox_node)
+
+    return node
+
+def get_cluster_nodes():
+    """
+    Obtiene los nodos del clúster que usa la aplicación, con su carga
+
+    :return: Lista de nodos (node, status, cpu, maxcpu, mem, maxmem, disk, maxdisk...)
+    :rtype: list[dict]
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    :raises ProxmoxError: Si no se pueden obtener los nodos
     """
     proxmox = get_proxmox_conn()
+    try:
+        resources = proxmox.cluster.resources.get(type='node')
+    except Exception as e:
+        raise ProxmoxError(f"Se ha fallado al obtener los nodos del clúster: {e}")
 
-    logger.info(f"Waiting for task {task_upid} to finish...")
+    return [node for node in resources if is_managed_node(node.get('node'))]
 
-    # Wait until the task is finished
-    elapsed_time = 0
-    while elapsed_time < timeout:
-        task_status = proxmox.nodes(proxmox_node).tasks(task_upid).status.get()
-        if task_status and task_status['status'] == 'stopped':
-            logger.info(f"Task {task_upid} finished with status: {task_status['exitstatus']}")
-            return
+def _node_from_upid(task_upid):
+    # UPID:{node}:{pid}:{pstart}:{starttime}:{type}:{id}:{user}:
+    parts = task_upid.split(':')
+    return parts[1] if len(parts) > 1 else proxmox_node
+
+def get_tasks_status(task_upids):
+    """
+    Obtiene el estado de varias tareas de Proxmox con una sola petición a cluster/tasks
+
+    Las tareas que no aparecen en la lista del clúster (por ser antiguas) se
+    consultan individualmente.
+
+    :param task_upids: Lista de UPIDs de las tareas
+    :type task_upids: list[str]
+
+    :return: Diccionario UPID -> exitstatus, o None si la tarea sigue en curso
+    :rtype: dict
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    """
+    return _run_sync(async_get_tasks_status(None, task_upids))
+
+def get_vms_status_snapshot(vmids=None):
+    """
+    Obtiene el estado de todas las VMs del clúster con una sola petición a cluster/resources
+
+    Sustituye a las llamadas a qemu(vmid).status.current por cada VM en las
+    operaciones por lotes: con N VMs se hace 1 petición en lugar de N.
+
+    :param vmids: IDs de las VMs a incluir. Si es None se incluyen todas (default: None)
+    :type vmids: list[int]
+
+    :return: Diccionario vmid -> datos de la VM (node, status, name, cpu, mem, maxmem, maxdisk, uptime, netin, netout...)
+    :rtype: dict
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    :raises ProxmoxError: Si no se puede obtener el estado de las VMs
+    """
+    return _run_sync(async_get_vms_status_snapshot(None, vmids))
+
+def wait_for_tasks(task_upids, timeout=60):
+    """
+    Espera a que terminen varias tareas de Proxmox
+
+    En cada comprobación se consulta el estado de todas las tareas pendientes a la vez.
+
+    :param task_upids: Lista de UPIDs de las tareas a esperar
+    :type task_upids: list[str]
+
+    :param timeout: El tiempo máximo (segundos) para esperar a que las tareas terminen (default: 60 segundos)
+    :type timeout: int
+
+    :return: Diccionario UPID -> exitstatus de las tareas terminadas
+    :rtype: dict
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    :raises TimeoutError: Si alguna tarea no termina en el tiempo dado
+    """
+    return _run_sync(async_wait_for_tasks(None, task_upids, timeout))
+
+def wait_for_vms_status(vmids, status, timeout=60):
+    """
+    Espera a que varias VMs alcancen un estado ('running', 'stopped'...)
+
+    En cada comprobación se obtiene el estado de todas las VMs con una sola petición.
+
+    :param vmids: Lista de IDs de las VMs
+    :type vmids: list[int]
+
+    :param status: El estado esperado
+    :type status: str
+
+    :param timeout: El tiempo máximo (segundos) para esperar (default: 60 segundos)
+    :type timeout: int
 
-        elif task_status and task_status['status'] in ['failed']:
-            raise ProxmoxError(f"La tarea {task_upid} ha fallado")
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    :raises TimeoutError: Si alguna VM no alcanza el estado en el tiempo dado
+    """
+    _run_sync(async_wait_for_vms_status(None, vmids, status, timeout))
+
+def wait_for_task(task_upid, timeout=60):
+    """
+    Función de ayuda para esperar a que una tarea de Proxmox termine
+
+    :param task_upid: El UPID de la tarea a esperar
+    :type task_upid: str
 
-        time.sleep(interval)
-        elapsed_time += interval
+    :param timeout: El tiempo máximo para esperar a que la tarea termine (default: 60 segundos)
+    :type timeout: int
 
-    raise TimeoutError(f"La tarea {task_upid} no terminó en {timeout} segundos")
+    :raises TimeoutError: Si la tarea no termina en el tiempo dado
+    :raises ProxmoxError: Si la tarea falla al ejecutarse
+    """
+    exitstatus = wait_for_tasks([task_upid], timeout)[task_upid]
+    if exitstatus != 'OK':
+        raise ProxmoxError(f"La tarea {task_upid} ha fallado: {exitstatus}")
 
 # UNUSED
 def get_proxmox_credentials():
@@ -149,14 +317,17 @@ def get_proxmox_conn():
 
     return proxmox
 
-def get_node_status():
+def get_node_status(node=None):
     """
-    Obtiene el estado del nodo de Proxmox.
+    Obtiene el estado de un nodo de Proxmox.
 
     Esta función es utilizada en las pruebas de rendimiento para comprobar los recursos del nodo durante ciertas operaciones.
+
+    :param node: Nombre del nodo (default: el nodo por defecto)
+    :type node: str
     """
     proxmox = get_proxmox_conn()
-    node_status = proxmox.nodes(proxmox_node).status.get()
+    node_status = proxmox.nodes(node or proxmox_node).status.get()
 
     if not node_status:
         raise ProxmoxError("No se han podido obtener los datos del nodo")
@@ -169,10 +340,124 @@ def get_node_status():
 
     return data
 
+def get_node_storages(node=None):
+    """
+    Obtiene los almacenamientos de un nodo de Proxmox con su espacio libre
+
+    :param node: Nombre del nodo (default: el nodo por defecto)
+    :type node: str
+
+    :return: Lista de almacenamientos (storage, type, content, shared, total, used, avail, active...)
+    :rtype: list[dict]
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    :raises ProxmoxError: Si no se pueden obtener los almacenamientos
+    """
+    proxmox = get_proxmox_conn()
+    try:
+        return proxmox.nodes(node or proxmox_node).storage.get()
+    except Exception as e:
+        raise ProxmoxError(f"Se ha fallado al obtener los almacenamientos del nodo {node or proxmox_node}: {e}")
+
+def get_vm_config(vmid):
+    """
+    Obtiene la configuración de una VM en Proxmox (discos, interfaces, memoria...)
+
+    :param vmid: ID de la VM
+    :type vmid: int
+
+    :return: La configuración de la VM
+    :rtype: dict
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    :raises ProxmoxError: Si no se puede obtener la configuración de la VM
+    """
+    proxmox = get_proxmox_conn()
+    try:
+        return proxmox.nodes(get_vm_node(vmid)).qemu(vmid).config.get() or {}
+    except Exception as e:
+        raise ProxmoxError(f"Se ha fallado al obtener la configuración de la VM {vmid}: {e}")
+
+# Inventario en caché
+## Las páginas de administración listan las VMs del clúster en cada carga. Para no repetir la
+## consulta a cluster/resources con cientos de VMs (o con la API de Proxmox lenta), el inventario
+## se guarda durante Config.PROXMOX.INVENTORY_CACHE_TTL segundos. Las operaciones de la propia
+## aplicación que cambian las VMs (crear, clonar, migrar, borrar, encender, apagar...) lo
+## invalidan; los cambios hechos desde fuera se ven, como mucho, pasado el TTL.
+class _InventoryCache:
+    """Última respuesta de cluster/resources, compartida por los hilos del proceso"""
+    def __init__(self):
+        self.vms = None
+        self.fetched_at = 0
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, max_age):
+        with self.lock:
+            if self.vms is not None and time.monotonic() - self.fetched_at <= max_age:
+                return self.vms
+            generation = self.generation
+
+        # La consulta se hace sin el candado para no bloquear a los demás hilos
+        vms = get_vms_status_snapshot()
+        with self.lock:
+            # Si se ha invalidado durante la consulta, la respuesta puede no incluir el cambio
+            if generation == self.generation:
+                self.vms = vms
+                self.fetched_at = time.monotonic()
+
+        return vms
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.vms = None
+
+_inventory = _InventoryCache()
+
+def get_inventory(max_age=None):
+    """
+    Obtiene el estado de todas las VMs del clúster, usando el inventario en caché si es reciente
+
+    :param max_age: Antigüedad máxima en segundos del inventario, 0 para consultarlo siempre
+        (default: Config.PROXMOX.INVENTORY_CACHE_TTL)
+    :type max_age: int
+
+    :return: Diccionario vmid -> datos de la VM, como get_vms_status_snapshot
+    :rtype: dict
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    :raises ProxmoxError: Si no se puede obtener el estado de las VMs
+    """
+    if max_age is None:
+        max_age = Config.PROXMOX.INVENTORY_CACHE_TTL
+
+    return _inventory.get(max_age)
+
+def invalidate_inventory():
+    """Descarta el inventario en caché tras cambiar alguna VM"""
+    _inventory.invalidate()
+
+def _serialize_vm(vm):
+    return {
+        'id': vm['vmid'],
+        'name': vm['name'],
+        'status': vm['status'],
+        'uptime': vm['uptime'],
+        'maxdisk': vm['maxdisk'],
+        'maxmem': vm['maxmem'],
+        'node': vm['node']
+        # 'ip': vm_ip if vm['status'] == 'running' else None
+    }
+
 # Como proxmox devuelve muchos datos innecesarios, se usa este método para devolver solo aquellos datos útiles para el frontend
-def get_all_vms_serialized():
+def get_all_vms_serialized(max_age=None):
     """
-    Obtiene una lista de las VMs en Proxmox con los datos necesarios para el frontend
+    Obtiene una lista de las VMs de los nodos del clúster con los datos necesarios para el frontend
+
+    :param max_age: Antigüedad máxima en segundos del inventario, 0 para consultarlo siempre
+        (default: Config.PROXMOX.INVENTORY_CACHE_TTL)
+    :type max_age: int
 
     :return: La lista de VMs serializadas
     :rtype: list
@@ -181,24 +466,12 @@ def get_all_vms_serialized():
     :raises ProxmoxError: Si no se pueden obtener las VMs de Proxmox
     """
     try:
-        proxmox = get_proxmox_conn()
-        vms = proxmox.nodes(proxmox_node).qemu.get()
+        vms = [vm for vm in get_inventory(max_age).values() if vm.get('type') == 'qemu']
 
         if not vms:
             return []
 
-        vms_serialized = [
-            {
-                'id': vm['vmid'],
-                'name': vm['name'],
-                'status': vm['status'],
-                'uptime': vm['uptime'],
-                'maxdisk': vm['maxdisk'],
-                'maxmem': vm['maxmem']
-                # 'ip': vm_ip if vm['status'] == 'running' else None
-            }
-            for vm in vms
-        ]
+        vms_serialized = [_serialize_vm(vm) for vm in vms]
 
     except ConnectionError as e:
         logger.error(f"Failed to connect to Proxmox: {e}")
@@ -210,32 +483,33 @@ def get_all_vms_serialized():
 
     return vms_serialized
 
-def get_vm_serialized(vmid):
+def get_vm_serialized(vmid, max_age=None):
     """
     Obtiene los datos de una VM en Proxmox con los datos necesarios para el frontend
 
+    Los datos se toman del inventario en caché; get_vm_by_id consulta siempre a Proxmox.
+
     :param vmid: ID de la VM a obtener
     :type vmid: str
 
+    :param max_age: Antigüedad máxima en segundos del inventario, 0 para consultarlo siempre
+        (default: Config.PROXMOX.INVENTORY_CACHE_TTL)
+    :type max_age: int
+
     :return: Los datos de la VM serializados o None si no se encuentra
     :rtype: dict
 
     :raises ProxmoxError: Si no se puede obtener la VM de Proxmox
     """
-    vm = get_vm_by_id(vmid)
+    try:
+        vm = get_inventory(max_age).get(int(vmid))
+    except Exception as e:
+        raise ProxmoxError(f"Se ha fallado al obtener la VM {vmid}: {e}")
 
-    if not vm:
+    if not vm or vm.get('type') != 'qemu':
         return None
 
-    vm_serialized = {
-        'id': vm['vmid'],
-        'name': vm['name'],
-        'status': vm['status'],
-        'uptime': vm['uptime'],
-        'maxdisk': vm['maxdisk'],
-        'maxmem': vm['maxmem']
-    }
-    return vm_serialized
+    return _serialize_vm(vm)
 
 def get_vm_by_id(vmid):
     """
@@ -251,18 +525,24 @@ def get_vm_by_id(vmid):
     """
     try:
         proxmox = get_proxmox_conn()
-        return proxmox.nodes(proxmox_node).qemu(vmid).status.current.get()
+        node = get_vm_node(vmid)
+        vm = proxmox.nodes(node).qemu(vmid).status.current.get()
     except Exception as e:
         raise ProxmoxError(f"Se ha fallado al obtener la VM {vmid}: {e}")
 
-def get_virtual_machines_ip(list_vmid, timeout=60, interval=5, batch_size=3, off_when_done=True):
+    if vm:
+        vm['node'] = node
+    return vm
+
+def get_virtual_machines_ip(list_vmid, timeout=60, batch_size=3, off_when_done=True):
     """Obtiene la dirección IP de un conjunto de máquinas virtuales en Proxmox
 
     Este método obtiene la primera dirección IPv4 de las máquinas virtuales en 
     la lista.
 
     Batch_size determina el número máximo de máquinas virtuales que estarán 
-    activas al mismo tiempo.
+    activas al mismo tiempo. El agente de QEMU de todas las máquinas que esperan
+    su IP se consulta en paralelo, por lo que un agente lento no retrasa al resto.
 
     NOTA: Las máquinas virtuales encendidas por este proceso se apagarán al 
     finalizar en función del valor de off_when_done. Si la máquina virtual ya
@@ -274,92 +554,33 @@ def get_virtual_machines_ip(list_vmid, timeout=60, interval=5, batch_size=3, off
     :param timeout: El tiempo máximo para esperar a que las VMs se inicien (default: 60 segundos)
     :type timeout: int
 
-    :param interval: El intervalo para comprobar si las VMs se han iniciado (default: 5 segundos)
-    :type interval: int
-
     :param batch_size: El tamaño del lote de VMs a obtener la dirección IP en paralelo (default: 3)
     :type batch_size: int
 
     :param off_when_done: Apagar las VMs cuando se haya obtenido la dirección IP (default: True)
 
-    :return: Un diccionario con las direcciones IP de las vm
+    :return: Un diccionario con las direcciones IP de las vm (None si no se pudo obtener).
+        Un fallo en una VM no impide obtener la IP del resto
     :rtype: dict
 
     :raises ConnectionError: Si no se puede conectar con Proxmox
-    :raises TimeoutError: Si alguna VM no se inicia en el tiempo dado
-    :raises ProxmoxError: Si no se puede obtener la dirección IP de alguna VM
     """
-    started_vms = []
-    ip_addresses = {}
-    try:
-        proxmox = get_proxmox_conn()
-        elapsed_time = 0
-
-        # Start the VMs in batches
-        for i in range(0, len(list_vmid), batch_size):
-            batch = list_vmid[i:i + batch_size]
-            logger.info(f"Starting batch: {batch}")
-
-            # Start the VMs in parallel
-            for vm_id in batch:
-                try:
-                    status = proxmox.nodes(proxmox_node).qemu(vm_id).status.current.get()
-                    if status and status['status'] == 'running':
-                        logger.info(f"VM {vm_id} is already running")
-                        continue
+    return _run_sync(async_get_virtual_machines_ip(list_vmid, timeout, batch_size, off_when_done))
 
-                    logger.info(f"Starting VM {vm_id}...")
-                    proxmox.nodes(proxmox_node).qemu(vm_id).status.start.post()
-                    started_vms.append(vm_id)
-                except Exception as e:
-                    logger.error(f"Failed to start VM {vm_id}: {e}")
-                    continue
-
-            # Wait for the VMs to start
-            elapsed_time = 0
-            while elapsed_time < timeout:
-                try:
-                    statuses = [
-                        proxmox.nodes(proxmox_node).qemu(vm_id).status.current.get()
-                        for vm_id in batch
-                    ]
-                    if all(status and status['status'] == 'running' for status in statuses):
-                        logger.info(f"Batch {batch} started successfully")
-                        break
-
-                except Exception as e:
-                    logger.error(f"Failed to get VM status: {e}")
-
-                time.sleep(interval)
-                elapsed_time += interval
-            
-            if elapsed_time >= timeout:
-                logger.error(f"Failed to start batch {batch} in {timeout} seconds")
-                raise TimeoutError(f"Se ha fallado al iniciar el lote {batch} en {timeout} segundos")
-
-            # En este punto las VMs del batch ya están encendidas
-            for vm_id in batch:
-                try:
-                    ip_addr = get_vm_ip_addr(vm_id, 20, 2) # Esperar 20 segundos y comprobar cada 2 segundos. Se usan valores más bajos porque las VMs deberían ya estar iniciándose
-
-                except (Exception, TimeoutError) as e:
-                    logger.error(f"Failed to get IP address for VM {vm_id}: {e}")
-                    ip_addr = None
-
-                ip_addresses[vm_id] = ip_addr
-
-            if off_when_done:
-                for vm_id in started_vms:
-                    stop_vm(vm_id)
-                started_vms = [] # Reset the list of started VMs
+def get_virtual_machines_ip_detailed(list_vmid, timeout=60, batch_size=3, off_when_done=True):
+    """
+    Igual que get_virtual_machines_ip, pero devuelve también el motivo por el que
+    no se obtuvo la IP de cada VM
 
-    except Exception as e:
-        logger.error(f"Ha ocurrido un error inesperado: {e}")
-        raise e
+    :return: Tupla (ips, errors) con los diccionarios vmid -> dirección IP (None si no
+        se pudo obtener) y vmid -> motivo por el que no se obtuvo
+    :rtype: tuple[dict, dict]
 
-    return ip_addresses
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    """
+    return _run_sync(async_get_virtual_machines_ip_detailed(list_vmid, timeout, batch_size, off_when_done))
 
-def get_vm_ip_addr(vmid, timeout=60, interval=5):
+def get_vm_ip_addr(vmid, timeout=60):
     """
     Obtiene la primera dirección IPv4 de una VM en Proxmox
 
@@ -372,9 +593,6 @@ def get_vm_ip_addr(vmid, timeout=60, interval=5):
     :param timeout: El tiempo máximo para esperar a que la VM se inicie (default: 60 segundos)
     :type timeout: int
 
-    :param interval: El intervalo para comprobar si la VM se ha iniciado (default: 5 segundos)
-    :type interval: int
-
     :return: La dirección IPv4 de la VM
     :rtype: str
 
@@ -383,61 +601,12 @@ def get_vm_ip_addr(vmid, timeout=60, interval=5):
     :raises ProxmoxError: Si no se puede iniciar la VM u obtener la dirección IP
     :raises Exception: Si ocurre un error inesperado
     """
-    started = False
-    try:
-        proxmox = get_proxmox_conn()
-        elapsed_time = 0
-        ip_address = None
-
-        # Start the VM if it's not running
-        vm_status = proxmox.nodes(proxmox_node).qemu(vmid).status.current.get()
-        if vm_status and vm_status['status'] != 'running':
-            try:
-                logger.info(f"Starting VM {vmid}...")
-                proxmox.nodes(proxmox_node).qemu(vmid).status.start.post() # Start the VM
-                started = True
-            except Exception as e:
-                raise ProxmoxError(f"Ha habido un error al iniciar la VM {vmid}: {e}")
-        else:
-            logger.info(f"VM {vmid} is already running")
-
-        logger.info(f"Trying to get IP address for VM {vmid}...")
-        while elapsed_time < timeout:
-            try:
-                vm_agent_info = proxmox.nodes(proxmox_node).qemu(vmid).agent.get('network-get-interfaces')
-                if vm_agent_info:
-                    for interface in vm_agent_info['result']:
-                        if interface['name'] != 'lo':
-                            for ip_info in interface.get('ip-addresses', []):
-                                if ip_info['ip-address-type'] == 'ipv4':
-                                    ip_address = ip_info['ip-address']
-
-                    if ip_address:
-                        logger.info(f"IP address for VM {vmid}: {ip_address}")
-                        break
-
-            except Exception as e:
-                if elapsed_time + interval >= timeout:
-                    logger.warning(f"Timeout is near. Failed to get IP address for VM {vmid}: {e}")
-
-            time.sleep(interval)
-            elapsed_time += interval
-
-        if elapsed_time >= timeout:
-            raise TimeoutError(f"No se ha podido obtener la dirección IP de la VM {vmid} en {timeout} segundos")
-
-        if not ip_address:
-            logger.error(f"Failed to get IP address for VM {vmid}")
-            raise ProxmoxError(f"Ha habido un error al obtener la dirección IP de la VM {vmid}")
-
-    except Exception as e:
-        logger.error(f"Ha ocurrido un error inesperado: {e}")
-        raise
-
-    finally:
-        if started:
-            stop_vm(vmid)
+    async def boot_and_get_ip():
+        async with AsyncProxmoxClient() as client:
+            return await async_boot_and_get_ip(client, vmid, timeout)
 
+    ip_address = _run_sync(boot_and_get_ip())
+    logger.info(f"IP address for VM {vmid}: {ip_address}")
     return ip_address
 
 # UNUSED
@@ -485,11 +654,13 @@ def create_vm(vmid, vm_name, vm_os, vm_cores, vm_memory, vm_disk_size, vm_iso):
             ide2=f"{vm_iso},media=cdrom",
             boot="cdn"
         )
+        set_vm_node(vmid, proxmox_node)
+        invalidate_inventory()
     except Exception as e:
         logger.error(f"Failed to create VM {vmid}: {e}")
         raise ProxmoxError(f"Ha habido un error al crear la VM {vmid}: {e}")
 
-def batch_start_virtual_machines(vm_id_batch, timeout=60, check_interval=5, batch_size=2):
+def batch_start_virtual_machines(vm_id_batch, timeout=60, batch_size=2):
     """
     Inicia un conjunto de VMs en Proxmox en lotes
 
@@ -499,61 +670,15 @@ def batch_start_virtual_machines(vm_id_batch, timeout=60, check_interval=5, batc
     :param timeout: El tiempo máximo para esperar a que las VMs se inicien (default: 60 segundos)
     :type timeout: int
 
-    :param check_interval: El intervalo (segundos) para comprobar si las VMs se han iniciado (default: 5 segundos)
-    :type check_interval: int
-
-    :param batch_size: El tamaño del lote de VMs a iniciar (default: 2)
+    :param batch_size: El número máximo de VMs arrancando a la vez (default: 2)
     :type batch_size: int
 
     :raises ConnectionError: Si no se puede conectar con Proxmox
-    :raises ProxmoxError: Si no se pueden iniciar las VMs
+    :raises TimeoutError: Si alguna VM no se puede iniciar o no se inicia en el tiempo dado
     """
-    proxmox = get_proxmox_conn()
-
-    # Split the VMs in batches
-    for i in range(0, len(vm_id_batch), batch_size):
-        batch = vm_id_batch[i:i + batch_size]
-        logger.info(f"Starting batch: {batch}")
-
-        # Start the VMs in parallel
-        for vm_id in batch:
-            try:
-                status = proxmox.nodes(proxmox_node).qemu(vm_id).status.current.get()
-                if status and status['status'] == 'running':
-                    logger.info(f"VM {vm_id} is already running")
-                    continue
-
-                logger.info(f"Starting VM {vm_id}...")
-                proxmox.nodes(proxmox_node).qemu(vm_id).status.start.post()
-            except Exception as e:
-                logger.error(f"Failed to start VM {vm_id}: {e}")
-                continue
-
-        # Wait for the VMs to start
-        elapsed_time = 0
-        while elapsed_time < timeout:
-            try:
-                statuses = [
-                    proxmox.nodes(proxmox_node).qemu(vm_id).status.current.get()
-                    for vm_id in batch
-                ]
-                if all(status and status['status'] == 'running' for status in statuses):
-                    logger.info(f"Batch {batch} started successfully")
-                    break
+    _run_sync(async_batch_start_virtual_machines(vm_id_batch, timeout, batch_size))
 
-            except Exception as e:
-                logger.error(f"Failed to get VM status: {e}")
-
-            time.sleep(check_interval)
-            elapsed_time += check_interval
-        
-        if elapsed_time >= timeout:
-            logger.error(f"Failed to start batch {batch} in {timeout} seconds")
-            raise TimeoutError(f"Se ha fallado al iniciar el lote {batch} en {timeout} segundos")
-
-    logger.info("All VMs started successfully")
-
-def stop_vm(vmid, timeout=60, interval=5):
+def stop_vm(vmid, timeout=60):
     """
     Apaga una VM en Proxmox y espera a que el proceso termine
 
@@ -563,104 +688,94 @@ def stop_vm(vmid, timeout=60, interval=5):
     :param timeout: El tiempo máximo para esperar a que la VM se apague (default: 60 segundos)
     :type timeout: int
 
-    :param interval: El intervalo para comprobar si la VM se ha apagado (default: 5 segundos)
-    :type interval: int
-
     :raises ConnectionError: Si no se puede conectar con Proxmox
     :raises TimeoutError: Si la VM no se apaga en el tiempo dado
     """
     proxmox = get_proxmox_conn()
-    proxmox.nodes(proxmox_node).qemu(vmid).status.stop.post()
+    proxmox.nodes(get_vm_node(vmid)).qemu(vmid).status.stop.post()
 
     # Wait until the VM is stopped
-    elapsed_time = 0
-    vm_apagada = False
-    while elapsed_time < timeout:
-        vm_status = proxmox.nodes(proxmox_node).qemu(vmid).status.current.get()
-        if vm_status and vm_status['status'] == 'stopped':
-            vm_apagada = True
-            break
+    wait_for_vms_status([vmid], 'stopped', timeout)
+    invalidate_inventory()
+
+def start_vm(vmid):
+    """
+    Solicita el encendido de una VM en Proxmox sin esperar a que arranque
 
-        time.sleep(interval)
-        elapsed_time += interval
+    Si la VM se hibernó, Proxmox la reanuda desde el estado guardado en disco.
 
-    if not vm_apagada:
-        raise TimeoutError(f"Failed to stop VM {vmid} in {timeout} seconds")
+    :param vmid: El ID de la VM a encender
+    :type vmid: int
 
-def batch_stop_virtual_machines(vm_id_batch, batch_size=2, check_interval=5, timeout=60):
+    :return: El UPID de la tarea de encendido
+    :rtype: str
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
     """
-    Apaga un conjunto de VMs en Proxmox
+    proxmox = get_proxmox_conn()
+    upid = proxmox.nodes(get_vm_node(vmid)).qemu(vmid).status.start.post()
+    invalidate_inventory()
+    return upid
+
+def batch_hibernate_virtual_machines(vm_id_batch, batch_size=2, timeout=120):
+    """
+    Hiberna un conjunto de VMs en Proxmox (suspensión a disco)
 
-    Las máquinas virtuales se apagan en lotes de 2 para evitar sobrecargar el servidor.
+    La memoria de cada VM se guarda en disco y la VM se apaga, liberando su RAM
+    en el nodo. Al encenderla de nuevo se reanuda donde se quedó.
 
-    :param vm_id_batch: Lista de IDs de las VMs a apagar
+    :param vm_id_batch: Lista de IDs de las VMs a hibernar
     :type vm_id_batch: list[int]
 
-    :param batch_size: El tamaño del lote de VMs a apagar (default: 2)
+    :param batch_size: El número máximo de VMs hibernándose a la vez (default: 2)
     :type batch_size: int
 
-    :param check_interval: El intervalo (segundos) para comprobar si las VMs se han apagado (default: 5 segundos)
-    :type check_interval: int
-
-    :param timeout: El tiempo máximo (segundos) para esperar a que las VMs se apaguen (default: 60 segundos)
+    :param timeout: El tiempo máximo (segundos) para esperar a que cada VM se hiberne (default: 120 segundos)
     :type timeout: int
 
     :raises ConnectionError: Si no se puede conectar con Proxmox
-    :raises ProxmoxError: Si no se pueden apagar las VMs
+    :raises TimeoutError: Si alguna VM no se hiberna en el tiempo dado
     """
-    proxmox = get_proxmox_conn()
-
-    # Split the VMs in batches
-    logger.info(f"Stopping VMs in batches of {batch_size}")
-    for i in range(0, len(vm_id_batch), batch_size):
-        batch = vm_id_batch[i:i + batch_size]
+    _run_sync(async_batch_hibernate_virtual_machines(vm_id_batch, batch_size, timeout))
 
-        # Stop the VMs in parallel
-        for vm_id in batch:
-            try:
-                status = proxmox.nodes(proxmox_node).qemu(vm_id).status.current.get()
-                if status and status['status'] == 'stopped':
-                    logger.info(f"VM {vm_id} is already stopped")
-                    continue
-
-                logger.info(f"Stopping VM {vm_id}...")
-                proxmox.nodes(proxmox_node).qemu(vm_id).status.stop.post()
-            except Exception as e:
-                logger.error(f"Failed to stop VM {vm_id}: {e}")
-                continue # Continue with the next VM
+def batch_stop_virtual_machines(vm_id_batch, batch_size=2, timeout=60):
+    """
+    Apaga un conjunto de VMs en Proxmox
 
-        # Wait for the VMs to stop
-        elapsed_time = 0
-        while elapsed_time < timeout:
-            try:
-                statuses = [
-                    proxmox.nodes(proxmox_node).qemu(vm_id).status.current.get()
-                    for vm_id in batch
-                ]
-                if all(status and status['status'] == 'stopped' for status in statuses):
-                    logger.info(f"Batch {batch} stopped successfully")
-                    break
+    Se apagan como máximo batch_size máquinas virtuales a la vez para evitar sobrecargar el servidor.
 
-            except Exception as e:
-                logger.error(f"Failed to get VM status: {e}")
+    :param vm_id_batch: Lista de IDs de las VMs a apagar
+    :type vm_id_batch: list[int]
 
-            time.sleep(check_interval)
-            elapsed_time += check_interval
+    :param batch_size: El número máximo de VMs apagándose a la vez (default: 2)
+    :type batch_size: int
 
-        if elapsed_time >= timeout:
-            logger.error(f"Failed to stop batch {batch} in {timeout} seconds")
-            raise TimeoutError(f"Se ha fallado al apagar el lote {batch} en {timeout} segundos")
+    :param timeout: El tiempo máximo (segundos) para esperar a que las VMs se apaguen (default: 60 segundos)
+    :type timeout: int
 
-    logger.info("All VMs stopped successfully")
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    :raises TimeoutError: Si alguna VM no se puede apagar o no se apaga en el tiempo dado
+    """
+    _run_sync(async_batch_stop_virtual_machines(vm_id_batch, batch_size, timeout))
 
-def clone_vm(vmid, base_vm_name, new_starting_id, number_of_clones=1, timeout=60, batch_size=2):
+def clone_vm(vmid, base_vm_name, new_starting_id, number_of_clones=1, timeout=60, max_concurrent=None, linked=False, ip_configs=None):
     """
     Clona una máquina virtual en Proxmox
 
     Los nuevos IDs comenzarán desde new_starting_id (inclusivo)
     Los clones se nombrarán como clone-{new_id}-{base_vm_name}.
 
-    El método esperará a que todos los clones hayan terminado de crearse.
+    Los clones se crean con una ventana deslizante: se mantienen hasta
+    max_concurrent tareas de clonación en curso y, en cuanto una termina, se
+    lanza la siguiente. Todas las tareas pendientes se comprueban en el mismo
+    bucle. El método esperará a que todos los clones hayan terminado de crearse.
+
+    Si linked es True se crean clones enlazados (full=0), que comparten el disco
+    de la VM original y se crean en segundos. Para ello la VM debe haberse
+    convertido antes en plantilla (ver convert_to_template).
+
+    Con ip_configs cada clon recibe su propia IP fija a través de cloud-init
+    (ipconfig0), por lo que se conoce sin necesidad de encenderlo.
 
     :param vmid: ID de la VM a clonar
     :type vmid: str
@@ -674,72 +789,1029 @@ def clone_vm(vmid, base_vm_name, new_starting_id, number_of_clones=1, timeout=60
     :param number_of_clones: Número de clones a crear (default: 1)
     :type number_of_clones: int
 
-    :param timeout: Tiempo máximo (segundos) para esperar a que los clones se creen (default: 60 segundos)
+    :param timeout: Tiempo máximo (segundos) para esperar a que cada clon se cree (default: 60 segundos)
     :type timeout: int
 
-    :param batch_size: Tamaño del lote de clones a crear (default: 2)
-    :type batch_size: int
+    :param max_concurrent: Número máximo de clones en curso a la vez (default: Config.PROXMOX.CLONE_CONCURRENCY)
+    :type max_concurrent: int
+
+    :param linked: Crear clones enlazados en lugar de clones completos (default: False)
+    :type linked: bool
+
+    :param ip_configs: Diccionario ID del clon -> valor de ipconfig0 de cloud-init (default: None, se conserva el de la VM original)
+    :type ip_configs: dict
 
     :raises ConnectionError: Si no se puede conectar con Proxmox
-    :raises ProxmoxError: Si no se pueden clonar las VMs
+    :raises ProxmoxError: Si no se pueden clonar las VMs o la VM no es una plantilla al crear clones enlazados
     """
-    proxmox = get_proxmox_conn()
+    _run_sync(async_clone_vm(vmid, base_vm_name, new_starting_id, number_of_clones, timeout, max_concurrent, linked, ip_configs))
 
-    # First we make sure that the VM is stopped
+def is_template(vmid):
+    """
+    Comprueba si una VM de Proxmox es una plantilla
+
+    :param vmid: ID de la VM a comprobar
+    :type vmid: str
+
+    :return: True si la VM es una plantilla, False si no
+    :rtype: bool
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    :raises ProxmoxError: Si no se puede obtener la configuración de la VM
+    """
+    proxmox = get_proxmox_conn()
     try:
-        vm_status = proxmox.nodes(proxmox_node).qemu(vmid).status.current.get()
-        if vm_status and vm_status['status'] == 'running':
-            logger.info(f"Stopping VM {vmid} before cloning...")
-            stop_vm(vmid)
+        vm_config = proxmox.nodes(get_vm_node(vmid)).qemu(vmid).config.get()
     except Exception as e:
-        logger.error(f"Failed to stop VM {vmid} before cloning: {e}")
-        raise ProxmoxError(f"Ha habido un error al clonar la VM {vmid}: {e}")
+        raise ProxmoxError(f"Se ha fallado al obtener la configuración de la VM {vmid}: {e}")
 
-    logger.info(f"Cloning VM {vmid} to {number_of_clones} new VMs...")
-    clone_errors = []
-    for batch_start in range(0, number_of_clones, batch_size):
-        batch_end = min(batch_start + batch_size, number_of_clones)
+    return bool(vm_config and vm_config.get('template'))
 
-        # Clone the VMs in parallel
-        tasks = []
-        for i in range(batch_start, batch_end):
-            new_vmid = new_starting_id + i
-            new_vm_name = f"clone-{new_vmid}-{base_vm_name}"
+def has_cloudinit_drive(vmid):
+    """
+    Comprueba si una VM de Proxmox tiene una unidad de cloud-init
 
-            try:
-                task = proxmox.nodes(proxmox_node).qemu(vmid).clone.create(
-                    newid=new_vmid,
-                    name=new_vm_name
-                )
-                tasks.append(task)
-            except Exception as e:
-                clone_errors.append({"vmid": new_vmid, "name": new_vm_name, "error": str(e)})
-                logger.error(f"Failed to clone VM {vmid} to {new_vm_name}: {e}")
-                continue
+    Sin ella los clones no reciben la IP fija de ipconfig0. La unidad aparece en
+    la configuración como, por ejemplo, 'ide2': 'local-lvm:vm-100-cloudinit,media=cdrom'.
 
-        # Wait for the tasks to finish
-        for task in tasks:
-            wait_for_task(task, timeout)
+    :param vmid: ID de la VM a comprobar
+    :type vmid: int
 
-    if clone_errors:
-        logger.error(f"Failed to clone the following VMs: {json.dumps(clone_errors, indent=2)}")
-        raise ProxmoxError(f"Ha habido un error al clonar las VMs: {json.dumps(clone_errors, indent=2)}")
+    :return: True si la VM tiene una unidad de cloud-init, False si no
+    :rtype: bool
 
-    logger.info(f"VM {vmid} cloned successfully to {number_of_clones} new VMs")
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    :raises ProxmoxError: Si no se puede obtener la configuración de la VM
+    """
+    return any(
+        isinstance(value, str) and 'cloudinit' in value.split(',')[0]
+        for value in get_vm_config(vmid).values()
+    )
+
+def convert_to_template(vmid, timeout=60):
+    """
+    Convierte una VM de Proxmox en plantilla
+
+    Las plantillas permiten crear clones enlazados. La conversión es
+    irreversible: la VM no podrá volver a iniciarse, solo clonarse.
+    Si la VM ya es una plantilla no se hace nada.
+
+    :param vmid: ID de la VM a convertir
+    :type vmid: str
+
+    :param timeout: Tiempo máximo (segundos) para esperar a que termine la conversión (default: 60 segundos)
+    :type timeout: int
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    :raises ProxmoxError: Si no se puede convertir la VM en plantilla
+    """
+    if is_template(vmid):
+        logger.info(f"VM {vmid} is already a template")
+        return
+
+    proxmox = get_proxmox_conn()
+    try:
+        node = get_vm_node(vmid)
+        vm_status = proxmox.nodes(node).qemu(vmid).status.current.get()
+        if vm_status and vm_status['status'] == 'running':
+            logger.info(f"Stopping VM {vmid} before converting it to a template...")
+            stop_vm(vmid)
+
+        logger.info(f"Converting VM {vmid} to a template...")
+        task = proxmox.nodes(node).qemu(vmid).template.post()
+
+        # Las versiones recientes de Proxmox devuelven el UPID de la tarea
+        if isinstance(task, str) and task.startswith('UPID'):
+            wait_for_task(task, timeout)
+
+        invalidate_inventory()
 
-def delete_vm(vmid):
+    except Exception as e:
+        logger.error(f"Failed to convert VM {vmid} to a template: {e}")
+        raise ProxmoxError(f"Ha habido un error al convertir la VM {vmid} en plantilla: {e}")
+
+def delete_vm(vmid, timeout=60):
     """
-    Borra una VM en Proxmox
+    Borra una VM en Proxmox y espera a que termine la tarea de borrado
 
     :param vmid: ID de la VM a borrar
     :type vmid: str
 
+    :param timeout: Tiempo máximo de espera (default: 60 segundos)
+    :type timeout: int
+
     :raises ConnectionError: Si no se puede conectar con Proxmox
     :raises ProxmoxError: Si no se puede borrar la VM
+    :raises TimeoutError: Si el borrado no termina a tiempo
     """
-    proxmox = get_proxmox_conn()
+    _run_sync(async_delete_vm(None, vmid, timeout))
+
+def migrate_vm(vmid, target_node, timeout=600, target_storage=None):
+    """
+    Migra una VM apagada a otro nodo del clúster y espera a que termine
+
+    Los discos en almacenamientos locales se copian al nodo de destino.
+
+    :param vmid: ID de la VM a migrar
+    :type vmid: int
+
+    :param target_node: Nodo de destino
+    :type target_node: str
+
+    :param timeout: Tiempo máximo (segundos) para esperar a que termine la migración (default: 600 segundos)
+    :type timeout: int
+
+    :param target_storage: Almacenamiento del nodo de destino para los discos locales (default: None, el mismo que en el origen)
+    :type target_storage: str
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    :raises ProxmoxError: Si la migración falla
+    :raises TimeoutError: Si la migración no termina a tiempo
+    """
+    _run_sync(async_migrate_vm(None, vmid, target_node, timeout, target_storage))
+
+# Cliente asíncrono
+## Las operaciones sobre muchas VMs se ejecutan de forma concurrente con asyncio.
+## Las versiones síncronas de estas operaciones son envoltorios de las asíncronas.
+class AsyncProxmoxClient:
+    """
+    Cliente asíncrono para la API de Proxmox basado en httpx
+
+    Usa la misma autenticación por ticket que proxmoxer (cookie PVEAuthCookie
+    y cabecera CSRFPreventionToken). El ticket se comparte entre todas las
+    instancias del proceso y se renueva antes de que caduque o si Proxmox
+    responde con un 401.
+
+    Todas las peticiones pasan por un semáforo, de forma que el número de
+    peticiones simultáneas contra Proxmox está acotado.
+
+    Se usa como gestor de contexto asíncrono:
+
+        async with AsyncProxmoxClient() as client:
+            await client.get(f"/nodes/{proxmox_node}/qemu")
+    """
+    TICKET_LIFETIME = 7200 - 300 # Los tickets de Proxmox duran 2 horas, se renuevan 5 minutos antes
+
+    _ticket = None
+    _csrf_token = None
+    _ticket_time = 0
+    _ticket_lock = threading.Lock()
+
+    def __init__(self, max_concurrent=None):
+        self.base_url = f"https://{Config.PROXMOX.HOST}:{Config.PROXMOX.PORT}/api2/json"
+        self.semaphore = asyncio.Semaphore(max_concurrent or Config.PROXMOX.API_CONCURRENCY)
+        self.tasks = _BulkWatcher(self._fetch_tasks_status)
+        self.vms = _BulkWatcher(self._fetch_vms_status)
+        self.agents = _AgentPoller(self)
+        self._client = None
+
+    async def __aenter__(self):
+        self._client = httpx.AsyncClient(base_url=self.base_url, verify=False, timeout=30)
+        try:
+            await self._ensure_ticket()
+        except Exception:
+            await self._client.aclose()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._client.aclose()
+
+    async def _ensure_ticket(self, force=False):
+        cls = AsyncProxmoxClient
+        if not force and cls._ticket and time.monotonic() - cls._ticket_time < cls.TICKET_LIFETIME:
+            return
+
+        try:
+            response = await self._client.post('/access/ticket', data={
+                'username': Config.PROXMOX.ROOT_USER,
+                'password': Config.PROXMOX.PASSWORD
+            })
+        except httpx.HTTPError as e:
+            raise ConnectionError(f"Se ha fallado al conectar con Proxmox: {e}")
+
+        if response.status_code != 200:
+            raise ConnectionError(f"Se ha fallado al autenticar con Proxmox: {response.status_code} {response.text}")
+
+        data = response.json()['data']
+        with cls._ticket_lock:
+            cls._ticket = data['ticket']
+            cls._csrf_token = data['CSRFPreventionToken']
+            cls._ticket_time = time.monotonic()
+
+    async def request(self, method, path, **params):
+        """
+        Realiza una petición a la API de Proxmox
+
+        :param method: Método HTTP (GET, POST, PUT, DELETE)
+        :type method: str
+
+        :param path: Ruta de la API, relativa a /api2/json
+        :type path: str
+
+        :param params: Parámetros de la petición
+        :type params: dict
+
+        :return: El campo 'data' de la respuesta
+        :rtype: dict | list | str | None
+
+        :raises ConnectionError: Si no se puede conectar o autenticar con Proxmox
+        :raises ProxmoxError: Si Proxmox devuelve un error
+        """
+        async with self.semaphore:
+            for attempt in range(2):
+                cls = AsyncProxmoxClient
+                headers = {'Cookie': f"PVEAuthCookie={cls._ticket}"}
+                if method != 'GET':
+                    headers['CSRFPreventionToken'] = cls._csrf_token
+
+                try:
+                    response = await self._client.request(
+                        method,
+                        path,
+                        params=params if method in ('GET', 'DELETE') else None,
+                        data=params if method in ('POST', 'PUT') else None,
+                        headers=headers
+                    )
+                except httpx.HTTPError as e:
+                    raise ConnectionError(f"Se ha fallado al conectar con Proxmox: {e}")
+
+                # The ticket expired or was revoked: renew it once
+                if response.status_code == 401 and attempt == 0:
+                    await self._ensure_ticket(force=True)
+                    continue
+
+                if response.status_code >= 400:
+                    raise ProxmoxError(f"{method} {path}: {response.status_code} {response.reason_phrase} {response.text}")
+
+                return response.json().get('data')
+
+    async def get(self, path, **params):
+        return await self.request('GET', path, **params)
+
+    async def post(self, path, **params):
+        return await self.request('POST', path, **params)
+
+    async def put(self, path, **params):
+        return await self.request('PUT', path, **params)
+
+    async def delete(self, path, **params):
+        return await self.request('DELETE', path, **params)
+
+    async def _fetch_tasks_status(self, task_upids):
+        return await async_get_tasks_status(self, task_upids)
+
+    async def _fetch_vms_status(self, vmids):
+        return await async_get_vms_status_snapshot(self, vmids)
+
+    async def wait_for_task(self, task_upid, timeout=60):
+        """
+        Espera a que termine una tarea. Todas las tareas esperadas a la vez se
+        comprueban con una sola petición a cluster/tasks.
+
+        :return: El exitstatus de la tarea
+        :rtype: str
+
+        :raises TimeoutError: Si la tarea no termina en el tiempo dado
+        """
+        try:
+            return await self.tasks.wait(task_upid, lambda exitstatus: exitstatus is not None, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"La tarea {task_upid} no terminó en {timeout} segundos")
+
+    async def wait_for_vm_status(self, vmid, status, timeout=60):
+        """
+        Espera a que una VM alcance un estado. Todas las VMs esperadas a la vez
+        se comprueban con una sola petición a cluster/resources.
+
+        :raises TimeoutError: Si la VM no alcanza el estado en el tiempo dado
+        """
+        try:
+            await self.vms.wait(int(vmid), lambda vm: vm is not None and vm.get('status') == status, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"La VM {vmid} no alcanzó el estado '{status}' en {timeout} segundos")
+
+    async def wait_for_agent_ip(self, vmid, timeout=20):
+        """
+        Espera a que el agente de QEMU de una VM devuelva su dirección IPv4. Los
+        agentes de todas las VMs esperadas a la vez se consultan en paralelo en
+        cada comprobación (ver _AgentPoller).
+
+        :return: La dirección IPv4 de la VM
+        :rtype: str
+
+        :raises TimeoutError: Si no se obtiene la dirección IP en el tiempo dado, con el último motivo
+        """
+        return await self.agents.wait(int(vmid), timeout)
+
+class _BulkWatcher:
+    """
+    Agrupa las esperas de muchas corrutinas en una sola petición por comprobación
+
+    Cada corrutina espera por una clave (UPID o vmid). Mientras haya esperas
+    pendientes, un único bucle obtiene el estado de todas las claves con fetch
+    y despierta a las corrutinas cuya condición se cumple. Los intervalos entre
+    comprobaciones siguen la espera adaptativa de _backoff_intervals.
+    """
+    def __init__(self, fetch):
+        self._fetch = fetch
+        self._waiters = {} # key -> list[(predicate, future)]
+        self._loop_task = None
+        self._new_waiter = None
+
+    async def wait(self, key, predicate, timeout):
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, []).append((predicate, future))
+
+        if self._loop_task is None or self._loop_task.done():
+            self._new_waiter = asyncio.Event()
+            self._loop_task = asyncio.create_task(self._run())
+        else:
+            self._new_waiter.set()
+
+        try:
+            # Lanza asyncio.TimeoutError, que antes de Python 3.11 no es el TimeoutError integrado
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            waiters = self._waiters.get(key, [])
+            if (predicate, future) in waiters:
+                waiters.remove((predicate, future))
+            if not waiters:
+                self._waiters.pop(key, None)
+
+    async def _run(self):
+        intervals = _backoff_intervals()
+        while self._waiters:
+            try:
+                values = await self._fetch(list(self._waiters))
+            except Exception as e:
+                logger.warning(f"Failed to refresh the watched Proxmox resources: {e}")
+                values = {}
+
+            for key, waiters in list(self._waiters.items()):
+                for predicate, future in waiters:
+                    if not future.done() and predicate(values.get(key)):
+                        future.set_result(values.get(key))
+
+            # Wait for the next tick; a new waiter restarts the fast polling
+            self._new_waiter.clear()
+            try:
+                await asyncio.wait_for(self._new_waiter.wait(), next(intervals))
+                intervals = _backoff_intervals()
+            except asyncio.TimeoutError:
+                pass
+
+class _AgentPoller:
+    """
+    Consulta en paralelo el agente de QEMU (network-get-interfaces) de todas las
+    VMs que esperan su dirección IP
+
+    En cada comprobación se lanza una consulta por cada VM pendiente que no tenga
+    ya una en curso, y cada VM se resuelve en cuanto responde su agente. Así, un
+    agente lento solo retrasa a su propia VM. Los intervalos siguen la misma
+    espera adaptativa que _BulkWatcher.
+    """
+    def __init__(self, client):
+        self._client = client
+        self._waiters = {} # vmid -> list[future]
+        self._in_flight = {} # vmid -> task
+        self._errors = {} # vmid -> último motivo por el que no se obtuvo la IP
+        self._loop_task = None
+        self._new_waiter = None
+
+    async def wait(self, vmid, timeout):
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(vmid, []).append(future)
+
+        if self._loop_task is None or self._loop_task.done():
+            self._new_waiter = asyncio.Event()
+            self._loop_task = asyncio.create_task(self._run())
+        else:
+            self._new_waiter.set()
+
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            reason = self._errors.get(vmid, "el agente no ha respondido")
+            raise TimeoutError(f"No se ha podido obtener la dirección IP de la VM {vmid} en {timeout} segundos: {reason}")
+        finally:
+            waiters = self._waiters.get(vmid, [])
+            if future in waiters:
+                waiters.remove(future)
+            if not waiters:
+                self._waiters.pop(vmid, None)
+                self._errors.pop(vmid, None)
+                task = self._in_flight.pop(vmid, None)
+                if task is not None:
+                    task.cancel()
+
+    async def _query(self, vmid):
+        try:
+            node = await async_get_vm_node(self._client, vmid)
+            vm_agent_info = await self._client.get(f"/nodes/{node}/qemu/{vmid}/agent/network-get-interfaces")
+            ip_address = _first_ipv4(vm_agent_info)
+            if ip_address is None:
+                self._errors[vmid] = "el agente de QEMU no ha devuelto ninguna dirección IPv4"
+
+        except Exception as e:
+            # The guest agent is not ready until the VM has booted
+            logger.debug(f"Failed to get IP address for VM {vmid}: {e}")
+            self._errors[vmid] = str(e)
+            ip_address = None
+
+        finally:
+            self._in_flight.pop(vmid, None)
+
+        if ip_address is not None:
+            for future in self._waiters.get(vmid, []):
+                if not future.done():
+                    future.set_result(ip_address)
+
+    async def _run(self):
+        intervals = _backoff_intervals()
+        while self._waiters:
+            for vmid in list(self._waiters):
+                if vmid not in self._in_flight:
+                    self._in_flight[vmid] = asyncio.create_task(self._query(vmid))
+
+            # Wait for the next tick; a new waiter restarts the fast polling
+            self._new_waiter.clear()
+            try:
+                await asyncio.wait_for(self._new_waiter.wait(), next(intervals))
+                intervals = _backoff_intervals()
+            except asyncio.TimeoutError:
+                pass
+
+@asynccontextmanager
+async def _client_scope(client=None):
+    # Reutiliza el cliente dado o abre uno nuevo para la operación
+    if client is not None:
+        yield client
+        return
+
+    async with AsyncProxmoxClient() as new_client:
+        yield new_client
+
+def _run_sync(coroutine):
+    # Ejecuta una corrutina desde el código síncrono (rutas de Flask, tareas programadas)
+    return asyncio.run(coroutine)
+
+async def async_get_tasks_status(client, task_upids):
+    """
+    Versión asíncrona de get_tasks_status
+
+    :return: Diccionario UPID -> exitstatus, o None si la tarea sigue en curso
+    :rtype: dict
+    """
+    pending = set(task_upids)
+    statuses = {}
+
+    async with _client_scope(client) as client:
+        try:
+            for task in await client.get('/cluster/tasks'):
+                if task['upid'] in pending:
+                    statuses[task['upid']] = task.get('status') if task.get('endtime') else None
+        except Exception as e:
+            logger.warning(f"Failed to get the cluster task list: {e}")
+
+        async def task_status(task_upid):
+            try:
+                status = await client.get(f"/nodes/{_node_from_upid(task_upid)}/tasks/{task_upid}/status")
+                return status.get('exitstatus') if status['status'] == 'stopped' else None
+            except Exception as e:
+                logger.warning(f"Failed to get the status of task {task_upid}: {e}")
+                return None
+
+        missing = list(pending - statuses.keys())
+        for task_upid, status in zip(missing, await asyncio.gather(*(task_status(t) for t in missing))):
+            statuses[task_upid] = status
+
+    return statuses
+
+async def async_get_vms_status_snapshot(client, vmids=None):
+    """
+    Versión asíncrona de get_vms_status_snapshot
+
+    :return: Diccionario vmid -> datos de la VM
+    :rtype: dict
+
+    :raises ProxmoxError: Si no se puede obtener el estado de las VMs
+    """
+    async with _client_scope(client) as client:
+        try:
+            resources = await client.get('/cluster/resources', type='vm')
+        except ProxmoxError as e:
+            raise ProxmoxError(f"Se ha fallado al obtener el estado de las VMs: {e}")
+
+    _remember_vm_nodes(resources)
+    wanted = {int(vmid) for vmid in vmids} if vmids is not None else None
+    return {
+        vm['vmid']: vm
+        for vm in resources
+        if is_managed_node(vm.get('node')) and (wanted is None or vm['vmid'] in wanted)
+    }
+
+async def async_wait_for_tasks(client, task_upids, timeout=60):
+    """
+    Versión asíncrona de wait_for_tasks
+
+    :return: Diccionario UPID -> exitstatus de las tareas terminadas
+    :rtype: dict
+
+    :raises TimeoutError: Si alguna tarea no termina en el tiempo dado
+    """
+    task_upids = list(task_upids)
+    logger.info(f"Waiting for {len(task_upids)} task(s) to finish...")
+
+    async with _client_scope(client) as client:
+        async def wait_one(task_upid):
+            try:
+                exitstatus = await client.wait_for_task(task_upid, timeout)
+            except TimeoutError:
+                return None
+            logger.info(f"Task {task_upid} finished with status: {exitstatus}")
+            return exitstatus
+
+        exitstatuses = await asyncio.gather(*(wait_one(task_upid) for task_upid in task_upids))
+
+    finished = {task_upid: exitstatus for task_upid, exitstatus in zip(task_upids, exitstatuses) if exitstatus is not None}
+    pending = sorted(set(task_upids) - finished.keys())
+    if pending:
+        raise TimeoutError(f"Las tareas {pending} no terminaron en {timeout} segundos")
+
+    return finished
+
+async def async_wait_for_vms_status(client, vmids, status, timeout=60):
+    """
+    Versión asíncrona de wait_for_vms_status
+
+    :raises TimeoutError: Si alguna VM no alcanza el estado en el tiempo dado
+    """
+    vmids = [int(vmid) for vmid in vmids]
+
+    async with _client_scope(client) as client:
+        async def wait_one(vmid):
+            try:
+                await client.wait_for_vm_status(vmid, status, timeout)
+            except TimeoutError:
+                return vmid
+            return None
+
+        pending = sorted(vmid for vmid in await asyncio.gather(*(wait_one(vmid) for vmid in vmids)) if vmid is not None)
+
+    if pending:
+        raise TimeoutError(f"Las VMs {pending} no alcanzaron el estado '{status}' en {timeout} segundos")
+
+async def async_get_vm_node(client, vmid):
+    """
+    Versión asíncrona de get_vm_node
+
+    :return: Nombre del nodo
+    :rtype: str
+    """
+    node = _vm_nodes.get(int(vmid))
+    if node is None:
+        try:
+            await async_get_vms_status_snapshot(client)
+        except Exception as e:
+            logger.warning(f"Failed to locate VM {vmid} in the cluster: {e}")
+        node = _vm_nodes.get(int(vmid), proxmox_node)
+
+    return node
+
+async def async_stop_vm(client, vmid, timeout=60):
+    """Versión asíncrona de stop_vm"""
+    await client.post(f"/nodes/{await async_get_vm_node(client, vmid)}/qemu/{vmid}/status/stop")
+    await client.wait_for_vm_status(vmid, 'stopped', timeout)
+    invalidate_inventory()
+
+async def async_prepare_clone_source(client, vmid, linked=False):
+    """
+    Prepara la VM de origen antes de clonarla: comprueba que es una plantilla
+    si se van a crear clones enlazados y la apaga si está encendida
+
+    :raises ProxmoxError: Si la VM no se puede preparar para la clonación
+    """
+    if linked:
+        vm_config = await client.get(f"/nodes/{await async_get_vm_node(client, vmid)}/qemu/{vmid}/config")
+        if not (vm_config and vm_config.get('template')):
+            raise ProxmoxError(f"La VM {vmid} debe ser una plantilla para crear clones enlazados")
+
+    # First we make sure that the VM is stopped
     try:
-        proxmox.nodes(proxmox_node).qemu(vmid).delete()
+        vm_status = (await async_get_vms_status_snapshot(client, [vmid])).get(int(vmid))
+        if vm_status and vm_status['status'] == 'running':
+            logger.info(f"Stopping VM {vmid} before cloning...")
+            await async_stop_vm(client, vmid)
     except Exception as e:
-        logger.error(f"Failed to delete VM {vmid}: {e}")
-        raise ProxmoxError(f"Ha habido un error al borrar la VM {vmid}: {e}")
+        logger.error(f"Failed to stop VM {vmid} before cloning: {e}")
+        raise ProxmoxError(f"Ha habido un error al clonar la VM {vmid}: {e}")
+
+async def async_clone_one(client, vmid, new_vmid, new_vm_name, timeout=60, linked=False, ipconfig=None, target=None, storage=None):
+    """
+    Crea un clon de una VM y espera a que la tarea termine
+
+    :param ipconfig: Valor de ipconfig0 de cloud-init para el clon (p. ej. 'ip=10.0.0.5/24,gw=10.0.0.1'),
+        None para conservar el de la VM original (default: None)
+    :type ipconfig: str
+
+    :param target: Nodo en el que se crea el clon, None para el de la VM original (default: None).
+        Proxmox solo lo permite si los discos de la VM original están en un almacenamiento compartido
+    :type target: str
+
+    :param storage: Almacenamiento de los discos del clon completo, None para el de la VM original (default: None)
+    :type storage: str
+
+    Si no se puede aplicar ipconfig, el clon se borra: sin ella no tomaría la IP
+    reservada para él.
+
+    Si el clon no se crea en el tiempo dado, se detiene su tarea y se borra lo
+    que haya llegado a crear antes de devolver el error.
+
+    :raises TimeoutError: Si el clon no se crea en el tiempo dado
+    :raises ProxmoxError: Si la tarea de clonación o la configuración de cloud-init fallan
+    :raises UnconfiguredCloneError: Si la configuración de cloud-init falla y el clon no se puede borrar,
+        por lo que sigue existiendo en Proxmox
+    :raises UnfinishedCloneError: Si el clon no se crea en el tiempo dado y su tarea no se puede detener
+        o lo creado no se puede borrar, por lo que puede existir en Proxmox
+    """
+    source_node = await async_get_vm_node(client, vmid)
+    options = {}
+    if target and target != source_node:
+        options['target'] = target
+    if storage and not linked:
+        options['storage'] = storage
+
+    task = await client.post(
+        f"/nodes/{source_node}/qemu/{vmid}/clone",
+        newid=new_vmid,
+        name=new_vm_name,
+        full=0 if linked else 1,
+        **options
+    )
+    try:
+        exitstatus = await client.wait_for_task(task, timeout)
+    except TimeoutError as e:
+        # La tarea sigue en Proxmox aunque se deje de esperar: se detiene y se borra lo que haya creado
+        await _async_abort_clone(client, task, new_vmid, timeout)
+        raise TimeoutError(f"El clon {new_vmid} no se ha creado en {timeout} segundos, se ha detenido su tarea") from e
+    if exitstatus != 'OK':
+        raise ProxmoxError(f"La tarea {task} ha fallado: {exitstatus}")
+
+    set_vm_node(new_vmid, options.get('target', source_node))
+    invalidate_inventory()
+
+    if ipconfig is not None:
+        node = options.get('target', source_node)
+        try:
+            # PUT aplica el cambio antes de responder; cloud-init lo lee en el primer arranque
+            await client.put(f"/nodes/{node}/qemu/{new_vmid}/config", ipconfig0=ipconfig)
+        except Exception as e:
+            logger.error(f"Failed to set the cloud-init IP of clone {new_vmid}, deleting it: {e}")
+            try:
+                await async_delete_vm(client, new_vmid, timeout)
+            except Exception as delete_error:
+                logger.error(f"Failed to delete the unconfigured clone {new_vmid}: {delete_error}")
+                raise UnconfiguredCloneError(
+                    f"No se ha podido configurar la IP del clon {new_vmid} ({e}) ni borrarlo: {delete_error}"
+                ) from e
+            raise ProxmoxError(f"No se ha podido configurar la IP del clon {new_vmid}, se ha borrado: {e}") from e
+
+    logger.info(f"Clone {new_vm_name} created on node {options.get('target', source_node)}")
+
+async def _async_abort_clone(client, task_upid, new_vmid, timeout=60):
+    """
+    Detiene una tarea de clonación, espera a que termine y borra el clon si ha llegado a crearse
+
+    :raises UnfinishedCloneError: Si la tarea no se puede detener o el clon no se puede borrar
+    """
+    logger.warning(f"Clone task {task_upid} timed out, stopping it")
+    try:
+        await client.delete(f"/nodes/{_node_from_upid(task_upid)}/tasks/{task_upid}")
+        await client.wait_for_task(task_upid, timeout)
+
+        if int(new_vmid) in await async_get_vms_status_snapshot(client, [new_vmid]):
+            await async_delete_vm(client, new_vmid, timeout)
+    except Exception as e:
+        logger.error(f"Failed to abort the clone task {task_upid}: {e}")
+        raise UnfinishedCloneError(
+            f"El clon {new_vmid} no se ha creado a tiempo y no se ha podido detener su tarea ni borrarlo: {e}"
+        ) from e
+
+async def async_delete_vm(client, vmid, timeout=60):
+    """
+    Versión asíncrona de delete_vm
+
+    :raises ProxmoxError: Si no se puede borrar la VM
+    :raises TimeoutError: Si el borrado no termina a tiempo
+    """
+    async with _client_scope(client) as client:
+        try:
+            upid = await client.delete(f"/nodes/{await async_get_vm_node(client, vmid)}/qemu/{vmid}")
+        except Exception as e:
+            logger.error(f"Failed to delete VM {vmid}: {e}")
+            raise ProxmoxError(f"Ha habido un error al borrar la VM {vmid}: {e}")
+
+        if upid:
+            exitstatus = await client.wait_for_task(upid, timeout)
+            if exitstatus != 'OK':
+                raise ProxmoxError(f"La tarea {upid} ha fallado: {exitstatus}")
+
+    set_vm_node(vmid, None)
+    invalidate_inventory()
+
+async def async_migrate_vm(client, vmid, target_node, timeout=600, target_storage=None):
+    """
+    Versión asíncrona de migrate_vm
+
+    :raises ProxmoxError: Si la migración falla
+    :raises TimeoutError: Si la migración no termina a tiempo
+    """
+    async with _client_scope(client) as client:
+        source_node = await async_get_vm_node(client, vmid)
+        if source_node == target_node:
+            return
+
+        options = {'targetstorage': target_storage} if target_storage else {}
+        logger.info(f"Migrating VM {vmid} from node {source_node} to {target_node}...")
+        task = await client.post(f"/nodes/{source_node}/qemu/{vmid}/migrate", target=target_node, **options)
+        exitstatus = await client.wait_for_task(task, timeout)
+        if exitstatus != 'OK':
+            raise ProxmoxError(f"La migración de la VM {vmid} al nodo {target_node} ha fallado: {exitstatus}")
+
+    set_vm_node(vmid, target_node)
+    invalidate_inventory()
+
+async def async_clone_vm(vmid, base_vm_name, new_starting_id, number_of_clones=1, timeout=60, max_concurrent=None, linked=False, ip_configs=None, client=None):
+    """
+    Versión asíncrona de clone_vm
+
+    Cada clon es una corrutina; un semáforo mantiene hasta max_concurrent
+    clonaciones en curso y todas las tareas se comprueban con una sola petición.
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    :raises ProxmoxError: Si no se pueden clonar las VMs
+    """
+    max_concurrent = max(1, max_concurrent or Config.PROXMOX.CLONE_CONCURRENCY)
+
+    async with _client_scope(client) as client:
+        await async_prepare_clone_source(client, vmid, linked)
+
+        logger.info(f"Cloning VM {vmid} to {number_of_clones} new {'linked' if linked else 'full'} clones ({max_concurrent} at a time)...")
+        window = asyncio.Semaphore(max_concurrent)
+
+        async def clone_one(new_vmid):
+            new_vm_name = f"clone-{new_vmid}-{base_vm_name}"
+            async with window:
+                try:
+                    await async_clone_one(client, vmid, new_vmid, new_vm_name, timeout, linked, (ip_configs or {}).get(new_vmid))
+                except Exception as e:
+                    logger.error(f"Failed to clone VM {vmid} to {new_vm_name}: {e}")
+                    return {"vmid": new_vmid, "name": new_vm_name, "error": str(e)}
+
+            return None
+
+        results = await asyncio.gather(*(clone_one(new_starting_id + i) for i in range(number_of_clones)))
+
+    clone_errors = [error for error in results if error]
+    if clone_errors:
+        logger.error(f"Failed to clone the following VMs: {json.dumps(clone_errors, indent=2)}")
+        raise ProxmoxError(f"Ha habido un error al clonar las VMs: {json.dumps(clone_errors, indent=2)}")
+
+    logger.info(f"VM {vmid} cloned successfully to {number_of_clones} new VMs")
+
+async def async_batch_start_virtual_machines(vm_id_batch, timeout=60, batch_size=2, client=None):
+    """
+    Versión asíncrona de batch_start_virtual_machines
+
+    Se mantienen hasta batch_size VMs arrancando a la vez; en cuanto una VM
+    está encendida se arranca la siguiente.
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    :raises TimeoutError: Si alguna VM no se puede iniciar o no se inicia en el tiempo dado
+    """
+    async with _client_scope(client) as client:
+        snapshot = await async_get_vms_status_snapshot(client, vm_id_batch)
+        window = asyncio.Semaphore(batch_size)
+
+        async def start_one(vm_id):
+            status = snapshot.get(int(vm_id))
+            if status and status['status'] == 'running':
+                logger.info(f"VM {vm_id} is already running")
+                return None
+
+            async with window:
+                try:
+                    logger.info(f"Starting VM {vm_id}...")
+                    await client.post(f"/nodes/{await async_get_vm_node(client, vm_id)}/qemu/{vm_id}/status/start")
+                except Exception as e:
+                    logger.error(f"Failed to start VM {vm_id}: {e}")
+                    return vm_id
+
+                try:
+                    await client.wait_for_vm_status(vm_id, 'running', timeout)
+                except TimeoutError:
+                    return vm_id
+
+            return None
+
+        # Las VMs cuya petición falla se cuentan junto a las que no terminan a tiempo
+        failed = [vm_id for vm_id in await asyncio.gather(*(start_one(vm_id) for vm_id in vm_id_batch)) if vm_id is not None]
+
+    invalidate_inventory()
+
+    if failed:
+        logger.error(f"Failed to start VMs {failed} in {timeout} seconds")
+        raise TimeoutError(f"Se ha fallado al iniciar las VMs {failed} en {timeout} segundos")
+
+    logger.info("All VMs started successfully")
+
+async def async_batch_stop_virtual_machines(vm_id_batch, batch_size=2, timeout=60, client=None):
+    """
+    Versión asíncrona de batch_stop_virtual_machines
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    :raises TimeoutError: Si alguna VM no se puede apagar o no se apaga en el tiempo dado
+    """
+    async with _client_scope(client) as client:
+        snapshot = await async_get_vms_status_snapshot(client, vm_id_batch)
+        window = asyncio.Semaphore(batch_size)
+
+        async def stop_one(vm_id):
+            status = snapshot.get(int(vm_id))
+            if status and status['status'] == 'stopped':
+                logger.info(f"VM {vm_id} is already stopped")
+                return None
+
+            async with window:
+                try:
+                    logger.info(f"Stopping VM {vm_id}...")
+                    await client.post(f"/nodes/{await async_get_vm_node(client, vm_id)}/qemu/{vm_id}/status/stop")
+                except Exception as e:
+                    logger.error(f"Failed to stop VM {vm_id}: {e}")
+                    return vm_id
+
+                try:
+                    await client.wait_for_vm_status(vm_id, 'stopped', timeout)
+                except TimeoutError:
+                    return vm_id
+
+            return None
+
+        # Las VMs cuya petición falla se cuentan junto a las que no terminan a tiempo
+        failed = [vm_id for vm_id in await asyncio.gather(*(stop_one(vm_id) for vm_id in vm_id_batch)) if vm_id is not None]
+
+    invalidate_inventory()
+
+    if failed:
+        logger.error(f"Failed to stop VMs {failed} in {timeout} seconds")
+        raise TimeoutError(f"Se ha fallado al apagar las VMs {failed} en {timeout} segundos")
+
+    logger.info("All VMs stopped successfully")
+
+async def async_batch_hibernate_virtual_machines(vm_id_batch, batch_size=2, timeout=120, client=None):
+    """
+    Versión asíncrona de batch_hibernate_virtual_machines
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    :raises TimeoutError: Si alguna VM no se hiberna en el tiempo dado
+    """
+    async with _client_scope(client) as client:
+        window = asyncio.Semaphore(batch_size)
+
+        async def hibernate_one(vm_id):
+            async with window:
+                try:
+                    logger.info(f"Hibernating VM {vm_id}...")
+                    await client.post(f"/nodes/{await async_get_vm_node(client, vm_id)}/qemu/{vm_id}/status/suspend", todisk=1)
+                except Exception as e:
+                    logger.error(f"Failed to hibernate VM {vm_id}: {e}")
+                    return vm_id
+
+                try:
+                    await client.wait_for_vm_status(vm_id, 'stopped', timeout)
+                except TimeoutError:
+                    return vm_id
+
+            return None
+
+        failed = [vm_id for vm_id in await asyncio.gather(*(hibernate_one(vm_id) for vm_id in vm_id_batch)) if vm_id is not None]
+
+    invalidate_inventory()
+
+    if failed:
+        logger.error(f"Failed to hibernate VMs {failed} in {timeout} seconds")
+        raise TimeoutError(f"Se ha fallado al hibernar las VMs {failed} en {timeout} segundos")
+
+    logger.info("All VMs hibernated successfully")
+
+def _first_ipv4(vm_agent_info):
+    # Primera IPv4 que no sea de loopback en la respuesta de network-get-interfaces
+    for interface in (vm_agent_info or {}).get('result', []):
+        if interface['name'] != 'lo':
+            for ip_info in interface.get('ip-addresses', []):
+                if ip_info['ip-address-type'] == 'ipv4':
+                    return ip_info['ip-address']
+
+    return None
+
+async def async_get_vm_agent_ip(client, vmid, timeout=20):
+    """
+    Obtiene la primera dirección IPv4 de una VM encendida a través del agente de QEMU
+
+    :return: La dirección IPv4 de la VM
+    :rtype: str
+
+    :raises TimeoutError: Si no se obtiene la dirección IP en el tiempo dado
+    """
+    return await client.wait_for_agent_ip(vmid, timeout)
+
+async def async_boot_and_get_ip(client, vm_id, timeout=60, off_when_done=True, vm_status=None):
+    """
+    Enciende una VM si es necesario, obtiene su dirección IPv4 y, si la encendió
+    este proceso y off_when_done es True, la vuelve a apagar
+
+    :param vm_status: Estado de la VM si ya se conoce (p. ej. de una instantánea), para evitar una petición
+    :type vm_status: dict
+
+    :return: La dirección IPv4 de la VM
+    :rtype: str
+
+    :raises TimeoutError: Si la VM no se inicia o no se obtiene la IP en el tiempo dado
+    :raises ProxmoxError: Si no se puede iniciar la VM
+    """
+    if vm_status is None:
+        vm_status = (await async_get_vms_status_snapshot(client, [vm_id])).get(int(vm_id))
+
+    started = False
+    try:
+        if vm_status and vm_status['status'] == 'running':
+            logger.info(f"VM {vm_id} is already running")
+        else:
+            logger.info(f"Starting VM {vm_id}...")
+            await client.post(f"/nodes/{await async_get_vm_node(client, vm_id)}/qemu/{vm_id}/status/start")
+            started = True
+            invalidate_inventory()
+
+        await client.wait_for_vm_status(vm_id, 'running', timeout)
+        # Se usa un tiempo más bajo porque la VM ya se está iniciando
+        return await async_get_vm_agent_ip(client, vm_id, 20)
+
+    finally:
+        if started and off_when_done:
+            try:
+                await async_stop_vm(client, vm_id)
+            except Exception as e:
+                logger.error(f"Failed to stop VM {vm_id}: {e}")
+
+async def async_get_virtual_machines_ip(list_vmid, timeout=60, batch_size=3, off_when_done=True, client=None):
+    """
+    Versión asíncrona de get_virtual_machines_ip
+
+    :return: Un diccionario con las direcciones IP de las VMs (None si no se pudo obtener)
+    :rtype: dict
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    """
+    ips, _ = await async_get_virtual_machines_ip_detailed(list_vmid, timeout, batch_size, off_when_done, client)
+    return ips
+
+async def async_get_virtual_machines_ip_detailed(list_vmid, timeout=60, batch_size=3, off_when_done=True, client=None):
+    """
+    Versión asíncrona de get_virtual_machines_ip_detailed
+
+    Las VMs apagadas ocupan uno de los batch_size huecos mientras se encienden,
+    se espera a su dirección IP y, si off_when_done es True, se vuelven a apagar.
+    Las que ya estaban encendidas no ocupan hueco. El agente de todas las VMs que
+    esperan su IP se consulta en paralelo en cada comprobación (ver
+    AsyncProxmoxClient.wait_for_agent_ip), y cada VM termina en cuanto tiene la suya.
+
+    :return: Tupla (ips, errors) con los diccionarios vmid -> dirección IP (None si no
+        se pudo obtener) y vmid -> motivo por el que no se obtuvo
+    :rtype: tuple[dict, dict]
+
+    :raises ConnectionError: Si no se puede conectar con Proxmox
+    """
+    errors = {}
+
+    async with _client_scope(client) as client:
+        snapshot = await async_get_vms_status_snapshot(client, list_vmid)
+        window = asyncio.Semaphore(batch_size)
+
+        async def ip_of(vm_id):
+            vm_status = snapshot.get(int(vm_id))
+            try:
+                if vm_status and vm_status['status'] == 'running':
+                    return await async_get_vm_agent_ip(client, vm_id, timeout)
+
+                async with window:
+                    return await async_boot_and_get_ip(client, vm_id, timeout, off_when_done, vm_status)
+
+            except Exception as e:
+                logger.error(f"Failed to get IP address for VM {vm_id}: {e}")
+                errors[vm_id] = str(e)
+                return None
+
+        ips = await asyncio.gather(*(ip_of(vm_id) for vm_id in list_vmid))
+
+    return dict(zip(list_vmid, ips)), errors
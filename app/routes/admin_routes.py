@@ -1,16 +1,22 @@
-import os, uuid, logging
-from flask import Blueprint, render_template, redirect, session, url_for, request, flash, current_app
+import os, uuid, logging, json, queue
+from flask import Blueprint, render_template, redirect, session, url_for, request, flash, current_app, jsonify, Response, stream_with_context
 import time
-from time import sleep
 from functools import wraps
 from werkzeug.utils import secure_filename
 from datetime import datetime
 
 import app.proxmox as proxmox
 import app.guacamole as guacamole
-from app.controllers import horario_controller, usuario_controller, asignatura_controller, matricula_controller, virtual_machines_controller
+import app.provisioning as provisioning
+import app.ip_resolution as ip_resolution
+import app.admission_control as admission_control
+import app.placement as placement_policy
+from app.controllers import horario_controller, usuario_controller, asignatura_controller, matricula_controller, virtual_machines_controller, job_controller, ip_allocation_controller
+from app.models.virtual_machine import CLONE_MODES
 
-from app.utils.tasks import reschedule_virtual_machines_tasks
+from app.utils.tasks import reschedule_virtual_machines_tasks, request_warm_pool_refill, database_lock, CLONE_LOCK_NAME
+import app.utils.jobs as jobs
+import app.utils.events as events
 
 # Import the appropiate configuration
 from app.config import Config
@@ -19,6 +25,7 @@ from app.config import Config
 # Constants
 DIAS_SEMANA = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes']
 BYTES_IN_GIB = 1073741824
+SSE_HEARTBEAT_INTERVAL = 15 # Segundos entre mensajes para mantener abierta la conexión de eventos
 
 admin_bp = Blueprint('admin_bp', __name__, url_prefix='/admin')
 
@@ -26,7 +33,6 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Define other Proxmox specific names
-proxmox_node = Config.PROXMOX.NODE_NAME
 
 def admin_required(f):
     @wraps(f)
@@ -182,8 +188,7 @@ def gestion_maquinas():
     print("Connected to Proxmox")
 
     # Get the list of virtual machines in our database
-    database_vms = [vm.serialize() for vm in virtual_machines_controller.get_all_virtual_machines()]
-    database_vm_ids = [vm['proxmox_id'] for vm in database_vms]
+    database_vms = {vm.proxmox_id: vm for vm in virtual_machines_controller.get_all_virtual_machines()}
 
     # Get the list of virtual machines in Proxmox
     proxmox_vms = proxmox.get_all_vms_serialized()
@@ -197,11 +202,11 @@ def gestion_maquinas():
     unregistered_vms = []
 
     for vm in proxmox_vms:
-        if vm['id'] in database_vm_ids:
-            if database_vms[database_vm_ids.index(vm['id'])]['is_base_vm']:
-                registered_vms.append(vm)
-        else:
+        database_vm = database_vms.get(vm['id'])
+        if database_vm is None:
             unregistered_vms.append(vm)
+        elif database_vm.is_base_vm:
+            registered_vms.append(vm)
 
     registered_vms.sort(key=lambda x: x['id'])
     unregistered_vms.sort(key=lambda x: x['id'])
@@ -252,6 +257,7 @@ def handle_form_action_asignatura(logged_user, action, asignatura=None):
     # Datos asignatura
     nombre = request.form.get('nombre')
     descripcion = request.form.get('descripcion')
+    warm_pool_size = request.form.get('warm-pool-size', '0') or '0'
 
     # Datos laboratorios
     lab_ids = request.form.getlist('lab-ids[]')
@@ -273,6 +279,11 @@ def handle_form_action_asignatura(logged_user, action, asignatura=None):
         flash(error_message, "danger")
         return redirect(url_for('admin_bp.crear_asignatura'))
 
+    if not warm_pool_size.isdigit():
+        flash("El número de clones de reserva no es un número válido", "danger")
+        return redirect(url_for('admin_bp.gestion_asignaturas'))
+    warm_pool_size = int(warm_pool_size)
+
     file_data = {
         'labs': lab_names,
         'lab-files': lab_pdf_files
@@ -290,9 +301,11 @@ def handle_form_action_asignatura(logged_user, action, asignatura=None):
                 descripcion,
                 labs_data,
                 alumnos_ids,
-                horarios_data
+                horarios_data,
+                warm_pool_size
             )
             reschedule_virtual_machines_tasks(new_asig.id)
+            request_warm_pool_refill(new_asig.id)
             flash("Asignatura creada correctamente", "success")
 
         elif action == "edit" and asignatura is not None:
@@ -302,9 +315,11 @@ def handle_form_action_asignatura(logged_user, action, asignatura=None):
                 descripcion,
                 labs_data,
                 alumnos_ids,
-                horarios_data
+                horarios_data,
+                warm_pool_size
             )
             reschedule_virtual_machines_tasks(asignatura.id)
+            request_warm_pool_refill(asignatura.id)
             flash("Asignatura actualizada correctamente", "success")
 
     except asignatura_controller.AsignaturaException as e:
@@ -445,6 +460,11 @@ def handle_form_action_usuario(action, usuario=None):
             )
             flash("Usuario actualizado correctamente", "success")
 
+        # Al matricularse, el alumno recibe un clon de reserva: pasa a los horarios y se repone la reserva
+        for asignatura_id in asignaturas_ids:
+            reschedule_virtual_machines_tasks(asignatura_id)
+            request_warm_pool_refill(asignatura_id)
+
     except ValueError as e:
         flash(f"Error al crear el usuario: {e}", "danger")
 
@@ -516,24 +536,32 @@ def deregister_maquina_virtual(proxmox_id):
     Este método borra la máquina virtual la base de datos, no de Proxmox. Además,
     también da de baja todos los clones si existen.
     """
+    asignatura_id = None
     try:
         vm = virtual_machines_controller.get_virtual_machine_by_id(proxmox_id)
         if vm is None:
             return f"La VM {proxmox_id} no se encuentra en la base de datos"
 
+        asignatura_id = vm.asignatura_id
+
         if vm.is_base_vm:
             # Al ser una máquina base, se obtienen los clones y se dan de baja
             clones = virtual_machines_controller.get_clones_of_virtual_machine(proxmox_id)
-            token = guacamole.get_guacamole_token()
+            # Las conexiones se borran en bloque, ignorando las que ya no existen
+            try:
+                token = guacamole.get_guacamole_token()
+                connection_errors = guacamole.bulk_delete_guacamole_connections(
+                    token, [clone.guacamole_connection_id for clone in clones if clone.guacamole_connection_id]
+                )
+            except guacamole.GuacamoleError as e:
+                return f"Error al dar de baja los clones en Guacamole: {e}"
+
             for clone in clones:
-                try:
-                    if clone.guacamole_connection_id:
-                        guacamole.delete_guacamole_connection(token, clone.guacamole_connection_id)
+                if clone.guacamole_connection_id in connection_errors:
+                    return f"Error al dar de baja el clon {clone.proxmox_id} en Guacamole: {connection_errors[clone.guacamole_connection_id]}"
 
+                try:
                     virtual_machines_controller.delete_virtual_machine(clone.proxmox_id)
-
-                except guacamole.GuacamoleError as e:
-                        return f"Error al dar de baja el clon {clone.proxmox_id} en Guacamole: {e}"
                 except Exception as e:
                     return f"Error al dar de baja el clon {clone.proxmox_id}: {e}"
 
@@ -546,6 +574,11 @@ def deregister_maquina_virtual(proxmox_id):
     except Exception as e:
         return f"Error al dar de baja la VM: {e}"
 
+    finally:
+        # Las tareas de los horarios guardan los IDs de los clones: se quitan los dados de baja
+        if asignatura_id is not None:
+            reschedule_virtual_machines_tasks(asignatura_id)
+
     return None # No errors
 
 ## Operaciones que no requieren conexión con Proxmox directamente
@@ -597,7 +630,8 @@ def registrar_maquina_virtual(proxmox_id):
             asignatura_id=int(asignatura_id),
             vnc_username=vnc_username,
             vnc_password=vnc_password,
-            is_base=True
+            is_base=True,
+            node=proxmox_vm['node']
         )
         flash(f"VM {proxmox_id} registrada correctamente", "success")
 
@@ -689,10 +723,12 @@ def editar_maquina_virtual(proxmox_id):
     return render_template(
         'admin_formulario_maquina_virtual.html',
         proxmox_vm=vm,
+        database_vm=database_vm.serialize(),
         asignatura_relacionada=asignatura_relacionada,
         alumnos=alumnos,
         clones=clone_list,
-        current_user=logged_user
+        current_user=logged_user,
+        ip_pool_enabled=ip_allocation_controller.is_pool_enabled()
     )
 
 ### Funciones de ayuda para modularizar el método de clonación
@@ -727,13 +763,21 @@ def validate_clone_data(proxmox_id, n_clones, new_starting_id, proxmox_vms_ids):
     
     return vm_a_clonar
 
-@admin_required
-def store_clones_in_database(base_vm_obj, n_clones, new_starting_id):
+def get_clone_timeout(proxmox_vm):
+    # Con el pipeline los clones se crean a la vez, el tiempo máximo es por clon
+    vm_disk_size = proxmox_vm['maxdisk'] // BYTES_IN_GIB # Convertir a GiB
+    timeout = 180 if vm_disk_size > 30 else 120
+    return timeout * Config.PROXMOX.CLONE_CONCURRENCY
+
+def store_clones_in_database(base_vm_obj, clone_ids, owner_id, clone_mode='full', ip_addresses=None, nodes=None):
     # Guardar la información de los clones en la base de datos
+    # Los clones sobrantes (sin alumnos a los que asignarlos) quedan a nombre de owner_id
+    # Si owner_id es None, los sobrantes quedan como clones de reserva para futuros alumnos
+    # ip_addresses: diccionario ID del clon -> IP fija asignada desde el pool
+    # nodes: diccionario ID del clon -> nodo del clúster en el que se ha creado
+    ip_addresses = ip_addresses or {}
+    nodes = nodes or {}
     try:
-        logged_user = session.get('logged_user')
-        assert logged_user is not None, "El usuario va a existir por el wrapper"
-
         alumnos_matriculados = matricula_controller.get_objetos_alumnos_matriculados(base_vm_obj.asignatura_id)
 
         alumnos_matriculados = list(
@@ -745,12 +789,11 @@ def store_clones_in_database(base_vm_obj, n_clones, new_starting_id):
             filter(lambda alumno: not any(vm.user_id == alumno.id for vm in virtual_machines), alumnos_matriculados)
         )
 
-        for i in range(int(n_clones)):
-            alumno_id = logged_user['id']
+        for i, new_id in enumerate(clone_ids):
+            alumno_id = owner_id
             if i < len(alumnos_sin_vm): # Si hay alumnos sin VMs
                 alumno_id = alumnos_sin_vm[i].id
 
-            new_id = new_starting_id + i
             virtual_machines_controller.create_virtual_machine(
                 proxmox_id=new_id,
                 name=f"clone-{new_id}-{base_vm_obj.nombre}",
@@ -759,45 +802,623 @@ def store_clones_in_database(base_vm_obj, n_clones, new_starting_id):
                 vnc_username=base_vm_obj.vnc_username,
                 vnc_password=base_vm_obj.get_vnc_password(),
                 is_base=False,
-                cloned_from=base_vm_obj.proxmox_id
+                cloned_from=base_vm_obj.proxmox_id,
+                clone_mode=clone_mode,
+                ip_address=ip_addresses.get(new_id),
+                is_spare=alumno_id is None,
+                node=nodes.get(new_id)
             )
 
     except Exception as e:
         raise Exception(f"Error al crear los clones en la base de datos: {e}")
 
+def get_used_vm_ids():
+    # IDs ocupados por una VM de Proxmox o de la base de datos o por una reserva de IP
+    # Se debe llamar con CLONE_LOCK_NAME para que no cambien antes de crear los clones
+    used_ids = {vm['id'] for vm in proxmox.get_all_vms_serialized(max_age=0)}
+    used_ids |= {vm.proxmox_id for vm in virtual_machines_controller.get_all_virtual_machines()}
+    used_ids |= ip_allocation_controller.get_reserved_ids()
+    return used_ids
+
+def find_created_clones(base_vm_name, vmids):
+    # Devuelve ID -> datos de Proxmox de los clones de vmids que existen con el nombre clone-{id}-{base_vm_name},
+    # para no confundirlos con VMs ajenas que hayan tomado el mismo ID
+    return {
+        vm_id: vm for vm_id, vm in proxmox.get_vms_status_snapshot(vmids).items()
+        if vm.get('name') == f"clone-{vm_id}-{base_vm_name}"
+    }
+
+def cleanup_unsaved_clones(job, base_vm_obj, base_vm_name, new_vmids, ip_addresses, results, owner_id, clone_mode='full'):
+    # Se llama cuando un trabajo de clonación falla a medias para no dejar clones ni IPs huérfanos
+    # - Si el aprovisionamiento no terminó (results es None), los clones que ya están en Proxmox
+    #   (con el nombre clone-{id}-{base_vm_name}) se guardan en la base de datos, sin conexión de Guacamole
+    # - Los clones creados que siguen sin estar en la base de datos se borran de Proxmox,
+    #   junto con sus conexiones de Guacamole
+    # - Las IPs reservadas de los clones que no están en la base de datos vuelven al pool
+    def saved_ids():
+        return {vm_id for vm_id in new_vmids if virtual_machines_controller.get_virtual_machine_by_id(vm_id) is not None}
+
+    connection_ids = {}
+    if results is None:
+        try:
+            created = find_created_clones(base_vm_name, new_vmids)
+        except Exception as e:
+            logger.error(f"Could not check which clones of {new_vmids} were created: {e}")
+            created = {}
+
+        try:
+            to_record = [vm_id for vm_id in new_vmids if vm_id in created and vm_id not in saved_ids()]
+            if to_record:
+                store_clones_in_database(
+                    base_vm_obj, to_record, owner_id, clone_mode, ip_addresses,
+                    nodes={vm_id: created[vm_id]['node'] for vm_id in to_record}
+                )
+                job.add_message(f"Los clones {to_record} se crearon antes del error y se han guardado sin conexión de Guacamole", "warning")
+                reschedule_virtual_machines_tasks(base_vm_obj.asignatura_id)
+        except Exception as e:
+            logger.error(f"Failed to store the clones created before the error: {e}")
+    else:
+        created = {vm_id for vm_id, result in results.items() if result['cloned']}
+        connection_ids = {vm_id: result['connection_id'] for vm_id, result in results.items() if result['connection_id']}
+
+    try:
+        saved = saved_ids()
+    except Exception as e:
+        # Sin saber qué se ha guardado no se borra nada
+        logger.error(f"Could not check which clones of {new_vmids} were stored, leaving them as they are: {e}")
+        return
+
+    orphans = [vm_id for vm_id in new_vmids if vm_id in created and vm_id not in saved]
+    if orphans:
+        orphan_connections = [connection_ids[vm_id] for vm_id in orphans if vm_id in connection_ids]
+        if orphan_connections:
+            try:
+                guacamole.bulk_delete_guacamole_connections(guacamole.get_guacamole_token(), orphan_connections)
+            except guacamole.GuacamoleError as e:
+                logger.error(f"Failed to delete the Guacamole connections {orphan_connections}: {e}")
+
+        deleted = []
+        for vm_id in orphans:
+            try:
+                proxmox.delete_vm(vm_id)
+                deleted.append(vm_id)
+            except Exception as e:
+                logger.error(f"Failed to delete the unsaved clone {vm_id}: {e}")
+                job.add_message(f"No se ha podido borrar el clon {vm_id}, que no está en la base de datos: {e}", "danger")
+
+        if deleted:
+            job.add_message(f"Se han borrado los clones {deleted}, que no se habían podido guardar", "warning")
+
+    # Las IPs de los clones que pueden existir sin que se sepa siguen reservadas
+    unknown = {vm_id for vm_id, result in (results or {}).items() if result['cloned'] is None}
+    unsaved_ips = [vm_id for vm_id in ip_addresses if vm_id not in saved and vm_id not in unknown]
+    if unsaved_ips:
+        try:
+            ip_allocation_controller.release_ip_addresses(unsaved_ips)
+        except Exception as e:
+            logger.error(f"Failed to release the IPs of clones {unsaved_ips}: {e}")
+
+def retry_spare_connections(job, spares):
+    # Crea las conexiones de Guacamole de los clones de reserva que se guardaron sin ella
+    # Los que sigan sin conexión se reintentan en la siguiente reposición
+    try:
+        guaca_token = guacamole.get_guacamole_token()
+    except guacamole.GuacamoleError as e:
+        job.add_message(f"No se han podido crear las conexiones de los clones de reserva {[vm.proxmox_id for vm in spares]}: {e}", "warning")
+        return
+
+    for vm in spares:
+        try:
+            vm_ip = vm.ip_address or ip_resolution.resolve_vm_ip(vm.proxmox_id) or proxmox.get_vm_ip_addr(vm.proxmox_id)
+            connection_id = guacamole.create_guacamole_connection(
+                token=guaca_token,
+                virtual_machine_ip=vm_ip,
+                connection_name=vm.nombre,
+                virtual_machine_username=vm.vnc_username,
+                connection_password=vm.get_vnc_password()
+            )
+            if not connection_id:
+                raise Exception("Guacamole no ha devuelto el ID de la conexión")
+
+            virtual_machines_controller.update_virtual_machine(vm.proxmox_id, guacamole_connection_id=connection_id)
+        except Exception as e:
+            logger.error(f"Failed to create the Guacamole connection of spare clone {vm.proxmox_id}: {e}")
+            job.add_message(f"No se ha podido crear la conexión del clon de reserva {vm.proxmox_id}: {e}", "warning")
+
+## Trabajos en segundo plano
+## Las operaciones largas se ejecutan fuera de la petición. Las rutas validan los datos,
+## encolan el trabajo y redirigen a una página que consulta su progreso en /admin/jobs/<id>
+@jobs.job_handler('clone_vm')
+def clone_vm_job(job, proxmox_id, base_vm_name, new_starting_id, number_of_clones, timeout, clone_mode, create_connections, owner_id, static_ips=False):
+    """Trabajo que clona una VM y, opcionalmente, crea las conexiones de Guacamole
+
+    Con static_ips cada clon recibe una IP fija del pool a través de cloud-init,
+    de modo que su conexión se crea sin encenderlo. Los trabajos de clonación se
+    ejecutan de uno en uno (ver CLONE_LOCK_NAME) y los IDs se vuelven a comprobar
+    al obtener el bloqueo, ya que la ruta solo los comprobó al encolar el trabajo.
+
+    :return: Diccionario vmid -> error de los clones que han fallado
+    :rtype: dict
+    """
+    def on_wait():
+        job.update(message="Esperando a que terminen otras clonaciones")
+
+    with database_lock(CLONE_LOCK_NAME, on_wait):
+        new_vmids = [new_starting_id + i for i in range(number_of_clones)]
+        try:
+            taken = sorted(set(new_vmids) & get_used_vm_ids())
+        except proxmox.ProxmoxError as e:
+            raise Exception(f"Error al obtener los datos de las VM's de Proxmox: {e}") from e
+
+        if taken:
+            raise Exception(f"Los IDs {taken} ya están en uso o reservados")
+
+        return clone_vms(
+            job, proxmox_id, base_vm_name, new_starting_id, number_of_clones, timeout,
+            clone_mode, create_connections, owner_id, static_ips
+        )
+
+def clone_vms(job, proxmox_id, base_vm_name, new_starting_id, number_of_clones, timeout, clone_mode, create_connections, owner_id, static_ips=False):
+    # Cuerpo de clone_vm_job, se debe llamar con CLONE_LOCK_NAME y con IDs libres: así todas las
+    # reservas de IP de new_vmids son de este trabajo y se pueden liberar si algo falla
+    # Prueba de rendimiento: tiempo
+    start_time = time.perf_counter()
+
+    database_vm = virtual_machines_controller.get_virtual_machine_by_id(proxmox_id)
+    if database_vm is None:
+        raise Exception(f"La VM {proxmox_id} no se encuentra en la base de datos")
+
+    new_vmids = [new_starting_id + i for i in range(number_of_clones)]
+    try:
+        # Se decide el nodo de cada clon y se comprueba que sus almacenamientos tienen sitio
+        job.update(message="Comprobando el espacio libre de los nodos")
+        placement = placement_policy.plan_clone_placement(
+            proxmox_id, new_vmids, database_vm.asignatura_id, linked=clone_mode == 'linked'
+        )
+        admission_control.check_clone(proxmox_id, number_of_clones, linked=clone_mode == 'linked', placement=placement)
+
+        # Los clones enlazados necesitan que la VM base sea una plantilla
+        if clone_mode == 'linked' and not database_vm.is_template:
+            job.update(message="Convirtiendo la VM base en plantilla")
+            proxmox.convert_to_template(proxmox_id)
+            virtual_machines_controller.update_virtual_machine(proxmox_id, is_template=True)
+
+        ip_addresses = {}
+        if static_ips:
+            job.update(message="Reservando las IPs de los clones")
+            ip_addresses = ip_allocation_controller.allocate_ip_addresses(
+                new_vmids, in_use=ip_resolution.get_addresses_in_use()
+            )
+
+    except admission_control.AdmissionException as e:
+        raise Exception(f"No se pueden crear los clones: {e}") from e
+
+    except ip_allocation_controller.IpAllocationException as e:
+        raise Exception(f"Error al asignar las IPs de los clones: {e}") from e
+
+    except proxmox.ProxmoxError as e:
+        raise Exception(f"Error al obtener los datos de las VM's de Proxmox: {e}") from e
+
+    # A partir de aquí ya hay IPs reservadas y puede haber clones en Proxmox: si algo falla,
+    # cleanup_unsaved_clones los guarda o los borra y devuelve las IPs al pool
+    results = None
+    try:
+        connection_data = None
+        if create_connections:
+            connection_data = {
+                'token': guacamole.get_guacamole_token(),
+                'name': database_vm.nombre,
+                'vnc_username': database_vm.vnc_username,
+                'vnc_password': database_vm.get_vnc_password()
+            }
+
+        # Un clon termina al crearse su conexión (o al clonarse si no se crean conexiones)
+        last_stage = 'connection_created' if create_connections else 'cloned'
+        finished = []
+        def on_progress(vm_id, stage, detail=None):
+            # Las etapas de cada clon se emiten en directo por /admin/jobs/<id>/events
+            job.publish('vm', {'vmid': vm_id, 'stage': stage, 'detail': detail})
+            if stage in (last_stage, 'failed'):
+                finished.append(vm_id)
+                job.update(
+                    progress=90 * len(finished) / number_of_clones,
+                    message=f"{len(finished)} de {number_of_clones} clones procesados"
+                )
+
+        job.update(message="Clonando la VM")
+        for vm_id in new_vmids:
+            job.publish('vm', {'vmid': vm_id, 'stage': 'queued', 'detail': None})
+
+        # Clonar, obtener las IPs y crear las conexiones como un pipeline por clon
+        results = provisioning.provision_clones(
+            vmid=proxmox_id,
+            base_vm_name=base_vm_name,
+            new_starting_id=new_starting_id,
+            number_of_clones=number_of_clones,
+            clone_timeout=timeout,
+            linked=clone_mode == 'linked',
+            connection_data=connection_data,
+            on_progress=on_progress,
+            ip_configs={vm_id: ip_allocation_controller.get_ipconfig(ip) for vm_id, ip in ip_addresses.items()},
+            placement=placement
+        )
+
+        # Los clones cuya tarea agotó el tiempo y no se pudo detener se buscan en Proxmox
+        unknown = [vm_id for vm_id, result in results.items() if result['cloned'] is None]
+        if unknown:
+            try:
+                found = find_created_clones(base_vm_name, unknown)
+            except (ConnectionError, proxmox.ProxmoxError) as e:
+                logger.error(f"Could not check whether the clones {unknown} were created: {e}")
+                job.add_message(f"No se ha podido comprobar si se han creado los clones {unknown}, sus IPs siguen reservadas: {e}", "danger")
+                found = None
+
+            if found is not None:
+                for vm_id in unknown:
+                    results[vm_id]['cloned'] = vm_id in found
+                    results[vm_id]['node'] = found.get(vm_id, {}).get('node')
+
+        cloned_ids = [vm_id for vm_id, result in results.items() if result['cloned']]
+        failed = {vm_id: result['error'] for vm_id, result in results.items() if result['error']}
+
+        # Las IPs de los clones que no se han llegado a crear vuelven al pool
+        not_cloned = [vm_id for vm_id in ip_addresses if results[vm_id]['cloned'] is False]
+        if not_cloned:
+            ip_allocation_controller.release_ip_addresses(not_cloned)
+
+        # Se guarda la información de los clones en la base de datos
+        job.update(message="Guardando los clones")
+        store_clones_in_database(
+            database_vm, cloned_ids, owner_id, clone_mode, ip_addresses,
+            nodes={vm_id: result['node'] for vm_id, result in results.items()}
+        )
+
+    except guacamole.GuacamoleError as e:
+        cleanup_unsaved_clones(job, database_vm, base_vm_name, new_vmids, ip_addresses, results, owner_id, clone_mode)
+        raise Exception(f"Error al crear las conexiones de Guacamole: {e}") from e
+
+    except proxmox.ProxmoxError as e:
+        cleanup_unsaved_clones(job, database_vm, base_vm_name, new_vmids, ip_addresses, results, owner_id, clone_mode)
+        raise Exception(f"Error al obtener los datos de las VM's de Proxmox: {e}") from e
+
+    except Exception:
+        cleanup_unsaved_clones(job, database_vm, base_vm_name, new_vmids, ip_addresses, results, owner_id, clone_mode)
+        raise
+
+    # Se actualizan las operaciones en segundo plano para incluir las nuevas máquinas virtuales
+    reschedule_virtual_machines_tasks(database_vm.asignatura_id)
+
+    message = "VM clonada correctamente"
+
+    if create_connections:
+        # Se guardan los datos de las conexiones en la base de datos
+        virtual_machines_controller.bulk_update_virtual_machines(
+            [
+                {
+                    "proxmox_id": vm_id,
+                    "guacamole_connection_id": result['connection_id']
+                }
+                for vm_id, result in results.items() if result['connection_id']
+            ]
+        )
+
+        message += " y conexiones de Guacamole creadas exitosamente"
+
+    for vm_id, error in failed.items():
+        job.add_message(f"Error al aprovisionar el clon {vm_id}: {error}", "danger")
+
+    if failed:
+        if not cloned_ids:
+            raise Exception("No se ha podido crear ningún clon")
+
+        message = f"{len(cloned_ids)} de {number_of_clones} clones creados"
+
+    job.add_message(message, "warning" if failed else "success")
+
+    elapsed_time = time.perf_counter() - start_time
+    logger.info(f"\nTiempo total de la operación: {elapsed_time:.3f} segundos\n")
+
+    return {str(vm_id): error for vm_id, error in failed.items()}
+
+@jobs.job_handler('refill_warm_pool')
+def refill_warm_pool_job(job, asignatura_id):
+    """Trabajo que repone los clones de reserva de una asignatura
+
+    Reintenta las conexiones de Guacamole de los clones de reserva que no la
+    tienen y crea los clones que faltan hasta warm_pool_size, con su conexión
+    de Guacamole y, si hay un pool configurado y la VM base tiene una unidad de
+    cloud-init, con una IP fija, de modo que al matricular a un alumno se le
+    pueda asignar uno al instante. Se ejecuta de uno en uno con el resto de trabajos de clonación (ver
+    CLONE_LOCK_NAME) para que no tomen los mismos IDs.
+
+    :return: Diccionario vmid -> error de los clones que han fallado
+    :rtype: dict
+    """
+    asignatura = asignatura_controller.get_asignatura_by_id(asignatura_id)
+    if asignatura is None:
+        raise Exception(f"La asignatura {asignatura_id} no existe")
+
+    base_vm = next(
+        (vm for vm in virtual_machines_controller.get_virtual_machine_by_asignatura(asignatura_id) if vm.is_base_vm),
+        None
+    )
+    if base_vm is None:
+        job.add_message(f"La asignatura {asignatura.nombre} no tiene una VM base", "warning")
+        return {}
+
+    def on_wait():
+        job.update(message="Esperando a que terminen otras clonaciones")
+
+    with database_lock(CLONE_LOCK_NAME, on_wait):
+        # Los clones sin conexión cuentan como reserva para no crear otros mientras Guacamole falla
+        spares = virtual_machines_controller.get_unowned_clones(asignatura_id)
+        without_connection = [vm for vm in spares if not vm.guacamole_connection_id]
+        if without_connection:
+            job.update(message="Creando las conexiones de los clones de reserva que no la tienen")
+            retry_spare_connections(job, without_connection)
+
+        needed = asignatura.warm_pool_size - len(spares)
+        if needed <= 0:
+            if not without_connection:
+                job.add_message("Los clones de reserva ya están completos", "info")
+            return {}
+
+        try:
+            vm_a_clonar = proxmox.get_vm_by_id(base_vm.proxmox_id)
+            if vm_a_clonar is None:
+                raise Exception(f"La VM {base_vm.proxmox_id} no se encuentra en Proxmox")
+
+            # Los nuevos IDs empiezan tras el mayor ID en uso en Proxmox, en la base de datos o en las reservas de IP
+            used_ids = get_used_vm_ids()
+
+            # Sin unidad de cloud-init los clones no tomarían la IP fija y sus conexiones apuntarían a otra dirección
+            pool_enabled = ip_allocation_controller.is_pool_enabled()
+            static_ips = pool_enabled and proxmox.has_cloudinit_drive(base_vm.proxmox_id)
+
+        except proxmox.ProxmoxError as e:
+            raise Exception(f"Error al obtener los datos de las VM's de Proxmox: {e}") from e
+
+        if pool_enabled and not static_ips:
+            job.add_message(
+                f"La VM base {base_vm.proxmox_id} no tiene una unidad de cloud-init, los clones de reserva obtendrán su IP por DHCP",
+                "warning"
+            )
+
+        logger.info(f"Refilling warm pool of subject {asignatura_id} with {needed} clones")
+        return clone_vms(
+            job,
+            proxmox_id=base_vm.proxmox_id,
+            base_vm_name=vm_a_clonar['name'],
+            new_starting_id=max(used_ids) + 1,
+            number_of_clones=needed,
+            timeout=get_clone_timeout(vm_a_clonar),
+            clone_mode='linked' if base_vm.is_template else 'full',
+            create_connections=True,
+            owner_id=None,
+            static_ips=static_ips
+        )
+
+@jobs.job_handler('delete_vm')
+def delete_vm_job(job, proxmox_id):
+    """Trabajo que elimina una VM de Proxmox"""
+    job.update(message=f"Eliminando la VM {proxmox_id}")
+    proxmox.delete_vm(proxmox_id)
+
+    job.add_message(f"VM {proxmox_id} eliminada correctamente", "success")
+
+@jobs.job_handler('delete_clone')
+def delete_clone_job(job, proxmox_id):
+    """Trabajo que elimina un clon de Proxmox, su conexión de Guacamole y su registro en la base de datos"""
+    database_vm = virtual_machines_controller.get_virtual_machine_by_id(proxmox_id)
+    if database_vm is None:
+        raise Exception(f"La VM {proxmox_id} no se encuentra en la base de datos")
+
+    if database_vm.guacamole_connection_id:
+        job.update(progress=10, message="Eliminando la conexión de Guacamole")
+        try:
+            guaca_token = guacamole.get_guacamole_token()
+            if guacamole.test_guacamole_connection(guaca_token, database_vm.guacamole_connection_id):
+                guacamole.delete_guacamole_connection(guaca_token, database_vm.guacamole_connection_id)
+            else:
+                job.add_message(f"La conexión de Guacamole de la VM {proxmox_id} no existe", "warning")
+
+        except guacamole.GuacamoleError as e:
+            # Warning porque es posible que la conexión no existiera en Guacamole
+            job.add_message(f"Error al eliminar la conexión de Guacamole: {e}", "warning")
+
+    # Eliminar la máquina virtual de Proxmox
+    job.update(progress=30, message=f"Eliminando la VM {proxmox_id} de Proxmox")
+    try:
+        proxmox.delete_vm(proxmox_id)
+    except (ConnectionError, TimeoutError, proxmox.ProxmoxError) as e:
+        job.add_message(f"Error al eliminar la VM de Proxmox: {e}", "danger")
+
+    # Eliminar la máquina virtual de la base de datos
+    job.update(progress=90, message="Eliminando la VM de la base de datos")
+    asignatura_id = database_vm.asignatura_id
+    try:
+        virtual_machines_controller.delete_virtual_machine(proxmox_id)
+    except Exception as e:
+        job.add_message(f"Error al eliminar la VM de la base de datos: {e}", "danger")
+
+    # Las tareas de los horarios guardan los IDs de los clones: se quita el eliminado
+    reschedule_virtual_machines_tasks(asignatura_id)
+
+    job.add_message(f"VM {proxmox_id} eliminada correctamente", "success")
+
+@jobs.job_handler('test_connection')
+def test_connection_job(job, proxmox_id):
+    """Trabajo que comprueba la conexión de Guacamole de un clon, creándola si no existe"""
+    start_time = time.perf_counter()
+
+    clone_vm = virtual_machines_controller.get_virtual_machine_by_id(proxmox_id)
+    if clone_vm is None:
+        raise Exception(f"La VM {proxmox_id} no se encuentra en la base de datos")
+
+    guaca_token = guacamole.get_guacamole_token()
+    if not guaca_token:
+        raise Exception("No se ha podido obtener el token de Guacamole")
+
+    if clone_vm.guacamole_connection_id:
+        # Si la conexión está registrada, se comprueba si existe
+        if not guacamole.test_guacamole_connection(guaca_token, clone_vm.guacamole_connection_id):
+            virtual_machines_controller.update_virtual_machine(
+                proxmox_id,
+                guacamole_connection_id=None
+            )
+        else:
+            job.add_message(f"Conexión de Guacamole de la VM {proxmox_id} existe", "info")
+            return
+
+    # Si no existe, se crea una nueva conexión y se prueba
+    job.update(progress=20, message=f"Obteniendo la IP de la VM {proxmox_id}")
+    vm_ip = ip_resolution.resolve_vm_ip(clone_vm.proxmox_id) or proxmox.get_vm_ip_addr(clone_vm.proxmox_id)
+
+    job.update(progress=70, message="Creando la conexión de Guacamole")
+    guacamole_conn_id = guacamole.create_guacamole_connection(
+        token=guaca_token,
+        virtual_machine_ip=vm_ip,
+        connection_name=f"{clone_vm.nombre}",
+        virtual_machine_username=clone_vm.vnc_username,
+        connection_password=clone_vm.get_vnc_password()
+    )
+    if not guacamole_conn_id:
+        raise Exception(f"No se ha podido crear la conexión de Guacamole para la VM {proxmox_id}")
+
+    virtual_machines_controller.update_virtual_machine(
+        clone_vm.proxmox_id,
+        guacamole_connection_id=guacamole_conn_id
+    )
+
+    # Se actualiza la información de la VM clonada
+    clone_vm = virtual_machines_controller.get_virtual_machine_by_id(proxmox_id)
+    if not clone_vm or not clone_vm.guacamole_connection_id:
+        raise Exception("Ha habido un error actualizando la máquina virtual con la conexión de Guacamole")
+
+    if not guacamole.test_guacamole_connection(guaca_token, clone_vm.guacamole_connection_id):
+        raise Exception("No se ha podido probar la conexión de Guacamole")
+
+    job.add_message(f"Conexión de Guacamole de la VM {proxmox_id} creada exitosamente", "success")
+
+    elapsed_time = time.perf_counter() - start_time
+    logger.info(f"\nTiempo total de Guacamole: {elapsed_time:.3f} segundos\n")
+
+@admin_bp.route('/jobs/<int:job_id>', methods=['GET'])
+@admin_required
+def estado_trabajo(job_id):
+    """Devuelve el estado de un trabajo en segundo plano en formato JSON
+
+    Las páginas de administración consultan esta ruta periódicamente para
+    mostrar el progreso de las operaciones largas.
+
+    :param job_id: ID del trabajo
+    :type job_id: int
+
+    :return: JSON con los datos del trabajo o un 404 si no existe
+    """
+    job = job_controller.get_job_by_id(job_id)
+    if job is None:
+        return jsonify({'error': f"El trabajo {job_id} no existe"}), 404
+
+    return jsonify(job.serialize())
+
+@admin_bp.route('/jobs/<int:job_id>/events', methods=['GET'])
+@admin_required
+def eventos_trabajo(job_id):
+    """Emite los eventos de un trabajo en segundo plano como Server-Sent Events
+
+    Los eventos se leen del bus en memoria del proceso, por lo que cualquier número
+    de administradores puede seguir el trabajo sin consultar Proxmox. Se emiten:
+        - vm: Cambio de etapa de un clon (queued, cloning, cloned, booting, ip_found, connection_created, failed)
+        - progress: Progreso y mensaje del trabajo
+        - message: Mensaje para el usuario
+        - end: El trabajo ha terminado
+
+    Si el trabajo se ejecuta en otro proceso solo se emite el evento 'end', y la
+    página sigue mostrando el progreso consultando /admin/jobs/<id>.
+
+    :param job_id: ID del trabajo
+    :type job_id: int
+
+    :return: Stream text/event-stream o un 404 si el trabajo no existe
+    """
+    if job_controller.get_job_status(job_id) is None:
+        return jsonify({'error': f"El trabajo {job_id} no existe"}), 404
+
+    def format_event(event, data):
+        return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+    def stream():
+        channel = events.job_channel(job_id)
+        subscriber = events.bus.subscribe(channel)
+        try:
+            # Se comprueba después de suscribirse para no perder el final del trabajo
+            status = job_controller.get_job_status(job_id)
+            while status not in ('completed', 'failed', None):
+                try:
+                    message = subscriber.get(timeout=SSE_HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    status = job_controller.get_job_status(job_id)
+                    yield ": keep-alive\n\n"
+                    continue
+
+                yield format_event(message['event'], message['data'])
+                if message['event'] == 'end':
+                    return
+
+            yield format_event('end', {'status': status})
+
+        finally:
+            events.bus.unsubscribe(channel, subscriber)
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @admin_bp.route('/virtual_machines/proxmox/<int:proxmox_id>/clonar', methods=['POST'])
 @admin_required
 @check_proxmox_connection
 def clonar_maquina_virtual(proxmox_id):
     """Clona una máquina virtual de Proxmox
 
-    Esta ruta clona una máquina virtual de Proxmox, creando una o varias copias de la misma dependiendo de los datos del formulario.
+    Esta ruta valida los datos y encola un trabajo que crea una o varias copias de la
+    máquina virtual dependiendo de los datos del formulario.
 
     El formulario contiene los siguientes campos:
         - num-clones: Número de clones a crear
         - start-id: ID de inicio para los clones
         - create-connections: Checkbox para crear conexiones en Guacamole
+        - clone-mode: Tipo de clon, 'full' (completo) o 'linked' (enlazado). Los clones enlazados convierten la VM base en plantilla
+        - static-ips: Checkbox para asignar a cada clon una IP fija del pool con cloud-init
 
     :param proxmox_id: ID de la máquina virtual a clonar
     :type proxmox_id: int
 
-    :return: Redirige a la página de gestión de máquinas virtuales independientemente del resultado.
+    :return: Redirige a la página de la máquina virtual, que muestra el progreso del trabajo, o a la de gestión si hay errores.
     """
-
-    # Prueba de rendimiento: tiempo
-    start_time = time.perf_counter()
-
     logged_user = session.get('logged_user')
     assert logged_user is not None, "El usuario va a existir por el wrapper"
 
     try:
-        # Obtener los IDs de las máquinas virtuales en Proxmox
-        proxmox_vms = proxmox.get_all_vms_serialized()
+        # Obtener los IDs de las máquinas virtuales en Proxmox, sin la caché para no validar IDs con una lista antigua
+        proxmox_vms = proxmox.get_all_vms_serialized(max_age=0)
         proxmox_vms_ids = [vm['id'] for vm in proxmox_vms]
 
         n_clones = request.form.get('num-clones')
         new_starting_id = request.form.get('start-id')
         create_guacamole_conn = request.form.get('check-connections') == 'on'
+        clone_mode = request.form.get('clone-mode', 'full')
+        static_ips = request.form.get('static-ips') == 'on'
+
+        if clone_mode not in CLONE_MODES:
+            flash(f"El tipo de clon '{clone_mode}' no es válido", "danger")
+            return redirect(url_for('admin_bp.gestion_maquinas'))
+
+        if static_ips and not ip_allocation_controller.is_pool_enabled():
+            flash("No hay un pool de IPs configurado para asignar IPs fijas", "danger")
+            return redirect(url_for('admin_bp.gestion_maquinas'))
 
         # Se obtiene la VM a clonar validando los datos
         vm_a_clonar = validate_clone_data(proxmox_id, n_clones, new_starting_id, proxmox_vms_ids)
@@ -814,77 +1435,29 @@ def clonar_maquina_virtual(proxmox_id):
         # Ya se validó que los datos se pueden convertir a enteros
         new_starting_id = int(new_starting_id)
         n_clones = int(n_clones)
-        vm_disk_size = vm_a_clonar['maxdisk'] // BYTES_IN_GIB # Convertir a GiB
-
-        flash("Clonando la VM, por favor espere...", "info")
+        timeout = get_clone_timeout(vm_a_clonar)
 
-        timeout = 180 if vm_disk_size > 30 else 120
-        timeout = timeout * n_clones
-        
-        # Clonar la máquina virtual de Proxmox
-        proxmox.clone_vm(
-            vmid=proxmox_id,
+        logger.info(f"Checkbox guacamole: {create_guacamole_conn}")
+        job_id = jobs.submit_job(
+            'clone_vm',
+            user_id=logged_user['id'],
+            proxmox_id=proxmox_id,
             base_vm_name=vm_a_clonar['name'],
             new_starting_id=new_starting_id,
             number_of_clones=n_clones,
-            timeout=timeout
+            timeout=timeout,
+            clone_mode=clone_mode,
+            create_connections=create_guacamole_conn,
+            owner_id=logged_user['id'],
+            static_ips=static_ips
         )
 
-        # Se guarda la información de los clones en la base de datos
-        store_clones_in_database(database_vm, n_clones, new_starting_id)
-
-        # Se actualizan las operaciones en segundo plano para incluir las nuevas máquinas virtuales
-        reschedule_virtual_machines_tasks(database_vm.asignatura_id)
-
-        flash_message = "VM clonada correctamente"
-
-        logger.info(f"Checkbox guacamole: {create_guacamole_conn}")
-        if create_guacamole_conn:
-            guaca_token = guacamole.get_guacamole_token()
-
-            clones_ids = [new_starting_id + i for i in range(n_clones)]
-
-            # Esta operación es muy costosa y es en la que más tiempo se tarda
-            clones_ips = proxmox.get_virtual_machines_ip(clones_ids)
-            clones_data = clones_ips.copy()
-
-            for vm_id, vm_ip in clones_ips.items():
-                logger.info(f"IP de VM {vm_id}: {vm_ip}")
-                guacamole_conn_id = guacamole.create_guacamole_connection(
-                    token=guaca_token,
-                    virtual_machine_ip=vm_ip,
-                    connection_name=f"clone-{vm_id}-{database_vm.nombre}",
-                    virtual_machine_username=database_vm.vnc_username,
-                    connection_password=database_vm.get_vnc_password()
-                )
-                clones_data[vm_id] = guacamole_conn_id
-
-            # Se guardan los datos de las conexiones en la base de datos
-            virtual_machines_controller.bulk_update_virtual_machines(
-                [
-                    {
-                        "proxmox_id": vm_id,
-                        "guacamole_connection_id": guaca_conn_id
-                    }
-                    for vm_id, guaca_conn_id in clones_data.items()
-                ]
-            )
-
-            flash_message += " y conexiones de Guacamole creadas exitosamente"
-
-        flash(flash_message, "success")
-
-        elapsed_time = time.perf_counter() - start_time
-        logger.info(f"\nTiempo total de la operación: {elapsed_time:.3f} segundos\n")
-
-        return redirect(url_for('admin_bp.editar_maquina_virtual', proxmox_id=proxmox_id))
+        flash("Clonando la VM, el progreso se muestra a continuación", "info")
+        return redirect(url_for('admin_bp.editar_maquina_virtual', proxmox_id=proxmox_id, job=job_id))
 
     except ValueError as e:
         flash(f"Error al obtener los datos del formulario: {e}", "danger")
 
-    except guacamole.GuacamoleError as e:
-        flash(f"Error al crear las conexiones de Guacamole: {e}", "danger")
-
     except proxmox.ProxmoxError as e:
         flash(f"Error al obtener los datos de las VM's de Proxmox: {e}", "danger")
 
@@ -897,17 +1470,20 @@ def clonar_maquina_virtual(proxmox_id):
 @admin_required
 @check_proxmox_connection
 def eliminar_maquina_virtual(proxmox_id):
+    logged_user = session.get('logged_user')
+    assert logged_user is not None, "El usuario va a existir por el wrapper"
+
     try:
         proxmox_vm = proxmox.get_vm_by_id(proxmox_id)
         if proxmox_vm is None:
             flash(f"La VM {proxmox_id} no se encuentra en Proxmox", "danger")
             return redirect(url_for('admin_bp.gestion_maquinas'))
 
-        # Eliminar la máquina virtual de Proxmox
-        proxmox.delete_vm(proxmox_id)
-        sleep(1) # 1 second sleep to give the server time to delete the VM
+        # Eliminar la máquina virtual de Proxmox en segundo plano
+        job_id = jobs.submit_job('delete_vm', user_id=logged_user['id'], proxmox_id=proxmox_id)
 
-        flash(f"VM {proxmox_id} eliminada correctamente", "success")
+        flash(f"Eliminando la VM {proxmox_id}", "info")
+        return redirect(url_for('admin_bp.gestion_maquinas', job=job_id))
 
     except Exception as e:
         flash(f"Error al eliminar la VM: {e}", "danger")
@@ -920,7 +1496,7 @@ def eliminar_maquina_virtual(proxmox_id):
 def eliminar_clon_maquina_virtual(proxmox_id):
     """Elimina una máquina virtual clonada de Proxmox
 
-    Esta ruta se encarga de eliminar una máquina virtual clonada del servidor 
+    Esta ruta encola un trabajo que elimina una máquina virtual clonada del servidor 
     de Proxmox, eliminando también la conexión de Guacamole si existe y los
     datos almacenados en la base de datos.
 
@@ -929,6 +1505,9 @@ def eliminar_clon_maquina_virtual(proxmox_id):
 
     :return: Redirige a la página de gestión de máquinas virtuales
     """
+    logged_user = session.get('logged_user')
+    assert logged_user is not None, "El usuario va a existir por el wrapper"
+
     try:
         database_vm = virtual_machines_controller.get_virtual_machine_by_id(proxmox_id)
         if database_vm is None:
@@ -944,33 +1523,10 @@ def eliminar_clon_maquina_virtual(proxmox_id):
             flash(f"La VM {proxmox_id} no se encuentra en Proxmox", "danger")
             return redirect(url_for('admin_bp.gestion_maquinas'))
 
-        if database_vm.guacamole_connection_id:
-            try:
-                guaca_token = guacamole.get_guacamole_token()
-                if guacamole.test_guacamole_connection(guaca_token, database_vm.guacamole_connection_id):
-                    guacamole.delete_guacamole_connection(guaca_token, database_vm.guacamole_connection_id)
-                else:
-                    flash(f"La conexión de Guacamole de la VM {proxmox_id} no existe", "warning")
-
-            except guacamole.GuacamoleError as e:
-                # Warning porque es posible que la conexión no existiera en Guacamole
-                flash(f"Error al eliminar la conexión de Guacamole: {e}", "warning")
-
-        # Eliminar la máquina virtual de Proxmox
-        try:
-            proxmox.delete_vm(proxmox_id)
-        except (ConnectionError, proxmox.ProxmoxError) as e:
-            flash(f"Error al eliminar la VM de Proxmox: {e}", "danger")
-
-        # Eliminar la máquina virtual de la base de datos
-        try:
-            virtual_machines_controller.delete_virtual_machine(proxmox_id)
-        except Exception as e:
-            flash(f"Error al eliminar la VM de la base de datos: {e}", "danger")
-
-        sleep(1) # 1 second sleep to give the server time to delete the VM
-        flash(f"VM {proxmox_id} eliminada correctamente", "success")
+        job_id = jobs.submit_job('delete_clone', user_id=logged_user['id'], proxmox_id=proxmox_id)
 
+        flash(f"Eliminando la VM {proxmox_id}", "info")
+        return redirect(url_for('admin_bp.gestion_maquinas', job=job_id))
 
     except Exception as e:
         flash(f"Error al eliminar la VM: {e}", "danger")
@@ -983,18 +1539,16 @@ def eliminar_clon_maquina_virtual(proxmox_id):
 def test_guacamole_connection(proxmox_id):
     """Prueba la conexión de Guacamole de una máquina virtual
 
-    Esta ruta comprueba la conexión de Guacamole de una máquina virtual con el ID dado, creando una conexión si no existe.
+    Esta ruta encola un trabajo que comprueba la conexión de Guacamole de una máquina virtual
+    con el ID dado, creando una conexión si no existe.
 
-    Si la conexión falla, se mostrará un mensaje de error.
+    Si la conexión falla, se mostrará un mensaje de error al terminar el trabajo.
 
     :param proxmox_id: ID de la máquina virtual a probar
     :type proxmox_id: int
 
-    :return: Redirige a la página de detalles de la máquina virtual.
+    :return: Redirige a la página de detalles de la máquina virtual, que muestra el progreso del trabajo.
     """
-
-    start_time = time.perf_counter()
-
     logged_user = session.get('logged_user')
     assert logged_user is not None, "El usuario va a existir por el wrapper"
 
@@ -1009,53 +1563,10 @@ def test_guacamole_connection(proxmox_id):
             flash(f"La VM base de la VM {proxmox_id} no se encuentra en la base de datos", "danger")
             return redirect(url_for('admin_bp.gestion_maquinas'))
 
-        guaca_token = guacamole.get_guacamole_token()
-        if not guaca_token:
-            raise Exception("No se ha podido obtener el token de Guacamole")
-
-        if clone_vm.guacamole_connection_id:
-            # Si la conexión está registrada, se comprueba si existe
-            if not guacamole.test_guacamole_connection(guaca_token, clone_vm.guacamole_connection_id):
-                virtual_machines_controller.update_virtual_machine(
-                    proxmox_id,
-                    guacamole_connection_id=None
-                )
-            else:
-                flash(f"Conexión de Guacamole de la VM {proxmox_id} existe", "info")
-                return redirect(url_for('admin_bp.editar_maquina_virtual', proxmox_id=base_vm_obj.proxmox_id))
-
-        # Si no existe, se crea una nueva conexión y se prueba
-        vm_ip = proxmox.get_vm_ip_addr(clone_vm.proxmox_id)
-        guacamole_conn_id = guacamole.create_guacamole_connection(
-            token=guaca_token,
-            virtual_machine_ip=vm_ip,
-            connection_name=f"{clone_vm.nombre}",
-            virtual_machine_username=clone_vm.vnc_username,
-            connection_password=clone_vm.get_vnc_password()
-        )
-        if not guacamole_conn_id:
-            flash(f"No se ha podido crear la conexión de Guacamole para la VM {proxmox_id}", "danger")
-            return redirect(url_for('admin_bp.gestion_maquinas'))
-
-        virtual_machines_controller.update_virtual_machine(
-            clone_vm.proxmox_id,
-            guacamole_connection_id=guacamole_conn_id
-        )
-
-        # Se actualiza la información de la VM clonada
-        clone_vm = virtual_machines_controller.get_virtual_machine_by_id(proxmox_id)
-        if not clone_vm or not clone_vm.guacamole_connection_id:
-            raise Exception("Ha habido un error actualizando la máquina virtual con la conexión de Guacamole")
-
-        if not guacamole.test_guacamole_connection(guaca_token, clone_vm.guacamole_connection_id):
-            raise Exception("No se ha podido probar la conexión de Guacamole")
-
-        flash(f"Conexión de Guacamole de la VM {proxmox_id} creada exitosamente", "success")
-
-        elapsed_time = time.perf_counter() - start_time
-        logger.info(f"\nTiempo total de Guacamole: {elapsed_time:.3f} segundos\n")
+        job_id = jobs.submit_job('test_connection', user_id=logged_user['id'], proxmox_id=proxmox_id)
 
-        return redirect(url_for('admin_bp.editar_maquina_virtual', proxmox_id=base_vm_obj.proxmox_id))
+        flash(f"Probando la conexión de Guacamole de la VM {proxmox_id}", "info")
+        return redirect(url_for('admin_bp.editar_maquina_virtual', proxmox_id=base_vm_obj.proxmox_id, job=job_id))
 
     except Exception as e:
         flash(f"Ha sucedido un error innesperado: {e}", "danger")
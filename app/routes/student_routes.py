@@ -1,10 +1,14 @@
 import logging, base64
-from flask import Blueprint, render_template, redirect, request, url_for, flash, session
+from flask import Blueprint, render_template, redirect, request, url_for, flash, session, jsonify
 from functools import wraps
 
+import app.proxmox as proxmox
 import app.guacamole as guacamole
+import app.on_demand_start as on_demand_start
+import app.admission_control as admission_control
+import app.utils.jobs as jobs
 
-from app.controllers import usuario_controller, asignatura_controller, laboratorio_controller, virtual_machines_controller
+from app.controllers import usuario_controller, asignatura_controller, laboratorio_controller, virtual_machines_controller, job_controller
 
 # Import the appropiate configuration
 from app.config import Config
@@ -112,9 +116,20 @@ def lab_content(asignatura_id, laboratorio_id):
     user_vms = [vm for vm in virtual_machines if vm.user_id == logged_user['id']]
 
     guacamole_url = ""
+    boot_job_id = None
     if user_vms:
         connection_id = user_vms[0].guacamole_connection_id # Asume que solo hay una VM por usuario
 
+        # Si la VM está apagada (fuera del horario o en reposo), se enciende bajo demanda
+        if connection_id is not None:
+            try:
+                if on_demand_start.get_vm_status(user_vms[0].proxmox_id) != 'running':
+                    boot_job_id = on_demand_start.request_start(user_vms[0], logged_user['id'])
+            except on_demand_start.OnDemandStartException as e:
+                flash(str(e), "warning")
+            except (ConnectionError, proxmox.ProxmoxError) as e:
+                logger.error(f"Could not get the status of VM {user_vms[0].proxmox_id}: {e}")
+
         if connection_id is not None:
             # La conexión de Guacamole está compuesta de:
             #   - ID de la conexión
@@ -144,5 +159,49 @@ def lab_content(asignatura_id, laboratorio_id):
         asignatura=asignatura,
         laboratorio=laboratorio,
         pdf_url=pdf_url,
-        guacamole_url=guacamole_url
+        guacamole_url=guacamole_url,
+        boot_job_id=boot_job_id
     )
+
+@student_bp.route('/jobs/<int:job_id>', methods=['GET'])
+@check_logged_user
+def estado_trabajo(job_id):
+    """Devuelve el estado de un trabajo del alumno en formato JSON
+
+    La página del laboratorio consulta esta ruta mientras se enciende la máquina virtual.
+
+    :param job_id: ID del trabajo
+    :type job_id: int
+
+    :return: JSON con los datos del trabajo o un 404 si no existe o no es del alumno
+    """
+    job = job_controller.get_job_by_id(job_id)
+    if job is None or job.user_id != session['logged_user']['id']:
+        return jsonify({'error': f"El trabajo {job_id} no existe"}), 404
+
+    return jsonify(job.serialize())
+
+## Trabajos en segundo plano
+@jobs.job_handler(on_demand_start.START_JOB_TYPE, workers=Config.PROXMOX.ON_DEMAND_START_WORKERS)
+def start_student_vm_job(job, proxmox_id):
+    """Trabajo que enciende la VM de un alumno y espera a que su servidor VNC responda"""
+    virtual_machine = virtual_machines_controller.get_virtual_machine_by_id(proxmox_id)
+    if virtual_machine is None:
+        raise Exception("No se ha encontrado su máquina virtual")
+
+    job.update(progress=10, message="Esperando turno para encender la máquina virtual")
+    on_demand_start.wait_for_boot_slot(job.job_id)
+
+    job.update(progress=30, message="Encendiendo la máquina virtual")
+    try:
+        on_demand_start.start_and_wait(proxmox_id)
+    except TimeoutError as e:
+        raise Exception("La máquina virtual está tardando demasiado en arrancar, inténtelo de nuevo más tarde") from e
+    except admission_control.AdmissionException as e:
+        raise Exception(f"El servidor está al límite de su capacidad, inténtelo de nuevo más tarde. {e}") from e
+    except (ConnectionError, proxmox.ProxmoxError) as e:
+        raise Exception(f"No se ha podido encender la máquina virtual: {e}") from e
+
+    job.update(progress=70, message="Esperando al escritorio remoto")
+    if not on_demand_start.wait_for_vnc(virtual_machine):
+        job.add_message("La máquina virtual está encendida, pero el escritorio remoto aún no responde", "warning")
@@ -0,0 +1,151 @@
+// Muestra el progreso de un trabajo en segundo plano
+// Las etapas de cada VM llegan en directo por Server-Sent Events; el estado
+// general y los mensajes finales se consultan periódicamente en formato JSON
+
+const JOB_POLL_INTERVAL = 2000; // ms
+const JOB_POLL_INTERVAL_WITH_EVENTS = 10000; // ms, los eventos ya actualizan la página
+
+const VM_STAGES = {
+    queued: ['En cola', 'secondary'],
+    cloning: ['Clonando', 'primary'],
+    migrating: ['Migrando', 'primary'],
+    cloned: ['Clonada', 'info'],
+    booting: ['Arrancando', 'primary'],
+    ip_found: ['IP obtenida', 'info'],
+    connection_created: ['Conexión creada', 'success'],
+    failed: ['Error', 'danger'],
+};
+
+let pollTimer = null;
+let eventsConnected = false;
+let jobFinished = false;
+
+function renderJobMessages(container, messages) {
+    container.innerHTML = '';
+    messages.forEach(([category, message]) => {
+        const alert = document.createElement('div');
+        alert.className = `alert alert-${category} mb-2`;
+        alert.setAttribute('role', 'alert');
+        alert.textContent = message;
+        container.appendChild(alert);
+    });
+}
+
+function renderProgress(progress, text) {
+    const bar = document.getElementById('job-progress-bar');
+    const message = document.getElementById('job-progress-message');
+
+    if (progress !== undefined) {
+        bar.style.width = `${progress}%`;
+        bar.textContent = `${progress}%`;
+    }
+    if (text) {
+        message.textContent = text;
+    }
+}
+
+function renderVmStage({ vmid, stage, detail }) {
+    const list = document.getElementById('job-progress-vms');
+    let item = list.querySelector(`li[data-vmid="${vmid}"]`);
+    if (!item) {
+        item = document.createElement('li');
+        item.className = 'list-group-item d-flex justify-content-between align-items-center';
+        item.dataset.vmid = vmid;
+        list.appendChild(item);
+    }
+
+    const [label, color] = VM_STAGES[stage] || [stage, 'secondary'];
+    const badge = document.createElement('span');
+    badge.className = `badge text-bg-${color}`;
+    badge.textContent = label;
+
+    const name = document.createElement('span');
+    name.textContent = detail && stage !== 'cloning' && stage !== 'booting' ? `VM ${vmid} (${detail})` : `VM ${vmid}`;
+
+    item.replaceChildren(name, badge);
+}
+
+function finishJob(panel, job) {
+    if (jobFinished) {
+        return;
+    }
+    jobFinished = true;
+
+    const bar = document.getElementById('job-progress-bar');
+    bar.classList.remove('progress-bar-animated', 'progress-bar-striped');
+    bar.classList.add(job.status === 'completed' ? 'bg-success' : 'bg-danger');
+
+    // Enlace para recargar la página sin el parámetro del trabajo
+    const url = new URL(window.location.href);
+    url.searchParams.delete('job');
+
+    const reload = document.createElement('a');
+    reload.href = url.toString();
+    reload.className = 'btn btn-sm btn-outline-primary';
+    reload.textContent = 'Actualizar página';
+    panel.appendChild(reload);
+}
+
+function schedulePoll(panel, delay) {
+    clearTimeout(pollTimer);
+    pollTimer = setTimeout(() => pollJob(panel), delay);
+}
+
+function pollJob(panel) {
+    const messages = document.getElementById('job-progress-messages');
+
+    fetch(panel.dataset.jobUrl, { headers: { 'Accept': 'application/json' } })
+        .then((response) => {
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            return response.json();
+        })
+        .then((job) => {
+            renderProgress(job.progress, job.message || (job.status === 'pending' ? 'En cola...' : ''));
+
+            if (job.result && job.result.messages) {
+                renderJobMessages(messages, job.result.messages);
+            }
+
+            if (job.status === 'completed' || job.status === 'failed') {
+                finishJob(panel, job);
+                return;
+            }
+            schedulePoll(panel, eventsConnected ? JOB_POLL_INTERVAL_WITH_EVENTS : JOB_POLL_INTERVAL);
+        })
+        .catch((error) => {
+            renderProgress(undefined, `No se ha podido obtener el estado del trabajo: ${error.message}`);
+            schedulePoll(panel, JOB_POLL_INTERVAL * 2);
+        });
+}
+
+function listenJobEvents(panel) {
+    if (!window.EventSource || !panel.dataset.eventsUrl) {
+        return;
+    }
+
+    const source = new EventSource(panel.dataset.eventsUrl);
+    source.onopen = () => { eventsConnected = true; };
+    source.onerror = () => { eventsConnected = false; };
+
+    source.addEventListener('vm', (event) => renderVmStage(JSON.parse(event.data)));
+    source.addEventListener('progress', (event) => {
+        const data = JSON.parse(event.data);
+        renderProgress(data.progress, data.message);
+    });
+    source.addEventListener('end', () => {
+        // Se cierra para que el navegador no vuelva a conectarse y se obtiene el resultado final
+        source.close();
+        eventsConnected = false;
+        pollJob(panel);
+    });
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    const panel = document.getElementById('job-progress');
+    if (panel) {
+        listenJobEvents(panel);
+        pollJob(panel);
+    }
+});
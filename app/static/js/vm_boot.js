@@ -0,0 +1,53 @@
+// Muestra el encendido bajo demanda de la VM del alumno
+// Consulta el estado del trabajo periódicamente y, cuando termina, carga el cliente de Guacamole
+
+const VM_BOOT_POLL_INTERVAL = 3000; // ms
+
+function loadGuacamoleClient() {
+    const iframe = document.getElementById('guacamole-iframe');
+    iframe.src = iframe.dataset.src;
+}
+
+function showBootMessages(status, messages) {
+    messages.forEach(([category, message]) => {
+        const alert = document.createElement('div');
+        alert.className = `alert alert-${category} mb-2`;
+        alert.setAttribute('role', 'alert');
+        alert.textContent = message;
+        status.appendChild(alert);
+    });
+}
+
+function pollVmBoot(status) {
+    fetch(status.dataset.jobUrl)
+        .then(response => response.json())
+        .then(job => {
+            if (job.error) {
+                throw new Error(job.error);
+            }
+
+            document.getElementById('vm-boot-progress').style.width = `${job.progress}%`;
+            if (job.message) {
+                document.getElementById('vm-boot-message').textContent = job.message;
+            }
+
+            if (job.status === 'completed') {
+                status.replaceChildren();
+                showBootMessages(status, (job.result && job.result.messages) || []);
+                loadGuacamoleClient();
+            } else if (job.status === 'failed') {
+                status.replaceChildren();
+                showBootMessages(status, (job.result && job.result.messages) || [['danger', job.message]]);
+            } else {
+                setTimeout(() => pollVmBoot(status), VM_BOOT_POLL_INTERVAL);
+            }
+        })
+        .catch(() => setTimeout(() => pollVmBoot(status), VM_BOOT_POLL_INTERVAL));
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    const status = document.getElementById('vm-boot-status');
+    if (status) {
+        pollVmBoot(status);
+    }
+});
@@ -0,0 +1,152 @@
+import time, logging, threading
+from datetime import datetime
+
+import app.proxmox as proxmox
+import app.admission_control as admission_control
+
+# Import the appropiate configuration
+from app.config import Config
+# from app.configUni import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Arranque escalonado de las clases
+## Antes, cada asignatura encendía todas sus VMs a la vez a hora_inicio - buffer, por lo que
+## varias asignaturas con el mismo horario saturaban el nodo. Ahora las VMs se encienden en
+## oleadas repartidas a lo largo del buffer; antes de soltar cada oleada se comprueba la carga
+## del nodo y el número de VMs arrancando a la vez está limitado entre todas las asignaturas.
+## Además, cada oleada pasa por el control de admisión (app/admission_control.py): las VMs
+## que no caben en la memoria del nodo esperan y, si siguen sin caber, no se encienden.
+
+class _BootSlots:
+    """Huecos de arranque compartidos por todas las asignaturas del proceso
+
+    Una oleada reserva todos sus huecos de una vez, así dos oleadas que esperan
+    no se quedan cada una con parte de los huecos que necesita la otra.
+    """
+    def __init__(self, capacity):
+        self.capacity = max(1, capacity)
+        self.in_use = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, n):
+        n = min(n, self.capacity)
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_use + n <= self.capacity)
+            self.in_use += n
+        return n
+
+    def release(self, n):
+        with self.condition:
+            self.in_use -= n
+            self.condition.notify_all()
+
+boot_slots = _BootSlots(Config.PROXMOX.NODE_BOOT_CONCURRENCY)
+
+def node_has_capacity(node=None):
+    """Comprueba si la carga de un nodo permite encender más VMs
+
+    :param node: Nombre del nodo (default: el nodo por defecto)
+    :type node: str
+
+    :return: True si el uso de CPU y de memoria están por debajo de los límites configurados
+    :rtype: bool
+    """
+    try:
+        status = proxmox.get_node_status(node)
+    except Exception as e:
+        # Si no se puede consultar el nodo no se bloquea el arranque de la clase
+        logger.warning(f"Could not get the status of node {node or proxmox.proxmox_node}, booting anyway: {e}")
+        return True
+
+    cpu = status['cpu']
+    memory = status['memory']['used'] / status['memory']['total'] if status['memory'].get('total') else 0
+
+    if cpu > Config.PROXMOX.BOOT_MAX_CPU or memory > Config.PROXMOX.BOOT_MAX_MEMORY:
+        logger.info(f"Node {node or proxmox.proxmox_node} under load (CPU {cpu:.0%}, memory {memory:.0%}), holding the next boot wave")
+        return False
+
+    return True
+
+def _wait_for_capacity(deadline, nodes):
+    # Pasada la hora límite se enciende igualmente: la clase va a empezar
+    while time.monotonic() < deadline:
+        if all(node_has_capacity(node) for node in nodes):
+            return
+        time.sleep(min(Config.PROXMOX.BOOT_LOAD_CHECK_INTERVAL, max(0, deadline - time.monotonic())))
+
+def _start_wave(wave, admission_timeout=0):
+    with admission_control.start_admission(wave, admission_timeout) as (admitted, rejected, reason):
+        if rejected:
+            logger.error(f"VMs {rejected} not started: {reason}")
+        if not admitted:
+            return
+
+        slots = boot_slots.acquire(len(admitted))
+        try:
+            proxmox.batch_start_virtual_machines(admitted, batch_size=slots)
+        except TimeoutError as e:
+            logger.error(e)
+        except Exception as e:
+            logger.error(f"Failed to start VMs {admitted}: {e}")
+        finally:
+            boot_slots.release(slots)
+
+def staggered_start_virtual_machines(vm_id_batch, window=0):
+    """
+    Enciende un conjunto de VMs en oleadas repartidas a lo largo de una ventana de tiempo
+
+    Las oleadas son de Config.PROXMOX.BOOT_WAVE_SIZE VMs y se sueltan a intervalos
+    iguales dentro de la ventana. Antes de cada oleada se espera a que los nodos
+    de sus VMs tengan CPU y memoria libres, como mucho hasta el final de la ventana, y cada
+    oleada ocupa huecos de arranque compartidos con el resto de asignaturas.
+    Las VMs de una oleada que no caben en la memoria del nodo esperan hasta el
+    final de la ventana más Config.PROXMOX.ADMISSION_QUEUE_TIMEOUT segundos y,
+    pasado ese tiempo, no se encienden.
+
+    :param vm_id_batch: Lista de IDs de las VMs a encender
+    :type vm_id_batch: list[int]
+
+    :param window: Segundos en los que se reparten los arranques, 0 para encenderlas cuanto antes (default: 0)
+    :type window: int
+    """
+    if not vm_id_batch:
+        return
+
+    wave_size = max(1, Config.PROXMOX.BOOT_WAVE_SIZE)
+    waves = [vm_id_batch[i:i + wave_size] for i in range(0, len(vm_id_batch), wave_size)]
+
+    start = time.monotonic()
+    deadline = start + window
+    interval = window / len(waves)
+
+    logger.info(f"Starting {len(vm_id_batch)} VMs in {len(waves)} waves over {window} seconds")
+    for i, wave in enumerate(waves):
+        release_at = start + i * interval
+        if release_at > time.monotonic():
+            time.sleep(release_at - time.monotonic())
+
+        _wait_for_capacity(deadline, {proxmox.get_vm_node(vm_id) for vm_id in wave})
+        _start_wave(wave, max(0, deadline - time.monotonic()) + Config.PROXMOX.ADMISSION_QUEUE_TIMEOUT)
+
+    logger.info(f"Boot waves finished in {time.monotonic() - start:.1f} seconds")
+
+def start_virtual_machines_before(vm_id_batch, class_start):
+    """
+    Enciende las VMs de una clase repartiendo los arranques hasta la hora de inicio
+
+    La ventana se calcula al ejecutarse, de modo que si la tarea se lanza con
+    retraso los arranques se comprimen en el tiempo que queda.
+
+    :param vm_id_batch: Lista de IDs de las VMs a encender
+    :type vm_id_batch: list[int]
+
+    :param class_start: Hora de inicio de la clase (HH:MM)
+    :type class_start: str
+    """
+    hour, minute = map(int, class_start.split(':'))
+    now = datetime.now()
+    window = (now.replace(hour=hour, minute=minute, second=0, microsecond=0) - now).total_seconds()
+
+    staggered_start_virtual_machines(vm_id_batch, max(0, int(window)))
@@ -0,0 +1,100 @@
+import logging, queue, threading
+from collections import defaultdict, deque
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class EventBus:
+    """
+    Publicación/suscripción en memoria entre los hilos del proceso
+
+    Cada canal guarda un histórico corto de eventos que se entrega a los nuevos
+    suscriptores, de forma que quien se conecta tarde ve el estado actual. Cada
+    suscriptor tiene su propia cola acotada; si un suscriptor no consume sus
+    eventos, los nuevos se descartan para él sin bloquear a quien publica.
+    """
+    def __init__(self, history_size=500, queue_size=1000):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+        self._history = defaultdict(lambda: deque(maxlen=history_size))
+        self._queue_size = queue_size
+
+    def publish(self, channel, event, data=None):
+        """Publica un evento en un canal
+
+        :param channel: Nombre del canal
+        :type channel: str
+
+        :param event: Tipo de evento
+        :type event: str
+
+        :param data: Datos del evento, deben ser serializables a JSON (default: None)
+        :type data: dict
+        """
+        message = {'event': event, 'data': data}
+        with self._lock:
+            self._history[channel].append(message)
+            subscribers = list(self._subscribers.get(channel, ()))
+
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                logger.warning(f"Dropping event '{event}' for a slow subscriber of {channel}")
+
+    def subscribe(self, channel):
+        """Se suscribe a un canal
+
+        :param channel: Nombre del canal
+        :type channel: str
+
+        :return: Cola con los eventos del histórico y los que se publiquen a partir de ahora
+        :rtype: queue.Queue
+        """
+        subscriber = queue.Queue(maxsize=self._queue_size)
+        with self._lock:
+            for message in self._history.get(channel, ()):
+                subscriber.put_nowait(message)
+            self._subscribers[channel].add(subscriber)
+
+        return subscriber
+
+    def unsubscribe(self, channel, subscriber):
+        """Cancela una suscripción
+
+        :param channel: Nombre del canal
+        :type channel: str
+
+        :param subscriber: Cola devuelta por subscribe
+        :type subscriber: queue.Queue
+        """
+        with self._lock:
+            subscribers = self._subscribers.get(channel)
+            if subscribers is None:
+                return
+
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[channel]
+
+    def close(self, channel):
+        """Elimina el histórico de un canal que ya no va a recibir eventos
+
+        :param channel: Nombre del canal
+        :type channel: str
+        """
+        with self._lock:
+            self._history.pop(channel, None)
+
+bus = EventBus()
+
+def job_channel(job_id):
+    """Nombre del canal de eventos de un trabajo en segundo plano
+
+    :param job_id: ID del trabajo
+    :type job_id: int
+
+    :return: Nombre del canal
+    :rtype: str
+    """
+    return f"job-{job_id}"
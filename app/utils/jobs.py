@@ -0,0 +1,263 @@
+import os, socket, logging, threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+
+from app.controllers import job_controller
+from app.utils.events import bus, job_channel
+
+# Import the appropiate configuration
+from app.config import Config
+# from app.configUni import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Funciones registradas para cada tipo de trabajo
+_job_handlers = {}
+
+# Los trabajos se ejecutan en los JOB_WORKERS hilos compartidos, salvo los tipos registrados
+# con hilos propios: así los trabajos que pasan mucho tiempo esperando turno (p. ej. los
+# encendidos bajo demanda) no dejan sin hilos a los trabajos de los administradores
+_job_workers = {} # Tipo de trabajo -> número de hilos propios
+_executors = {} # Tipo de trabajo (None para los compartidos) -> ThreadPoolExecutor
+_executor_lock = threading.Lock()
+
+def _worker_id():
+    """Identificador del proceso actual (host:pid)
+
+    Se calcula en cada llamada porque los servidores como gunicorn crean los
+    procesos con fork después de importar la aplicación.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _get_executor(job_type=None):
+    key = job_type if job_type in _job_workers else None
+    with _executor_lock:
+        if key not in _executors:
+            if key is None:
+                _executors[key] = ThreadPoolExecutor(max_workers=Config.FLASK.JOB_WORKERS, thread_name_prefix='job-worker')
+            else:
+                _executors[key] = ThreadPoolExecutor(max_workers=_job_workers[key], thread_name_prefix=f"job-{key}")
+        return _executors[key]
+
+def job_handler(job_type, workers=None):
+    """Decorador que registra la función que ejecuta un tipo de trabajo
+
+    La función recibe un JobContext como primer argumento y los parámetros
+    del trabajo como argumentos con nombre. Lo que devuelva se guarda en el
+    resultado del trabajo, por lo que debe ser serializable a JSON.
+
+    :param job_type: Tipo de trabajo
+    :type job_type: str
+
+    :param workers: Hilos propios para este tipo de trabajo, None para usar los JOB_WORKERS compartidos (default: None)
+    :type workers: int
+    """
+    def decorator(f):
+        _job_handlers[job_type] = f
+        if workers is not None:
+            _job_workers[job_type] = max(1, workers)
+        return f
+    return decorator
+
+class JobContext:
+    """Permite a la función de un trabajo informar de su progreso
+
+    Los mensajes añadidos se muestran al usuario cuando el trabajo termina,
+    del mismo modo que los mensajes flash de una petición normal. Además de
+    guardarse en la base de datos, los cambios se publican en el canal de
+    eventos del trabajo para quien lo siga en directo.
+    """
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.messages = []
+        self.channel = job_channel(job_id)
+
+    def publish(self, event, data=None):
+        """Publica un evento en el canal del trabajo sin guardarlo en la base de datos
+
+        :param event: Tipo de evento
+        :type event: str
+
+        :param data: Datos del evento (default: None)
+        :type data: dict
+        """
+        bus.publish(self.channel, event, data)
+
+    def update(self, progress=None, message=None):
+        """Actualiza el progreso del trabajo
+
+        :param progress: Progreso del trabajo (0 - 100) (default: None)
+        :type progress: int
+
+        :param message: Mensaje de progreso (default: None)
+        :type message: str
+        """
+        fields = {}
+        if progress is not None:
+            fields['progress'] = max(0, min(100, int(progress)))
+        if message is not None:
+            fields['message'] = message
+
+        if fields:
+            job_controller.update_job(self.job_id, **fields)
+            self.publish('progress', fields)
+
+    def add_message(self, message, category='info'):
+        """Añade un mensaje para el usuario
+
+        :param message: Mensaje
+        :type message: str
+
+        :param category: Categoría del mensaje, como en flash (default: 'info')
+        :type category: str
+        """
+        self.messages.append([category, message])
+        job_controller.update_job(self.job_id, result={'messages': list(self.messages)})
+        self.publish('message', {'category': category, 'message': message})
+
+def submit_job(job_type, user_id=None, **params):
+    """Registra un trabajo en la base de datos y lo encola para su ejecución
+
+    Debe llamarse dentro del contexto de la aplicación.
+
+    :param job_type: Tipo de trabajo, debe estar registrado con job_handler
+    :type job_type: str
+
+    :param user_id: ID del usuario que lanza el trabajo (default: None)
+    :type user_id: int
+
+    :param params: Parámetros del trabajo, deben ser serializables a JSON
+
+    :return: ID del trabajo
+    :rtype: int
+
+    :raises ValueError: Si el tipo de trabajo no está registrado
+    :raises SQLAlchemyError: Si no se puede guardar el trabajo
+    """
+    if job_type not in _job_handlers:
+        raise ValueError(f"El tipo de trabajo '{job_type}' no existe")
+
+    job = job_controller.create_job(job_type, params=params, user_id=user_id, worker=_worker_id())
+    _get_executor(job_type).submit(_run_job, current_app._get_current_object(), job.id)
+
+    logger.info(f"Job {job.id} ({job_type}) queued")
+    return job.id
+
+def _run_job(app, job_id):
+    with app.app_context():
+        try:
+            if not job_controller.claim_job(job_id, _worker_id()):
+                logger.info(f"Job {job_id} already claimed by another worker")
+                return
+
+            job = job_controller.get_job_by_id(job_id)
+            context = JobContext(job_id)
+            handler = _job_handlers[job.job_type]
+
+        except Exception as e:
+            logger.error(f"Failed to start job {job_id}: {e}")
+            return
+
+        logger.info(f"Job {job_id} ({job.job_type}) started")
+        try:
+            data = handler(context, **(job.params or {}))
+            job_controller.update_job(
+                job_id,
+                status='completed',
+                progress=100,
+                message="Trabajo completado",
+                result={'messages': context.messages, 'data': data},
+                finished_at=datetime.now()
+            )
+            logger.info(f"Job {job_id} completed")
+
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            context.messages.append(['danger', str(e)])
+            try:
+                job_controller.update_job(
+                    job_id,
+                    status='failed',
+                    message=str(e),
+                    result={'messages': context.messages},
+                    finished_at=datetime.now()
+                )
+            except Exception as e:
+                logger.error(f"Failed to store the result of job {job_id}: {e}")
+
+        finally:
+            try:
+                status = job_controller.get_job_by_id(job_id).status
+            except Exception:
+                status = 'failed'
+
+            context.publish('end', {'status': status})
+            bus.close(context.channel)
+
+def _is_orphaned(worker):
+    """Comprueba si el proceso que tenía asignado un trabajo ya no existe
+
+    Solo se pueden comprobar los procesos del mismo host; los trabajos de
+    otros hosts se dejan para que los recupere su propio proceso.
+    """
+    if not worker:
+        return True
+
+    host, _, pid = worker.rpartition(':')
+    if host != socket.gethostname():
+        return False
+
+    # Tras un reinicio el proceso puede volver a tener el mismo PID
+    if worker == _worker_id():
+        return True
+
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except (ValueError, PermissionError):
+        return False
+
+    return False
+
+def recover_interrupted_jobs():
+    """Recupera los trabajos que quedaron a medias al detenerse un proceso
+
+    Los trabajos pendientes se vuelven a encolar en este proceso. Los que se
+    estaban ejecutando se marcan como fallidos, ya que sus operaciones no se
+    pueden repetir de forma segura (p. ej. clones parcialmente creados).
+
+    Debe llamarse dentro del contexto de la aplicación.
+    """
+    try:
+        jobs = job_controller.get_jobs_by_status('pending', 'running')
+    except Exception as e:
+        logger.error(f"Failed to load interrupted jobs: {e}")
+        return
+
+    for job in jobs:
+        if not _is_orphaned(job.worker):
+            continue
+
+        try:
+            if job.status == 'running':
+                message = "El trabajo se interrumpió al reiniciarse la aplicación"
+                job_controller.update_job(
+                    job.id,
+                    status='failed',
+                    message=message,
+                    result={'messages': [['danger', message]]},
+                    finished_at=datetime.now()
+                )
+                logger.warning(f"Job {job.id} ({job.job_type}) was interrupted, marked as failed")
+
+            elif job.job_type in _job_handlers:
+                job_controller.update_job(job.id, worker=_worker_id())
+                _get_executor(job.job_type).submit(_run_job, current_app._get_current_object(), job.id)
+                logger.info(f"Job {job.id} ({job.job_type}) requeued")
+
+        except Exception as e:
+            logger.error(f"Failed to recover job {job.id}: {e}")
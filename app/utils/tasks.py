@@ -1,41 +1,227 @@
-import atexit, logging
+import atexit, logging, threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 
 from apscheduler.schedulers.background import BackgroundScheduler
-# from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore # To store jobs in the database
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore # To store jobs in the database
+from apscheduler.jobstores.base import JobLookupError
+
+from sqlalchemy import event, select, text
+from sqlalchemy.orm import Session, object_session
 
 from app.utils.orphaned_files_cleanup import clean_orphaned_files
+from app.utils.boot_scheduler import staggered_start_virtual_machines, start_virtual_machines_before
+
+from flask import current_app
 
-from app.controllers import horario_controller, asignatura_controller, virtual_machines_controller
+from app.extensions import db
+from app.models.horario import Horario
+from app.models.asignatura import Asignatura
+from app.controllers import horario_controller, asignatura_controller, virtual_machines_controller, job_controller
 import app.proxmox as proxmox
+import app.idle_detection as idle_detection
+import app.utils.jobs as jobs
+
+# Import the appropiate configuration
+from app.config import Config
+# from app.configUni import Config
 
 scheduler = BackgroundScheduler()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def start_scheduler():
+# Las tareas de encendido y apagado de los horarios se guardan en la base de datos
+# (tabla apscheduler_jobs) con un ID por horario, así sobreviven a los reinicios y
+# cambiar un horario solo actualiza sus dos tareas. El resto de tareas son periódicas
+# y se crean al arrancar, por lo que se quedan en memoria.
+PERSISTENT_JOBSTORE = 'persistent'
+JOBSTORE_TABLE = 'apscheduler_jobs'
+
+# Con varios workers de gunicorn cada proceso tiene su scheduler, pero solo el que tiene
+# el bloqueo SCHEDULER_LOCK_NAME de MySQL (el líder) lo ejecuta. El resto lo tienen en
+# pausa: siguen guardando las tareas en el almacén persistente y, si el líder cae (MySQL
+# libera el bloqueo al cerrarse su conexión), uno de ellos lo sustituye.
+SCHEDULER_LOCK_NAME = 'vmnexus_scheduler'
+
+class _SchedulerLeader(threading.Thread):
+    """Hilo que intenta obtener el bloqueo del scheduler y, mientras lo tiene, lo mantiene activo"""
+    def __init__(self, app, engine, on_elected):
+        super().__init__(name="scheduler-leader", daemon=True)
+        self.app = app
+        self.engine = engine # db.engine necesita el contexto de la aplicación, que este hilo no tiene
+        self.on_elected = on_elected # Se ejecuta en el contexto de la aplicación antes de reanudar el scheduler
+        self.connection = None
+        self.stopped = threading.Event()
+
+    @property
+    def is_leader(self):
+        return self.connection is not None
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                if self.is_leader:
+                    self._heartbeat()
+                else:
+                    self._try_acquire()
+            except Exception as e:
+                logger.warning(f"Scheduler leadership check failed: {e}")
+                self.step_down()
+
+            self.stopped.wait(Config.FLASK.SCHEDULER_HEARTBEAT_INTERVAL)
+
+    def _execute(self, query):
+        result = self.connection.execute(text(query), {'name': SCHEDULER_LOCK_NAME}).scalar()
+        self.connection.commit()
+        return result
+
+    def _try_acquire(self):
+        self.connection = self.engine.connect()
+        try:
+            acquired = self._execute("SELECT GET_LOCK(:name, 0)")
+        except Exception:
+            self._close()
+            raise
+
+        if acquired != 1:
+            self._close()
+            return
+
+        logger.info("This process is now the scheduler leader")
+        with self.app.app_context():
+            self.on_elected()
+        scheduler.resume()
+
+    def _heartbeat(self):
+        # Comprueba que la conexión sigue viva y que el bloqueo sigue siendo suyo
+        if self._execute("SELECT IS_USED_LOCK(:name) = CONNECTION_ID()") != 1:
+            raise Exception("The scheduler lock is no longer held")
+
+        # Otros procesos pueden haber añadido tareas al almacén persistente
+        scheduler.wakeup()
+
+    def _close(self):
+        # El bloqueo pertenece a la conexión: se descarta en lugar de devolverla al pool
+        try:
+            self.connection.invalidate()
+        except Exception as e:
+            logger.warning(f"Error closing the scheduler lock connection: {e}")
+        self.connection = None
+
+    def step_down(self):
+        if not self.is_leader:
+            return
+
+        if scheduler.running:
+            scheduler.pause()
+
+        try:
+            self._execute("SELECT RELEASE_LOCK(:name)")
+        except Exception:
+            pass # Al cerrar la conexión MySQL lo libera igualmente
+        self._close()
+        logger.info("This process is no longer the scheduler leader")
+
+    def stop(self):
+        self.stopped.set()
+        self.step_down()
+
+_leader = None
+
+# Los trabajos de clonación comprueban o eligen los IDs de los nuevos clones a partir de los
+# que están en uso, por lo que dos a la vez podrían tomar los mismos IDs (y sus reservas de IP).
+# Se ejecutan de uno en uno en todos los procesos con el bloqueo CLONE_LOCK_NAME de MySQL.
+CLONE_LOCK_NAME = 'vmnexus_clone'
+LOCK_POLL_INTERVAL = 10 # Segundos
+
+_local_locks = {} # Sin MySQL: nombre -> threading.Lock
+_local_locks_guard = threading.Lock()
+
+@contextmanager
+def database_lock(name, on_wait=None):
+    """
+    Gestor de contexto que obtiene un bloqueo con nombre compartido por todos los procesos
+
+    El bloqueo es de MySQL (GET_LOCK) y pertenece a una conexión propia, así que si
+    el proceso cae MySQL lo libera al cerrarse la conexión. Sin MySQL se asume un
+    único proceso y se usa un bloqueo del proceso. Debe llamarse dentro del
+    contexto de la aplicación.
+
+        with database_lock(CLONE_LOCK_NAME):
+            ...
+
+    :param name: Nombre del bloqueo
+    :type name: str
+
+    :param on_wait: Función que se llama una vez si hay que esperar al bloqueo (default: None)
+    :type on_wait: callable
+    """
+    if db.engine.dialect.name != 'mysql':
+        with _local_locks_guard:
+            lock = _local_locks.setdefault(name, threading.Lock())
+        if not lock.acquire(blocking=False):
+            if on_wait is not None:
+                on_wait()
+            lock.acquire()
+        try:
+            yield
+        finally:
+            lock.release()
+        return
+
+    connection = db.engine.connect()
+    try:
+        timeout = 0
+        while connection.execute(text("SELECT GET_LOCK(:name, :timeout)"), {'name': name, 'timeout': timeout}).scalar() != 1:
+            if timeout == 0 and on_wait is not None:
+                on_wait()
+            timeout = LOCK_POLL_INTERVAL
+        connection.commit()
+
+        try:
+            yield
+        finally:
+            try:
+                connection.execute(text("SELECT RELEASE_LOCK(:name)"), {'name': name})
+            except Exception as e:
+                logger.warning(f"Error releasing the {name} lock: {e}")
+    finally:
+        # Como el bloqueo del scheduler, la conexión se descarta en lugar de devolverla al pool
+        connection.invalidate()
+
+def start_scheduler(paused=False):
     if not scheduler.running:
-        scheduler.start()
+        scheduler.start(paused=paused)
 
 def stop_scheduler():
+    if _leader is not None:
+        _leader.stop()
+
     if scheduler.running:
         scheduler.shutdown(wait=False)
     logger.info("Scheduler stopped")
 
 atexit.register(stop_scheduler) # Se asegura de que el scheduler se detenga cuando la aplicación se detenga
 
-def __try_remove_job(job_id, retries=3):
+def __try_remove_job(job_id, retries=3, jobstore=None):
     """Intenta eliminar un trabajo del scheduler
 
+    Si el trabajo no existe no se hace nada.
+
     :param job_id: ID del trabajo a eliminar
     :type job_id: str
 
     :param retries: Número de intentos (default: 3)
     :type retries: int
+
+    :param jobstore: Almacén del trabajo, None para buscarlo en todos (default: None)
+    :type jobstore: str
     """
     for attempt in range (1, retries + 1):
         try:
-            scheduler.remove_job(job_id)
+            scheduler.remove_job(job_id, jobstore)
+            break
+        except JobLookupError:
             break
         except Exception as e:
             logger.error(f"Error removing job '{job_id}' (attempt {attempt}/{retries}): {e}")
@@ -70,9 +256,18 @@ def manage_schedule_times(start_time, end_time, buffer=10):
 
     return start_time_buffer, end_time_buffer
 
+# Si un horario se reprograma durante su clase (o después, el mismo día), sus VMs se encienden
+# (o apagan) en un trabajo en segundo plano con hilos propios: el arranque escalonado puede
+# tardar minutos y no debe bloquear la petición que ha reprogramado el horario
+CATCH_UP_JOB_TYPE = 'catch_up_horario'
+CATCH_UP_WORKERS = 2
+
 def check_machines_state(vm_id_batch, day, start_time, end_time):
     """Verifica el estado de las máquinas virtuales antes de programar las tareas
 
+    El encendido o apagado se encola como un trabajo en segundo plano (ver CATCH_UP_JOB_TYPE).
+    Debe llamarse dentro del contexto de la aplicación.
+
     :param vm_id_batch: Batch de IDs de máquinas virtuales
     :type vm_id_batch: list
 
@@ -100,14 +295,59 @@ def check_machines_state(vm_id_batch, day, start_time, end_time):
     current_time = datetime.now().time()
 
     if current_day == int_day and current_time >= start_time.time() and current_time <= end_time.time():
-        proxmox.batch_start_virtual_machines(vm_id_batch)
+        __request_catch_up(vm_id_batch, 'start')
 
     if current_day == int_day and current_time >= end_time.time():
-        proxmox.batch_stop_virtual_machines(vm_id_batch)
+        __request_catch_up(vm_id_batch, 'stop')
+
+@jobs.job_handler(CATCH_UP_JOB_TYPE, workers=CATCH_UP_WORKERS)
+def catch_up_horario_job(job, vm_ids, action):
+    """Trabajo que enciende o apaga las VMs de un horario reprogramado durante o después de su clase"""
+    if action == 'start':
+        # Las VMs en reposo por inactividad no se despiertan: las enciende el alumno al abrir el laboratorio
+        suspended = {
+            vm.proxmox_id for vm in virtual_machines_controller.get_all_virtual_machines()
+            if vm.idle_suspended_at is not None
+        }
+        vm_ids = [vm_id for vm_id in vm_ids if vm_id not in suspended]
+
+        job.update(message=f"Encendiendo las {len(vm_ids)} VMs de la clase en curso")
+        staggered_start_virtual_machines(vm_ids)
+    else:
+        job.update(message=f"Apagando las {len(vm_ids)} VMs de la clase terminada")
+        proxmox.batch_stop_virtual_machines(vm_ids)
+
+def __request_catch_up(vm_ids, action):
+    # No se encola si ya hay un trabajo pendiente o en curso que cubre las mismas VMs
+    # Si falla, las tareas del horario se programan igualmente
+    try:
+        already_requested = any(
+            job.job_type == CATCH_UP_JOB_TYPE
+            and (job.params or {}).get('action') == action
+            and set(vm_ids) <= set((job.params or {}).get('vm_ids', ()))
+            for job in job_controller.get_jobs_by_status('pending', 'running')
+        )
+        if not already_requested:
+            jobs.submit_job(CATCH_UP_JOB_TYPE, vm_ids=list(vm_ids), action=action)
+    except Exception as e:
+        logger.error(f"Error requesting the catch-up {action} of VMs {vm_ids}: {e}")
+
+def get_horario_job_ids(horario_id):
+    """Obtiene los IDs de las tareas de encendido y apagado de un horario
+
+    :param horario_id: ID del horario
+    :type horario_id: int
+
+    :return: ID de la tarea de encendido y de la de apagado
+    :rtype: tuple (str, str)
+    """
+    return f"start_vm_horario_{horario_id}", f"stop_vm_horario_{horario_id}"
 
 def schedule_virtual_machine_tasks(asignatura_id, vm_id_batch, schedule_data):
     """
-    Inicializa las tareas de programación de máquinas virtuales para los horarios de una asignatura
+    Programa las tareas de encendido y apagado de las máquinas virtuales para un horario de una asignatura
+
+    Si el horario ya tenía tareas, se reemplazan.
 
     :param asignatura_id: ID de la asignatura
     :type asignatura_id: int
@@ -115,7 +355,7 @@ def schedule_virtual_machine_tasks(asignatura_id, vm_id_batch, schedule_data):
     :param vm_batch: Batch de máquinas virtuales
     :type vm_batch: list
 
-    :param schedule: Horario de las tareas
+    :param schedule: Horario de las tareas, con su ID ("id")
     :type schedule: dict
 
     :raises Exception: Si ocurre un error al programar las tareas
@@ -126,8 +366,9 @@ def schedule_virtual_machine_tasks(asignatura_id, vm_id_batch, schedule_data):
 
     start_time_buffer, end_time_buffer = manage_schedule_times(start_time, end_time)
 
-    start_job_id = f"start_vm_job_{asignatura_id}_{day}_{start_time_buffer.hour}_{start_time_buffer.minute}"
-    end_job_id = f"stop_vm_job_{asignatura_id}_{day}_{end_time_buffer.hour}_{end_time_buffer.minute}"
+    start_job_id, end_job_id = get_horario_job_ids(schedule_data["id"])
+    # Si el proceso estaba parado a la hora de la tarea, se ejecuta al arrancar mientras dure la clase
+    misfire_grace_time = (end_time_buffer - start_time_buffer).seconds
 
     logger.info(f"Programando tareas para la asignatura {asignatura_id} en el día {day} a las {start_time_buffer} y {end_time_buffer}")
 
@@ -139,15 +380,19 @@ def schedule_virtual_machine_tasks(asignatura_id, vm_id_batch, schedule_data):
 
     # Add jobs to the scheduler
     try:
-        # Start job
+        # Start job: los arranques se reparten a lo largo del buffer
         scheduler.add_job(
-            proxmox.batch_start_virtual_machines,
+            start_virtual_machines_before,
             'cron',
             day_of_week=day,
             hour=start_time_buffer.hour,
             minute=start_time_buffer.minute,
-            args=[vm_id_batch],
-            id=start_job_id
+            args=[vm_id_batch, start_time],
+            id=start_job_id,
+            jobstore=PERSISTENT_JOBSTORE,
+            replace_existing=True,
+            coalesce=True,
+            misfire_grace_time=misfire_grace_time # Si todos los hilos están ocupados, se arranca igualmente con retraso
         )
         # End job
         scheduler.add_job(
@@ -157,23 +402,35 @@ def schedule_virtual_machine_tasks(asignatura_id, vm_id_batch, schedule_data):
             hour=end_time_buffer.hour,
             minute=end_time_buffer.minute,
             args=[vm_id_batch],
-            id=end_job_id
+            id=end_job_id,
+            jobstore=PERSISTENT_JOBSTORE,
+            replace_existing=True,
+            coalesce=True,
+            misfire_grace_time=misfire_grace_time
         )
     except Exception as e:
         logger.error(f"Error al programar las tareas: {e}")
         raise e
 
+def unschedule_horario_tasks(horario_id):
+    """Elimina las tareas de encendido y apagado de un horario
+
+    :param horario_id: ID del horario
+    :type horario_id: int
+    """
+    for job_id in get_horario_job_ids(horario_id):
+        __try_remove_job(job_id, jobstore=PERSISTENT_JOBSTORE)
+
 def reschedule_virtual_machines_tasks(asignatura_id):
     """
     Reprograma las tareas de programación de máquinas virtuales para los horarios de una asignatura
 
+    Las tareas de cada horario se reemplazan en el almacén persistente; las de los
+    horarios eliminados se borran al confirmarse su eliminación (ver __horario_deleted).
+
     :param asignatura_id: ID de la asignatura
     :type asignatura_id: int
     """
-    for job in scheduler.get_jobs():
-        if job.id.startswith(f"start_vm_job_{asignatura_id}") or job.id.startswith(f"stop_vm_job_{asignatura_id}"):
-            __try_remove_job(job.id)
-
     # Se obtienen los horarios de las asignaturas
     try:
         horarios = horario_controller.get_all_horarios_by_asignatura(asignatura_id)
@@ -188,13 +445,20 @@ def reschedule_virtual_machines_tasks(asignatura_id):
         logger.error(f"Error al obtener la máquina virtual de la asignatura {asignatura_id}: {e}")
         return
 
-    if not horarios or not virtual_machines:
+    # Lista de IDs de máquinas virtuales sin la máquina base ni los clones de reserva sin asignar,
+    # que no deben encenderse (ni ocupar memoria) hasta que un alumno los reciba
+    clones_list = [
+        vm.proxmox_id for vm in virtual_machines
+        if not vm.is_base_vm and not (vm.is_spare and vm.user_id is None)
+    ]
+    if not clones_list:
+        for horario in horarios:
+            unschedule_horario_tasks(horario.id)
         return
 
-    # Lista de IDs de máquinas virtuales sin la máquina base
-    clones_list = [vm.proxmox_id for vm in virtual_machines if not vm.is_base_vm]
     for horario in horarios:
         schedule_data = {
+            "id": horario.id,
             "day": horario.dia,
             "hora_inicio": horario.hora_inicio,
             "hora_fin": horario.hora_fin
@@ -204,8 +468,123 @@ def reschedule_virtual_machines_tasks(asignatura_id):
         except Exception as e:
             logger.error(f"Error al programar las tareas para la asignatura {asignatura_id}: {e}")
 
+# Los horarios eliminados (directamente o al borrar su asignatura) se apuntan en la sesión
+# y sus tareas se borran solo si la transacción se confirma
+@event.listens_for(Horario, 'after_delete')
+def __horario_deleted(mapper, connection, target):
+    object_session(target).info.setdefault('unscheduled_horarios', set()).add(target.id)
+
+@event.listens_for(Asignatura, 'before_delete')
+def __asignatura_deleted(mapper, connection, target):
+    # Los horarios se borran en cascada en la base de datos (passive_deletes), sin cargarlos
+    horario_ids = connection.execute(select(Horario.id).where(Horario.asignatura_id == target.id)).scalars()
+    object_session(target).info.setdefault('unscheduled_horarios', set()).update(horario_ids)
+
+@event.listens_for(Session, 'after_commit')
+def __unschedule_deleted_horarios(session):
+    for horario_id in session.info.pop('unscheduled_horarios', ()):
+        unschedule_horario_tasks(horario_id)
+
+@event.listens_for(Session, 'after_rollback')
+def __discard_deleted_horarios(session):
+    session.info.pop('unscheduled_horarios', None)
+
+def request_warm_pool_refill(asignatura_id):
+    """
+    Encola un trabajo que repone los clones de reserva de una asignatura si le faltan
+    o si alguno se quedó sin conexión de Guacamole
+
+    No se encola si ya hay un trabajo de reposición pendiente o en curso para la
+    asignatura. Debe llamarse dentro del contexto de la aplicación.
+
+    :param asignatura_id: ID de la asignatura
+    :type asignatura_id: int
+
+    :return: ID del trabajo encolado o None si no hace falta reponer
+    :rtype: int
+    """
+    asignatura = asignatura_controller.get_asignatura_by_id(asignatura_id)
+    if asignatura is None or not asignatura.warm_pool_size:
+        return None
+
+    # Los clones sin conexión de Guacamole cuentan como reserva: la reposición reintenta su conexión
+    spares = virtual_machines_controller.get_unowned_clones(asignatura_id)
+    if len(spares) >= asignatura.warm_pool_size and all(vm.guacamole_connection_id for vm in spares):
+        return None
+
+    refilling = any(
+        job.job_type == 'refill_warm_pool' and (job.params or {}).get('asignatura_id') == asignatura_id
+        for job in job_controller.get_jobs_by_status('pending', 'running')
+    )
+    if refilling:
+        return None
+
+    logger.info(f"Warm pool of subject {asignatura_id} has {len(spares)} of {asignatura.warm_pool_size} spare clones")
+    return jobs.submit_job('refill_warm_pool', asignatura_id=asignatura_id)
+
+def check_warm_pools(app):
+    """Repone los clones de reserva de todas las asignaturas que se estén quedando sin ellos
+
+    :param app: Aplicación de Flask, las tareas del scheduler se ejecutan fuera de su contexto
+    :type app: Flask
+    """
+    with app.app_context():
+        for asignatura in asignatura_controller.get_all_asignaturas():
+            try:
+                request_warm_pool_refill(asignatura.id)
+            except Exception as e:
+                logger.error(f"Error checking the warm pool of subject {asignatura.id}: {e}")
+
+def __warm_pool_tasks():
+    """Comprobación periódica de los clones de reserva"""
+    scheduler.add_job(
+        check_warm_pools,
+        'interval',
+        minutes=Config.FLASK.WARM_POOL_CHECK_INTERVAL,
+        args=[current_app._get_current_object()],
+        id="warm_pool_check",
+        replace_existing=True
+    )
+
+def check_idle_virtual_machines(app):
+    """Pone en reposo los clones inactivos (ver app/idle_detection.py)
+
+    :param app: Aplicación de Flask, las tareas del scheduler se ejecutan fuera de su contexto
+    :type app: Flask
+    """
+    with app.app_context():
+        try:
+            idle_detection.check_idle_virtual_machines()
+        except Exception as e:
+            logger.error(f"Error checking idle VMs: {e}")
+
+def __idle_detection_tasks():
+    """Comprobación periódica de los clones inactivos"""
+    if not idle_detection.is_enabled():
+        return
+
+    scheduler.add_job(
+        check_idle_virtual_machines,
+        'interval',
+        seconds=Config.PROXMOX.IDLE_CHECK_INTERVAL,
+        args=[current_app._get_current_object()],
+        id="idle_vm_check",
+        replace_existing=True,
+        coalesce=True,
+        max_instances=1
+    )
+
 def __virtual_machine_tasks():
-    """Inicializa todos los jobs para todas las asignaturas"""
+    """Inicializa todos los jobs para todas las asignaturas
+
+    Solo hace falta si el almacén persistente está vacío (primer arranque); en el
+    resto de arranques las tareas ya están guardadas y se mantienen al día al
+    modificar los horarios o las máquinas virtuales.
+    """
+    if scheduler.get_jobs(jobstore=PERSISTENT_JOBSTORE):
+        return
+
+    logger.info("Persistent job store is empty, scheduling every subject")
     asignaturas = asignatura_controller.get_all_asignaturas()
     for a in asignaturas:
         reschedule_virtual_machines_tasks(a.id)
@@ -216,17 +595,41 @@ def __orphaned_files_cleanup():
         clean_orphaned_files,
         'interval',
         hours=24,
-        id="orphaned_files_cleanup"
+        id="orphaned_files_cleanup",
+        replace_existing=True
     )
 
 def initialize_tasks():
-    """Inicializa las tareas programadas"""
-    start_scheduler()
+    """Inicializa las tareas programadas
 
-    # Se inicializan las tareas de programación de máquinas virtuales
-    __virtual_machine_tasks()
+    Debe llamarse dentro del contexto de la aplicación.
+    """
+    global _leader
+
+    try:
+        scheduler.add_jobstore(SQLAlchemyJobStore(engine=db.engine, tablename=JOBSTORE_TABLE), PERSISTENT_JOBSTORE)
+    except ValueError:
+        pass # Ya se añadió en una llamada anterior
+
+    # El scheduler arranca en pausa hasta que el proceso sea el líder
+    start_scheduler(paused=True)
 
     # Se inicializa la tarea de limpieza de archivos huérfanos
     __orphaned_files_cleanup()
 
+    # Se inicializa la reposición de los clones de reserva
+    __warm_pool_tasks()
+
+    # Se inicializa el reposo de los clones inactivos
+    __idle_detection_tasks()
+
+    if db.engine.dialect.name != 'mysql':
+        # Sin MySQL no hay bloqueo compartido: se asume un único proceso
+        logger.warning("Scheduler leader election needs MySQL, running the scheduler in this process")
+        __virtual_machine_tasks()
+        scheduler.resume()
+    elif _leader is None:
+        _leader = _SchedulerLeader(current_app._get_current_object(), db.engine, on_elected=__virtual_machine_tasks)
+        _leader.start()
+
     logger.info("\n\nTareas programadas inicializadas\n")